@@ -1,15 +1,39 @@
-from flask import Flask, request, jsonify, send_from_directory, render_template
-from werkzeug.utils import secure_filename
+from flask import Flask, Response, g, request, jsonify, render_template
+from werkzeug.utils import safe_join, secure_filename
 from pathlib import Path
+import hashlib
 import json
 import os
-import shutil
+import threading
+import time
 
 # Import our geometry processors
-from effects.geometry.extractors.pointcloud_processor import extract_points
-import effects.geometry.extractors.lineart_processor as lineart
+from effects.geometry.extractors.edge_store import MissingEdgeMap, image_size
+from effects.geometry.extractors.geometry_format import MIME_TYPE as GEOMETRY_MIME_TYPE, decode_geometry, json_to_binary
+from effects.geometry.extractors.pipeline import (
+    GEOMETRY_TYPES,
+    atlas_path,
+    binary_path,
+    fetch_cached_geometry,
+    geometry_to_json,
+    prepare_edge_maps,
+    preview_geometry,
+    select_geometry_binary,
+    stream_geometry,
+    write_bytes_atomic,
+)
+from effects.geometry.extractors.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, GAUGE, HISTOGRAM, metrics, rss_bytes
+from effects.geometry.extractors.model_registry import registry as model_registry
+from config_index import ConfigIndex
+from jobs import FINISHED, JobQueue, QueueFull
+from static_assets import STATIC_DIRS, asset_url, generate_compressed_geometry, send_static
+from static_assets import assets as static_assets
+from image_derivatives import build_derivatives, load_manifest as load_derivatives
+import profiling
 
 app = Flask(__name__)
+# Content-hashed, immutable URLs for template scripts
+app.jinja_env.globals['asset_url'] = asset_url
 
 # Configure paths
 BASE_DIR = Path(__file__).parent
@@ -42,6 +66,55 @@ NOVELS_DIR.mkdir(parents=True, exist_ok=True)
 SCENE_CONFIGS_DIR.mkdir(parents=True, exist_ok=True)
 NOVEL_CONFIGS_DIR.mkdir(parents=True, exist_ok=True)
 
+# Geometry extraction runs in worker processes, see jobs.py
+job_queue = JobQueue()
+
+# Parsed configs, revalidated by mtime, see config_index.py
+scene_index = ConfigIndex(SCENE_CONFIGS_DIR)
+novel_index = ConfigIndex(NOVELS_DIR)
+
+# Request latency and job, model and memory gauges for /api/metrics
+metrics.describe('pile_http_request_duration_seconds', HISTOGRAM,
+                 'Time to build each response (to the first chunk, for streamed ones).')
+metrics.describe('pile_jobs', GAUGE, 'Background jobs by status.')
+metrics.describe('pile_model_resident_bytes', GAUGE, 'Memory of resident detector models, per process.')
+metrics.describe('pile_model_loads', GAUGE, 'Detector model loads, per process.')
+metrics.describe('pile_process_resident_memory_bytes', GAUGE, 'Resident memory of the server process.')
+
+@metrics.collector
+def collect_gauges():
+    statuses = {}
+    for job in job_queue.list():
+        statuses[job['status']] = statuses.get(job['status'], 0) + 1
+    for status, count in statuses.items():
+        yield 'pile_jobs', {'status': status}, count
+    processes = dict(job_queue.worker_models, server=model_registry.stats())
+    for process, stats in processes.items():
+        yield 'pile_model_resident_bytes', {'process': process}, stats['resident_bytes']
+        for model, loads in stats['loads'].items():
+            yield 'pile_model_loads', {'process': process, 'model': model}, loads
+    rss = rss_bytes()
+    if rss is not None:
+        yield 'pile_process_resident_memory_bytes', {}, rss
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Route templates, not paths, keep the label set small
+        metrics.observe('pile_http_request_duration_seconds', time.perf_counter() - started,
+                        method=request.method,
+                        route=request.url_rule.rule if request.url_rule else 'unmatched',
+                        status=response.status_code)
+    return response
+
+# ?profile=1 samples a request's stack when PILE_PROFILING is set, see profiling.py
+profiling.install(app)
+
 # Configure allowed files
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 
@@ -62,19 +135,19 @@ def serve_index():
 @app.route('/config')
 def serve_tool():
     """Serve the configuration tool"""
-    return send_from_directory('tools', 'config.html')
+    return send_static('tools', 'config.html')
 
 @app.route('/tools/<path:filename>')
 def serve_tool_files(filename):
-    return send_from_directory('tools', filename)
+    return send_static('tools', filename)
 
 @app.route('/core/<path:filename>')
 def serve_core_files(filename):
-    return send_from_directory('core', filename)
+    return send_static('core', filename)
 
 @app.route('/effects/<path:filename>')
 def serve_effects_files(filename):
-    return send_from_directory('effects', filename)
+    return send_static('effects', filename)
 
 # @app.route('/scenes/<path:filename>')
 # def serve_scenes_files(filename):
@@ -82,11 +155,101 @@ def serve_effects_files(filename):
 
 @app.route('/assets/<path:filename>')
 def serve_assets(filename):
-    return send_from_directory('assets', filename)
+    # Derived images live under their source's content hash, see image_derivatives.py
+    return send_static('assets', filename, immutable=filename.startswith('images/derived/'))
+
+@app.route('/api/geometry/<geometry_type>/<path:filename>')
+def serve_geometry(geometry_type, filename):
+    """
+    Serve a geometry file as packed binary or JSON, depending on the Accept
+    header. Binary copies missing for older geometry are built on first use.
+    
+    ``max_segments`` (lineart) or ``max_points`` (pointcloud) caps the number
+    of items sent; the matching precomputed level-of-detail tier is served.
+    """
+    if geometry_type not in GEOMETRY_TYPES:
+        return jsonify({'error': 'Unknown geometry type'}), 404
+    
+    geometry_dir = GEOMETRY_DIR / geometry_type
+    json_path = safe_join(str(geometry_dir), filename)
+    if json_path is None or not os.path.isfile(json_path):
+        return jsonify({'error': 'Geometry not found'}), 404
+    
+    budget_param = 'max_segments' if geometry_type == 'lineart' else 'max_points'
+    max_items = request.args.get(budget_param, type=int)
+    if max_items is not None and max_items < 0:
+        return jsonify({'error': f'{budget_param} must not be negative'}), 400
+    
+    best = request.accept_mimetypes.best_match(['application/json', GEOMETRY_MIME_TYPE])
+    if best == GEOMETRY_MIME_TYPE or max_items is not None:
+        # The pipeline writes both forms; only geometry from before the
+        # binary format lacks one
+        bin_path = binary_path(json_path)
+        if not bin_path.exists():
+            with open(json_path) as f:
+                document = json.load(f)
+            write_bytes_atomic(json_to_binary(document, *geometry_image_size(geometry_type, filename)), bin_path)
+    
+    if best == GEOMETRY_MIME_TYPE:
+        if max_items is None:
+            response = static_assets.send(bin_path, mimetype=GEOMETRY_MIME_TYPE)
+        else:
+            response = static_assets.encode_response(app.response_class(
+                select_geometry_binary(json_path, max_items), mimetype=GEOMETRY_MIME_TYPE))
+    elif max_items is not None:
+        data = select_geometry_binary(json_path, max_items)
+        response = static_assets.encode_response(jsonify(geometry_to_json(decode_geometry(data))))
+    else:
+        response = static_assets.send(json_path, mimetype='application/json')
+    response.vary.add('Accept')
+    return response
+
+def geometry_image_size(geometry_type, filename):
+    """
+    ``(width, height)`` of the image a scene's geometry file was extracted
+    from, or ``(0, 0)`` when no scene with an existing image uses it.
+    """
+    scenes, _ = scene_index.items()
+    for _, scene_data in scenes:
+        image = scene_data.get('image') or {}
+        geometry = image.get('geometry') or {}
+        if geometry.get('type') != geometry_type or geometry.get('data') != filename:
+            continue
+        image_path = safe_join(str(IMAGES_DIR), image.get('path') or '')
+        if image_path is not None and os.path.isfile(image_path):
+            return image_size(image_path)
+    return 0, 0
+
+@app.route('/api/geometry/<geometry_type>/<path:filename>/atlas')
+def serve_geometry_atlas(geometry_type, filename):
+    """
+    The sprite atlas of a lineart geometry file (see sprite_atlas.py), with
+    the URL of each page. 404 unless it was generated with ``atlas_scale``.
+    """
+    if geometry_type != 'lineart':
+        return jsonify({'error': 'Only lineart has sprite atlases'}), 404
+    
+    json_path = safe_join(str(GEOMETRY_DIR / geometry_type), filename)
+    meta_path = atlas_path(json_path) if json_path else None
+    if meta_path is None or not meta_path.is_file():
+        return jsonify({'error': 'Atlas not found'}), 404
+    
+    def build():
+        with open(meta_path) as f:
+            meta = json.load(f)
+        # Page names are relative to the geometry file
+        meta['pages'] = [
+            asset_url(f"assets/geometry/{geometry_type}/{Path(filename).with_name(page).as_posix()}")
+            for page in meta['pages']
+        ]
+        return meta
+    
+    stat = meta_path.stat()
+    return conditional_json(f"{stat.st_mtime_ns}-{stat.st_size}", build)
 
 @app.route('/schemas/<path:filename>')
 def serve_schemas(filename):
-    return send_from_directory('schemas', filename)
+    return send_static('schemas', filename)
 
 @app.route('/scene/<scene_id>')
 def view_scene(scene_id):
@@ -99,76 +262,194 @@ def view_novel(novel_id):
     return render_template('viewer.html', content_type='novel', content_id=novel_id)
 
 
+def conditional_json(etag, build):
+    """
+    JSON response tagged with ``etag``, or 304 Not Modified when the client
+    sent it in If-None-Match. ``build`` makes the payload only when needed.
+    """
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    # Cacheable, but revalidated on every use
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/api/scenes', methods=['GET'])
 def list_scenes():
-    scenes = []
-    for config_file in SCENE_CONFIGS_DIR.glob('*.json'):
-        with open(config_file) as f:
-            scene_data = json.load(f)
-            scenes.append({
-                'id': scene_data['id'],
-                'image': scene_data['image']['path']
-            })
-    return jsonify(scenes)
+    scenes, etag = scene_index.items()
+    return conditional_json(etag, lambda: [
+        {
+            'id': scene_data['id'],
+            'image': scene_data['image']['path']
+        }
+        for _, scene_data in scenes
+    ])
 
 @app.route('/api/scenes/<scene_id>', methods=['GET'])
 def get_scene(scene_id):
-    config_path = SCENE_CONFIGS_DIR / f"{scene_id}.json"  # Use SCENE_CONFIGS_DIR instead
-    if not config_path.exists():
+    found = scene_index.get(scene_id)
+    if found is None:
         return jsonify({'error': 'Scene not found'}), 404
     
-    with open(config_path) as f:
-        return jsonify(json.load(f))
+    scene_data, etag = found
+    return conditional_json(etag, lambda: scene_data)
 
 @app.route('/api/scenes', methods=['POST'])
 def save_scene():
     scene_data = request.json
     scene_id = scene_data['id']
     
-    # Handle geometry processing if needed
-    if 'geometry' in scene_data['image']:
-        image_path = IMAGES_DIR / scene_data['image']['path']
-        geometry_type = scene_data['image']['geometry']['type']
-        
-        # Create geometry subdirectory if it doesn't exist
-        geometry_subdir = GEOMETRY_DIR / geometry_type
-        geometry_subdir.mkdir(exist_ok=True)
-        
-        # Generate geometry data
-        if geometry_type == 'pointcloud':
-            geometry_data = extract_points(
-                str(image_path),
-                num_points=10000,  # Could make these configurable
-                edge_weight=0.8
-            )
-        elif geometry_type == 'lineart':
-            fname = os.path.basename(image_path).split('.')[0]
-            # geometry_data = extract_paths(str(image_path))
-            features, debug_images = lineart.process_image_hierarchical(image_path)
-
-            # Save features
-            print(f"Processed {len(features)} levels")
-            for i, level in enumerate(features):
-                print(f"Level {i} paths: {len(level)}")
-
-            geometry_data = {
-                'levels': features
-            }
-        else:
-            return jsonify({'error': 'Unknown geometry type'}), 400
-        
-        # Save geometry data
-        geometry_path = geometry_subdir / scene_data['image']['geometry']['data']
-        with open(geometry_path, 'w') as f:
-            json.dump(geometry_data, f)
+    geometry = scene_data['image'].get('geometry')
+    if geometry and geometry['type'] not in GEOMETRY_TYPES:
+        return jsonify({'error': 'Unknown geometry type'}), 400
     
     # Save scene config
     config_path = SCENE_CONFIGS_DIR / f"{scene_id}.json"
     with open(config_path, 'w') as f:
         json.dump(scene_data, f, indent=2)
+    scene_index.invalidate(scene_id)
+    
+    # Geometry is extracted in the background; poll /api/jobs/<job_id> for progress
+    if geometry:
+        image_path = IMAGES_DIR / scene_data['image']['path']
+        geometry_path = GEOMETRY_DIR / geometry['type'] / geometry['data']
+        options = geometry.get('options')
+        
+        # Unchanged image and options: reuse the cached geometry
+        cached = fetch_cached_geometry(image_path, geometry['type'], geometry_path, options)
+        if cached:
+            return jsonify({'success': True, 'cached': True})
+        
+        try:
+            job = job_queue.submit(
+                generate_compressed_geometry,
+                str(image_path),
+                geometry['type'],
+                str(geometry_path),
+                options=options,
+                key=str(geometry_path),
+                description=f"{geometry['type']} geometry for scene {scene_id}",
+            )
+        except QueueFull as e:
+            return jsonify({'error': str(e)}), 503
+        return jsonify({'success': True, 'job_id': job['id']}), 202
     
     return jsonify({'success': True})
 
+@app.route('/api/geometry/preview', methods=['POST'])
+def preview_geometry_route():
+    """
+    Re-extract geometry with new post-processing options from the stored
+    detector outputs. If the detectors have not run for this image yet, a job
+    computing them is queued and its id returned; retry once it finishes.
+    """
+    params = request.json
+    geometry_type = params.get('type')
+    if geometry_type not in GEOMETRY_TYPES:
+        return jsonify({'error': 'Unknown geometry type'}), 400
+    
+    image_path = IMAGES_DIR / secure_filename(params.get('image', ''))
+    if not image_path.is_file():
+        return jsonify({'error': 'Image not found'}), 404
+    
+    options = params.get('options')
+    try:
+        geometry_data = preview_geometry(image_path, geometry_type, options)
+    except MissingEdgeMap:
+        try:
+            job = job_queue.submit(
+                prepare_edge_maps,
+                str(image_path),
+                geometry_type,
+                options=options,
+                key=f"edges:{geometry_type}:{image_path}",
+                description=f"{geometry_type} edge maps for {image_path.name}",
+            )
+        except QueueFull as e:
+            return jsonify({'error': str(e)}), 503
+        return jsonify({'job_id': job['id']}), 202
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'geometry': geometry_data})
+
+@app.route('/api/geometry/stream', methods=['POST'])
+def stream_geometry_route():
+    """
+    Extract geometry with the given options (no file is written) and stream
+    each level as an NDJSON line as soon as it is done, so the editor can
+    draw level 0 long before the last level. Takes the same body as
+    /api/geometry/preview; runs the detectors if they have not run yet.
+    """
+    params = request.json
+    geometry_type = params.get('type')
+    if geometry_type not in GEOMETRY_TYPES:
+        return jsonify({'error': 'Unknown geometry type'}), 400
+    
+    image_path = IMAGES_DIR / secure_filename(params.get('image', ''))
+    if not image_path.is_file():
+        return jsonify({'error': 'Image not found'}), 404
+    
+    try:
+        job = job_queue.submit(
+            stream_geometry,
+            str(image_path),
+            geometry_type,
+            options=params.get('options'),
+            key=f"stream:{geometry_type}:{image_path}",
+            description=f"{geometry_type} preview of {image_path.name}",
+            stream=True,
+        )
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    return ndjson_stream(job)
+
+def ndjson_stream(job):
+    """
+    A job's streamed output as NDJSON: a ``job`` line, one line per chunk,
+    then a ``done`` line with the result or an ``error`` line.
+    """
+    def generate():
+        yield json.dumps({'event': 'job', 'job_id': job['id']}) + '\n'
+        for chunk in job_queue.iter_output(job['id']):
+            yield json.dumps(chunk) + '\n'
+        finished = job_queue.get(job['id'])
+        if finished is not None and finished['status'] == FINISHED:
+            yield json.dumps({'event': 'done', 'result': finished['result']}) + '\n'
+        else:
+            yield json.dumps({
+                'event': 'error',
+                'status': finished and finished['status'],
+                'error': finished and finished['error'],
+            }) + '\n'
+    
+    response = Response(generate(), mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop proxies from holding lines back until the end
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify(job_queue.list())
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/stream', methods=['GET'])
+def stream_job(job_id):
+    """The output of a job submitted with ``stream=True``, as NDJSON (see ndjson_stream)."""
+    job = job_queue.get(job_id)
+    if job is None or not job['stream']:
+        return jsonify({'error': 'Job not found'}), 404
+    return ndjson_stream(job)
+
 @app.route('/api/upload-image', methods=['POST'])
 def upload_image():
     if 'image' not in request.files:
@@ -185,14 +466,51 @@ def upload_image():
         # Save the file
         file.save(str(save_path))
         
-        # Return the filename
-        return jsonify({
-            'success': True,
-            'filename': filename
-        })
+        # Resized tiers and deep-zoom tiles are built in the background
+        response = {'success': True, 'filename': filename}
+        try:
+            job = queue_derivatives(save_path)
+            response['job_id'] = job['id']
+        except QueueFull:
+            # Build later with POST /api/images/<filename>/derivatives
+            pass
+        return jsonify(response)
     
     return jsonify({'error': 'Invalid file type'}), 400
 
+def queue_derivatives(image_path):
+    return job_queue.submit(
+        build_derivatives,
+        str(image_path),
+        key=f"derivatives:{image_path.name}",
+        description=f"derivatives of {image_path.name}",
+    )
+
+@app.route('/api/images/<path:filename>/derivatives', methods=['GET', 'POST'])
+def image_derivatives(filename):
+    """
+    The manifest of an image's resized tiers and tile pyramid (GET), or
+    queue building them (POST).
+    """
+    image_path = safe_join(str(IMAGES_DIR), filename)
+    if image_path is None or not os.path.isfile(image_path) or not allowed_file(filename):
+        return jsonify({'error': 'Image not found'}), 404
+    image_path = Path(image_path)
+    
+    manifest = load_derivatives(image_path)
+    if request.method == 'GET':
+        if manifest is None:
+            return jsonify({'error': 'Derivatives not built'}), 404
+        return conditional_json(static_assets.digest(image_path), lambda: manifest)
+    
+    if manifest is not None:
+        return jsonify({'success': True, 'cached': True})
+    try:
+        job = queue_derivatives(image_path)
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify({'success': True, 'job_id': job['id']}), 202
+
 @app.route('/api/geometry-types', methods=['GET'])
 def get_geometry_types():
     """Return available geometry types and their options"""
@@ -207,20 +525,75 @@ def get_geometry_types():
                     'min': 1000,
                     'max': 50000
                 },
-                'edge_weight': {
+                'detect_resolution': {
                     'type': 'number',
-                    'default': 0.8,
+                    'default': 512,
+                    'min': 256,
+                    'max': 4096
+                },
+                'sampling': {
+                    'type': 'select',
+                    'default': 'weighted',
+                    'choices': ['weighted', 'poisson']
+                },
+                'seed': {
+                    'type': 'number',
+                    'default': 0,
                     'min': 0,
-                    'max': 1
+                    'max': 1000000
                 }
             }
         },
         'lineart': {
             'name': 'Line Art',
-            'description': 'Extracts vector lines from image'
+            'description': 'Extracts vector lines from image',
+            'options': {
+                'threshold': {
+                    'type': 'number',
+                    'default': 0.3,
+                    'min': 0,
+                    'max': 1
+                },
+                'min_length': {
+                    'type': 'number',
+                    'default': 10,
+                    'min': 0,
+                    'max': 100
+                },
+                'level_source': {
+                    'type': 'select',
+                    'default': 'detect',
+                    'choices': ['detect', 'derive']
+                },
+                'atlas_scale': {
+                    'type': 'number',
+                    'default': 0,
+                    'min': 0,
+                    'max': 2
+                }
+            }
         }
     })
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Stage timings, request latency, job and memory metrics in Prometheus text format"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/api/profiles/<path:filename>', methods=['GET'])
+def get_profile(filename):
+    """A request profile written by profiling.py, in collapsed-stack format"""
+    return send_static(profiling.PROFILE_DIR, filename, mimetype='text/plain')
+
+@app.route('/api/models', methods=['GET'])
+def get_model_stats():
+    """Report resident detectors and their load/hit/eviction counts"""
+    return jsonify({
+        'server': model_registry.stats(),
+        # Extraction runs in job workers, each with its own registry
+        'workers': job_queue.worker_models,
+    })
+
 ### Novel Code:
 # @app.route('/novel/<novel_id>')
 # def view_novel(novel_id):
@@ -229,20 +602,86 @@ def get_geometry_types():
 
 @app.route('/api/novels', methods=['GET'])
 def list_novels():
-    novels = []
-    for config_file in NOVELS_DIR.glob('*.json'):
-        with open(config_file) as f:
-            novels.append(json.load(f))
-    return jsonify(novels)
+    novels, etag = novel_index.items()
+    return conditional_json(etag, lambda: [novel_data for _, novel_data in novels])
 
 @app.route('/api/novels/<novel_id>', methods=['GET'])
 def get_novel(novel_id):
-    novel_path = NOVELS_DIR / f"{novel_id}.json"
-    if not novel_path.exists():
+    found = novel_index.get(novel_id)
+    if found is None:
         return jsonify({'error': 'Novel not found'}), 404
     
-    with open(novel_path) as f:
-        return jsonify(json.load(f))
+    novel_data, etag = found
+    return conditional_json(etag, lambda: novel_data)
+
+def scene_assets(scene_data, stamps):
+    """
+    URLs and byte sizes of a scene's image and geometry (None when missing).
+    Each file's mtime and size is appended to ``stamps`` for tagging.
+    """
+    def size(directory, relative):
+        path = safe_join(str(directory), relative) if relative else None
+        try:
+            stat = os.stat(path) if path else None
+        except FileNotFoundError:
+            stat = None
+        if stat is None:
+            return None
+        stamps.append(f"{path}:{stat.st_mtime_ns}:{stat.st_size}")
+        return stat.st_size
+    
+    image = scene_data.get('image') or {}
+    image_bytes = size(IMAGES_DIR, image.get('path'))
+    assets = {'image': None}
+    if image_bytes is not None:
+        # Resized tiers and deep-zoom tiles, once built
+        derivatives = load_derivatives(IMAGES_DIR / image['path'])
+        stamps.append(f"{image['path']}:derivatives:{derivatives is not None}")
+        assets['image'] = {
+            'url': asset_url(f"assets/images/{image['path']}"),
+            'bytes': image_bytes,
+            'derivatives': derivatives,
+        }
+    geometry = image.get('geometry')
+    if geometry and geometry.get('type') in GEOMETRY_TYPES:
+        geometry_dir = GEOMETRY_DIR / geometry['type']
+        json_bytes = size(geometry_dir, geometry.get('data'))
+        assets['geometry'] = None if json_bytes is None else {
+            'url': f"/api/geometry/{geometry['type']}/{geometry['data']}",
+            'bytes': json_bytes,
+            # The packed form, when built; see geometry_format.py
+            'binary_bytes': size(geometry_dir, str(binary_path(geometry['data']))),
+        }
+    return assets
+
+@app.route('/api/novels/<novel_id>/bundle', methods=['GET'])
+def get_novel_bundle(novel_id):
+    """The novel, its scene configs and a manifest of their assets in one response"""
+    found = novel_index.get(novel_id)
+    if found is None:
+        return jsonify({'error': 'Novel not found'}), 404
+    
+    novel_data, novel_etag = found
+    scenes = {}
+    assets = {}
+    missing = []
+    stamps = [novel_etag]
+    for scene_id in novel_data.get('scenes', []):
+        scene = scene_index.get(scene_id)
+        if scene is None:
+            missing.append(scene_id)
+            continue
+        scenes[scene_id], scene_etag = scene
+        stamps.append(scene_etag)
+        assets[scene_id] = scene_assets(scenes[scene_id], stamps)
+    
+    etag = hashlib.sha1('|'.join(stamps).encode()).hexdigest()[:20]
+    return conditional_json(etag, lambda: {
+        'novel': novel_data,
+        'scenes': scenes,
+        'assets': assets,
+        'missing': missing,
+    })
 
 @app.route('/api/novels', methods=['POST'])
 def save_novel():
@@ -251,6 +690,7 @@ def save_novel():
     
     with open(novel_path, 'w') as f:
         json.dump(novel_data, f, indent=2)
+    novel_index.invalidate(novel_data['id'])
     
     return jsonify({'success': True})
 
@@ -263,5 +703,27 @@ def not_found(error):
 def server_error(error):
     return jsonify({'error': 'Server error'}), 500
 
+def warm_models():
+    """Load detectors in the job workers when PILE_WARM_MODELS is set"""
+    names = os.environ.get('PILE_WARM_MODELS')
+    if not names:
+        return
+    if names in ('1', 'all'):
+        job_queue.warm()
+    else:
+        job_queue.warm([name.strip() for name in names.split(',')])
+
+def precompress_static():
+    """Build compressed copies of the static files in the background"""
+    def run():
+        built = static_assets.precompress_tree([BASE_DIR / directory for directory in STATIC_DIRS])
+        if built:
+            print(f"Precompressed {built} static file copies")
+    threading.Thread(target=run, name='precompress-static', daemon=True).start()
+
 if __name__ == '__main__':
+    # With debug=True the reloader parent never serves requests; only warm the child
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        warm_models()
+        precompress_static()
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,101 @@
+"""
+Benchmark batched lineart inference against the per-level detector loop
+``process_image_hierarchical`` used to run, and check the maps agree.
+
+    python -m benchmarks.bench_batched_inference [--images a.png b.jpg] [--copies 4]
+        [--resolutions 512 768 1024] [--threads N] [--random-weights]
+
+``--copies`` repeats each image, as bulk precomputation of same-sized pages
+would. ``--random-weights`` builds the detector with untrained weights (same
+architecture, so the same cost) for machines without the model download.
+"""
+import argparse
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from controlnet_aux.util import HWC3
+
+from effects.geometry.extractors.batched_inference import configure_threads, lineart_batch
+from effects.geometry.extractors.lineart_processor import RESOLUTIONS
+from effects.geometry.extractors.model_registry import get_model, registry
+
+DEFAULT_IMAGES = [Path(__file__).resolve().parents[1] / 'assets' / 'images' / 'pile1.jpg']
+
+
+def _random_lineart():
+    import torch
+    from controlnet_aux.lineart import Generator, LineartDetector
+    torch.manual_seed(0)
+    return LineartDetector(Generator(3, 1, 3).eval(), Generator(3, 1, 3).eval())
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def detector_map(image, resolution):
+    """The previous path: ``LineartDetector.__call__`` at one resolution."""
+    detected = np.array(get_model('lineart')(image, detect_resolution=resolution, image_resolution=resolution))
+    return cv2.cvtColor(detected, cv2.COLOR_RGB2GRAY)
+
+
+def loop_maps(images, resolutions):
+    """One detector call per image and resolution."""
+    return [{res: detector_map(image, res) for res in resolutions} for image in images]
+
+
+def agreement(a, b, threshold=0.3):
+    """Share of pixels on the same side of the extraction threshold."""
+    level = int(threshold * 255)
+    return float(np.mean((a > level) == (b > level)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--images', nargs='+', default=[str(path) for path in DEFAULT_IMAGES])
+    parser.add_argument('--copies', type=int, default=1)
+    parser.add_argument('--resolutions', type=int, nargs='+', default=RESOLUTIONS)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--random-weights', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.random_weights:
+        registry.register('lineart', _random_lineart)
+    threads = configure_threads(args.threads)
+    get_model('lineart')
+
+    images = [HWC3(cv2.imread(path)) for path in args.images for _ in range(args.copies)]
+    batch = lineart_batch()
+    # One untimed pass each so allocator and kernel selection are warm
+    loop_maps(images[:1], args.resolutions[:1])
+    batch.edge_maps(images[:1], args.resolutions[:1])
+
+    loop_time, reference = timed(lambda: loop_maps(images, args.resolutions))
+    batched_time, batched = timed(lambda: batch.edge_maps(images, args.resolutions))
+    derived_time, derived = timed(lambda: batch.edge_maps(images, args.resolutions, level_source='derive'))
+
+    for expected, maps in zip(reference, batched):
+        for res in args.resolutions:
+            assert maps[res].shape == expected[res].shape, f'{res}: shape differs from the detector'
+    max_diff = max(
+        int(np.abs(maps[res].astype(np.int16) - expected[res]).max())
+        for expected, maps in zip(reference, batched) for res in args.resolutions
+    )
+
+    shapes = ', '.join(f"{image.shape[1]}x{image.shape[0]}" for image in images[::args.copies])
+    print(f"{len(images)} images ({shapes}), levels {args.resolutions}, {threads} torch threads")
+    print(f"  detector loop:      {loop_time:8.2f} s")
+    print(f"  batched:            {batched_time:8.2f} s  ({loop_time / batched_time:.2f}x), "
+          f"max pixel difference {max_diff}")
+    print(f"  derived levels:     {derived_time:8.2f} s  ({loop_time / derived_time:.2f}x)")
+    for res in args.resolutions:
+        agree = np.mean([agreement(maps[res], expected[res]) for expected, maps in zip(reference, derived)])
+        print(f"    level {res}: {agree * 100:.1f}% of pixels agree with detection at {res}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark the vectorized ``extract_paths`` against the original per-component
+implementation on synthetic line art, and check both produce identical output.
+
+    python -m benchmarks.bench_extract_paths [--size 1024] [--strokes 400] [--repeat 5]
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from effects.geometry.extractors.lineart_processor import extract_paths, extract_segments
+
+
+def legacy_extract_paths(image, threshold=0.2, min_length=20, scale_x=1.0, scale_y=1.0):
+    """The original implementation, kept here as the reference."""
+    image = image.astype(np.uint8)
+    _, binary = cv2.threshold(image, int(threshold * 255), 255, cv2.THRESH_BINARY)
+    min_area = 50
+    nb_components, output, stats, centroids = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    sizes = stats[1:, -1]
+    nb_components = nb_components - 1
+    cleaned_binary = np.zeros((output.shape))
+    for i in range(0, nb_components):
+        if sizes[i] >= min_area:
+            cleaned_binary[output == i + 1] = 255
+    cleaned_binary = cleaned_binary.astype(np.uint8)
+    contours, _ = cv2.findContours(cleaned_binary, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+    paths = []
+    for contour in contours:
+        if cv2.arcLength(contour, False) > min_length:
+            approx = cv2.approxPolyDP(contour, 2.0, False)
+            for i in range(len(approx) - 1):
+                start = approx[i][0]
+                end = approx[i + 1][0]
+                paths.append({
+                    'start': {'x': float(start[0] * scale_x), 'y': float(start[1] * scale_y)},
+                    'end': {'x': float(end[0] * scale_x), 'y': float(end[1] * scale_y)},
+                })
+    return paths
+
+
+def synthetic_line_art(size, strokes, specks, seed=0):
+    """White strokes on black plus small specks that the component filter removes."""
+    rng = np.random.default_rng(seed)
+    image = np.zeros((size, size), dtype=np.uint8)
+    for _ in range(strokes):
+        # Short strokes (like hatching) give many separate components
+        origin = rng.integers(0, size, size=2)
+        steps = rng.integers(-40, 41, size=(rng.integers(2, 6), 2))
+        points = np.clip(origin + np.cumsum(steps, axis=0), 0, size - 1).astype(np.int32)[:, None, :]
+        cv2.polylines(image, [points], False, int(rng.integers(120, 256)), int(rng.integers(1, 4)))
+    for x, y in rng.integers(0, size, size=(specks, 2)):
+        cv2.circle(image, (int(x), int(y)), 1, 255, -1)
+    return image
+
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--strokes', type=int, default=1500)
+    parser.add_argument('--specks', type=int, default=3000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    image = synthetic_line_art(args.size, args.strokes, args.specks)
+    kwargs = dict(threshold=0.3, min_length=20, scale_x=1.7, scale_y=1.3)
+
+    legacy_time, legacy = best_of(lambda: legacy_extract_paths(image, **kwargs), args.repeat)
+    dicts_time, paths = best_of(lambda: extract_paths(image, **kwargs), args.repeat)
+    array_time, segments = best_of(lambda: extract_segments(image, **kwargs), args.repeat)
+
+    assert paths == legacy, 'vectorized extract_paths output differs from the reference'
+
+    print(f"{args.size}px, {len(legacy)} segments")
+    print(f"  legacy extract_paths:     {legacy_time * 1000:8.1f} ms")
+    print(f"  extract_paths (dicts):    {dicts_time * 1000:8.1f} ms  ({legacy_time / dicts_time:.1f}x)")
+    print(f"  extract_segments (array): {array_time * 1000:8.1f} ms  ({legacy_time / array_time:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Measure how long importing the app takes and how much memory it holds, as a
+web worker sees it at boot.
+
+    python -m benchmarks.bench_startup [--module app] [--runs 5]
+
+Each run imports ``--module`` in a fresh interpreter and reports the import
+time, the resident memory afterwards and which of the heavy extraction
+dependencies got loaded. The detector stack (torch, controlnet_aux) is only
+imported where a network runs, so serving configs, assets and stored
+geometry never loads it; the run fails if the module pulls it in.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+
+HEAVY_MODULES = ('torch', 'controlnet_aux', 'timm', 'scipy', 'cv2', 'numpy', 'PIL')
+# Must stay out of web processes
+DETECTOR_MODULES = ('torch', 'controlnet_aux')
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+rss = [int(line.split()[1]) * 1024 for line in open('/proc/self/status') if line.startswith('VmRSS')]
+print(json.dumps({{'seconds': seconds, 'rss_bytes': rss[0] if rss else None,
+                  'loaded': [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def measure(module):
+    """Import time, resident memory and heavy modules of one fresh import of ``module``."""
+    result = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                            cwd=BASE_DIR, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure app import time and memory')
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    seconds = [run['seconds'] for run in runs]
+    rss = [run['rss_bytes'] for run in runs if run['rss_bytes']]
+    loaded = runs[-1]['loaded']
+    print(f"import {args.module}: median {statistics.median(seconds):.2f}s "
+          f"(min {min(seconds):.2f}s, max {max(seconds):.2f}s) over {len(runs)} runs")
+    if rss:
+        print(f"resident memory: {statistics.median(rss) / 2**20:.0f} MB")
+    print(f"loaded: {', '.join(loaded) or 'none of ' + ', '.join(HEAVY_MODULES)}")
+
+    detectors = [name for name in DETECTOR_MODULES if name in loaded]
+    if detectors:
+        print(f"{args.module} imports the detector stack ({', '.join(detectors)}) at load")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
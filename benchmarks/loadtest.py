@@ -0,0 +1,390 @@
+"""
+HTTP load test: simulated novel readers and scene editors against a local server.
+
+    python -m benchmarks.loadtest [--users 50] [--editor-ratio 0.1] [--duration 30]
+        [--workers 1] [--threads 8] [--dev] [--url http://host:port] [--json results.json]
+
+Viewers read novels the way the viewer does: the novel list, a novel, then
+for each of its scenes the scene config, the image and (for scenes with
+geometry) the packed geometry, keeping ETags so repeat fetches revalidate.
+With ``--bundle`` they load ``/api/novels/<id>/bundle`` instead of each
+config. Editors fetch a scene, save a copy of it under their own
+``loadtest-<n>`` id, poll the save job until it is done and pause
+``--editor-think`` seconds. ``--editor-ratio`` is the share of users that
+are editors. Job polls open a new connection each, as a browser's spread
+over its connection pool, so with several workers they reach workers other
+than the one that queued the job; those 404s count as errors.
+
+Unless ``--url`` is given, the harness starts the app with serve.py (gunicorn
+with ``--workers`` processes of ``--threads`` threads, or Werkzeug's threaded
+dev server with ``--dev``) and stops it afterwards. That server runs
+``stub_app``: geometry extraction is replaced by ``stub_geometry``, which
+waits ``PILE_LOADTEST_EXTRACTION_SECONDS`` (default 0.2) and writes nothing,
+so saves exercise the job queue without running detectors. Against a
+``--url`` server, editors' saves run real extraction.
+
+Reported per route: requests, throughput, errors, latency percentiles and
+status codes. Geometry requests 404 for scenes whose geometry has not been
+generated in this checkout. The client runs on the same machine, so leave it some cores.
+The scene configs editors saved are removed at the end.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.parse import quote, urlsplit
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+SCENE_CONFIGS_DIR = BASE_DIR / 'scenes' / 'configs'
+EDITOR_PREFIX = 'loadtest-'
+
+GEOMETRY_MIME_TYPE = 'application/vnd.pile.geometry'
+# jobs.DONE_STATES, without importing the app into the client
+JOB_DONE_STATES = ('finished', 'failed', 'superseded')
+PERCENTILES = (50, 90, 99)
+
+
+def stub_geometry(image_path, geometry_type, output_path, options=None, on_progress=None, on_output=None):
+    """Stands in for ``generate_compressed_geometry``: a fixed delay, no detectors, no files."""
+    delay = float(os.environ.get('PILE_LOADTEST_EXTRACTION_SECONDS', 0.2))
+    time.sleep(delay)
+    if on_progress:
+        on_progress(stage='level', level=0, levels_done=1, levels_total=1)
+    if on_output:
+        on_output(event='level', level=0, levels_total=1, paths=[])
+    return {'geometry_path': str(output_path), 'counts': [0], 'lod_counts': [], 'cached': False}
+
+
+def stub_app():
+    """The app with geometry extraction stubbed out (``serve.py --app benchmarks.loadtest:stub_app()``)."""
+    import app
+    app.generate_compressed_geometry = stub_geometry
+    return app.app
+
+
+class RouteStats:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+
+    def add(self, seconds, status):
+        self.latencies.append(seconds)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if not isinstance(status, int) or status >= 400:
+            self.errors += 1
+
+    def merge(self, other):
+        self.latencies += other.latencies
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        self.errors += other.errors
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(p / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Client:
+    """One simulated user's keep-alive connection, ETag cache and per-route stats."""
+
+    def __init__(self, base_url, use_cache=True, timeout=60):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.timeout = timeout
+        self.use_cache = use_cache
+        self.connection = None
+        self.etags = {}
+        self.stats = {}
+
+    def request(self, method, path, route, body=None, headers=None, new_connection=False):
+        """
+        Send a request and read the whole response; returns ``(status, body)``.
+        ``new_connection`` sends it on a fresh connection instead of the kept-alive one.
+        """
+        if new_connection:
+            self.close()
+            self.connection = None
+        headers = dict(headers or {})
+        if method == 'GET' and self.use_cache and path in self.etags:
+            headers['If-None-Match'] = self.etags[path]
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+
+        start = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException) as e:
+            # The server closed a kept-alive connection, or failed; start over next time
+            self.connection.close()
+            self.connection = None
+            status, data = type(e).__name__, b''
+        self.stats.setdefault(route, RouteStats()).add(time.perf_counter() - start, status)
+
+        if status == 200 and method == 'GET':
+            etag = response.getheader('ETag')
+            if etag:
+                self.etags[path] = etag
+        return status, data
+
+    def get_json(self, path, route, new_connection=False):
+        status, data = self.request('GET', path, route, new_connection=new_connection)
+        if status == 200:
+            return json.loads(data)
+        return None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+def run_viewer(client, stop, args, rng):
+    cached = {}
+
+    def fetch_json(path, route):
+        # A 304 means the copy from an earlier read is current
+        data = client.get_json(path, route)
+        if data is not None:
+            cached[path] = data
+        return cached.get(path)
+
+    while not stop.is_set():
+        novels = fetch_json('/api/novels', '/api/novels')
+        if not novels:
+            time.sleep(1)
+            continue
+        novel_id = rng.choice(novels)['id']
+        if args.bundle:
+            bundle = fetch_json(f"/api/novels/{quote(novel_id)}/bundle", '/api/novels/<id>/bundle')
+            scenes = [bundle['scenes'].get(scene_id) for scene_id in bundle['novel']['scenes']] if bundle else []
+        else:
+            novel = fetch_json(f"/api/novels/{quote(novel_id)}", '/api/novels/<id>')
+            scenes = [
+                fetch_json(f"/api/scenes/{quote(scene_id)}", '/api/scenes/<id>')
+                for scene_id in (novel or {}).get('scenes', [])
+            ]
+        for scene in scenes:
+            if stop.is_set():
+                break
+            if not scene:
+                continue
+            client.request('GET', f"/assets/images/{quote(scene['image']['path'])}", '/assets/images/<file>')
+            geometry = scene['image'].get('geometry')
+            if geometry:
+                client.request('GET', f"/api/geometry/{geometry['type']}/{quote(geometry['data'])}",
+                               '/api/geometry/<type>/<file>', headers={'Accept': GEOMETRY_MIME_TYPE})
+            if args.think:
+                stop.wait(rng.uniform(0, 2 * args.think))
+
+
+def run_editor(client, stop, args, rng, index):
+    scene_id = f"{EDITOR_PREFIX}{index}"
+    while not stop.is_set():
+        scenes = client.get_json('/api/scenes', '/api/scenes') or []
+        templates = [scene for scene in scenes if not scene['id'].startswith(EDITOR_PREFIX)]
+        if not templates:
+            stop.wait(1)
+            continue
+        template = client.get_json(f"/api/scenes/{quote(rng.choice(templates)['id'])}", '/api/scenes/<id>')
+        if template:
+            scene = dict(template, id=scene_id)
+            geometry = scene['image'].get('geometry')
+            if geometry:
+                # Never overwrite a real scene's geometry
+                scene['image'] = dict(scene['image'], geometry=dict(geometry, data=f"{scene_id}.json"))
+            status, data = client.request('POST', '/api/scenes', '/api/scenes [POST]', body=scene)
+            if status == 202:
+                poll_job(client, stop, json.loads(data)['job_id'], args.job_poll)
+        stop.wait(rng.uniform(0, 2 * args.editor_think))
+
+
+def poll_job(client, stop, job_id, interval):
+    """Poll a save job, as the editor does, until it is done or lost."""
+    while not stop.is_set():
+        job = client.get_json(f"/api/jobs/{quote(job_id)}", '/api/jobs/<id>', new_connection=True)
+        if job is None or job['status'] in JOB_DONE_STATES:
+            return
+        stop.wait(interval)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args):
+    """Launch serve.py with the stubbed app; returns ``(process, base_url, log_path)``."""
+    port = free_port()
+    command = [sys.executable, str(BASE_DIR / 'serve.py'), '--app', 'benchmarks.loadtest:stub_app()',
+               '--bind', f"127.0.0.1:{port}"]
+    if args.dev:
+        command.append('--dev')
+    else:
+        command += ['--workers', str(args.workers), '--threads', str(args.threads)]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(BASE_DIR), os.environ.get('PYTHONPATH')])))
+    env.setdefault('PILE_EXTRACTION_WORKERS', '1')
+    log = tempfile.NamedTemporaryFile('w', prefix='pile-loadtest-', suffix='.log', delete=False)
+    process = subprocess.Popen(command, cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+                               start_new_session=True)
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/api/novels')
+            if connection.getresponse().status == 200:
+                return process, base_url, log.name
+        except OSError:
+            pass
+        time.sleep(0.5)
+    stop_server(process)
+    sys.exit(f"The server did not start; see {log.name}")
+
+
+def stop_server(process):
+    # The whole session: gunicorn's workers and their extraction processes
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=30)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+def report(stats, elapsed, args, label):
+    """Print the per-route table; returns the results as a dict."""
+    routes = {}
+    total = RouteStats()
+    for route, route_stats in sorted(stats.items()):
+        total.merge(route_stats)
+        routes[route] = summarize(route_stats, elapsed)
+    overall = summarize(total, elapsed)
+
+    print(f"\n{label}: {args.users} users ({args.editors} editors), {elapsed:.1f}s")
+    header = f"{'route':32s} {'requests':>9s} {'req/s':>8s} {'errors':>7s}" + \
+        ''.join(f" {'p' + str(p):>8s}" for p in PERCENTILES) + f" {'max':>8s}  statuses"
+    print(header)
+    for route, row in list(routes.items()) + [('all', overall)]:
+        print(f"{route:32s} {row['requests']:9d} {row['throughput']:8.1f} {row['errors']:7d}" +
+              ''.join(f" {row['latency_ms'][f'p{p}']:8.1f}" for p in PERCENTILES) +
+              f" {row['latency_ms']['max']:8.1f}  " +
+              ' '.join(f"{status}:{count}" for status, count in sorted(row['statuses'].items(), key=str)))
+    print('(latencies in ms)')
+    return {'label': label, 'elapsed': elapsed, 'users': args.users, 'editors': args.editors,
+            'routes': routes, 'overall': overall}
+
+
+def summarize(route_stats, elapsed):
+    latencies = sorted(route_stats.latencies)
+    latency_ms = {f"p{p}": percentile(latencies, p) * 1000 for p in PERCENTILES}
+    latency_ms['max'] = latencies[-1] * 1000 if latencies else 0.0
+    latency_ms['mean'] = sum(latencies) / len(latencies) * 1000 if latencies else 0.0
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'errors': route_stats.errors,
+        'statuses': {str(status): count for status, count in route_stats.statuses.items()},
+        'latency_ms': latency_ms,
+    }
+
+
+def remove_editor_scenes():
+    for path in SCENE_CONFIGS_DIR.glob(f"{EDITOR_PREFIX}*.json"):
+        path.unlink(missing_ok=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=50, help='Simulated users')
+    parser.add_argument('--editor-ratio', type=float, default=0.1, help='Share of users that edit scenes')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+    parser.add_argument('--ramp-up', type=float, default=5, help='Seconds over which users start')
+    parser.add_argument('--think', type=float, default=0.5, help="Viewers' mean pause between scenes (s)")
+    parser.add_argument('--editor-think', type=float, default=2.0, help="Editors' mean pause between saves (s)")
+    parser.add_argument('--bundle', action='store_true', help='Viewers load novel bundles')
+    parser.add_argument('--no-cache', action='store_true', help='Never revalidate with ETags')
+    parser.add_argument('--url', default=None, help='Test a running server instead of starting one')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='Threads per gunicorn worker')
+    parser.add_argument('--job-poll', type=float, default=0.25, help="Editors' save job poll interval (s)")
+    parser.add_argument('--dev', action='store_true', help="Start Werkzeug's threaded server instead")
+    parser.add_argument('--startup-timeout', type=float, default=180)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', type=Path, default=None, help='Write the results to this file')
+    args = parser.parse_args(argv)
+    args.editors = round(args.users * args.editor_ratio)
+
+    process = None
+    if args.url:
+        base_url, label = args.url.rstrip('/'), args.url
+    else:
+        process, base_url, log_path = start_server(args)
+        label = 'dev server' if args.dev else f"gunicorn, {args.workers} workers x {args.threads} threads"
+        print(f"Started {label} at {base_url} (log: {log_path})")
+
+    stop = threading.Event()
+    clients = []
+    threads = []
+    try:
+        for index in range(args.users):
+            client = Client(base_url, use_cache=not args.no_cache)
+            rng = random.Random(args.seed * 100003 + index)
+            if index < args.editors:
+                target, extra = run_editor, (index,)
+            else:
+                target, extra = run_viewer, ()
+            clients.append(client)
+            threads.append(threading.Thread(target=target, args=(client, stop, args, rng) + extra, daemon=True))
+
+        start = time.perf_counter()
+        for index, thread in enumerate(threads):
+            thread.start()
+            if args.ramp_up and index < len(threads) - 1:
+                time.sleep(args.ramp_up / len(threads))
+        stop.wait(max(0, args.duration - (time.perf_counter() - start)))
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=60)
+        elapsed = time.perf_counter() - start
+    finally:
+        stop.set()
+        for client in clients:
+            client.close()
+        if process is not None:
+            stop_server(process)
+        remove_editor_scenes()
+
+    stats = {}
+    for client in clients:
+        for route, route_stats in client.stats.items():
+            stats.setdefault(route, RouteStats()).merge(route_stats)
+    results = report(stats, elapsed, args, label)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+"""
+Offline benchmark suite for the extraction pipeline, with regression checks.
+
+    python -m benchmarks.suite [--filter extract_paths] [--repeat 5] [--quick]
+        [--baseline benchmarks/baseline.json] [--tolerance 0.25] [--save-baseline]
+        [--output results.json]
+
+No network or model download is needed: a deterministic ``StubDetector``
+draws synthetic edge maps (seeded strokes, at several edge densities) in
+place of the lineart and HED networks. Each case is timed over ``--repeat``
+runs after a warm-up, for every image size and density:
+
+``extract_paths``       contours to segment dicts, from a lineart map
+``sample_points``       the sampling half of ``extract_points``, from a HED map
+``process_raster``      ``process_raster.process_image`` on a synthetic photo
+``json_paths``          JSON serialization of ``extract_paths`` output
+``json_points``         JSON serialization of sampled points
+``extract_geometry``    the full lineart pipeline (three levels, merging,
+                        LOD tiers) with the stub behind the batched inference
+
+Results are compared with the baseline file: a case whose best time is more
+than ``--tolerance`` (a fraction) slower fails the run. ``--save-baseline``
+records the current results as the new baseline instead. Timings depend on
+the machine; the baseline records where it was taken and a warning is
+printed when it differs from the current one.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import process_raster
+from effects.geometry.extractors.batched_inference import lineart_batch
+from effects.geometry.extractors.edge_store import EdgeMapStore
+from effects.geometry.extractors.lineart_processor import extract_paths
+from effects.geometry.extractors.pipeline import extract_geometry
+from effects.geometry.extractors.pointcloud_processor import edge_weights, points_to_dicts, sample_points
+from effects.geometry.extractors.point_sampler import PointSampler
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / 'baseline.json'
+BASELINE_VERSION = 1
+
+SIZES = (512, 1024, 2048)
+QUICK_SIZES = (512, 1024)
+# Strokes per megapixel
+DENSITIES = {'sparse': 300, 'medium': 1000, 'dense': 3000}
+DEFAULT_TOLERANCE = 0.25
+
+NUM_POINTS = 10000
+
+
+class StubDetector:
+    """
+    Deterministic stand-in for the detector networks. Maps are drawn from an
+    RNG seeded with the map's size and density, so every run (and every
+    machine) sees the same pixels.
+    """
+
+    def __init__(self, seed=0):
+        self.seed = seed
+
+    def _rng(self, width, height, strokes):
+        return np.random.default_rng([self.seed, width, height, strokes])
+
+    def lineart(self, width, height, strokes_per_mp):
+        """A uint8 lineart map: bright strokes of varied width and strength, plus specks."""
+        strokes = max(1, int(strokes_per_mp * width * height / 1e6))
+        rng = self._rng(width, height, strokes)
+        edge_map = np.zeros((height, width), dtype=np.uint8)
+        reach = max(8, min(width, height) // 25)
+        for _ in range(strokes):
+            origin = rng.integers(0, [width, height])
+            steps = rng.integers(-reach, reach + 1, size=(rng.integers(2, 7), 2))
+            points = np.clip(origin + np.cumsum(steps, axis=0), 0, [width - 1, height - 1]).astype(np.int32)
+            cv2.polylines(edge_map, [points[:, None, :]], False,
+                          int(rng.integers(120, 256)), int(rng.integers(1, 4)))
+        # Specks the component filter removes
+        for x, y in rng.integers(0, [width, height], size=(strokes * 2, 2)):
+            cv2.circle(edge_map, (int(x), int(y)), 1, 255, -1)
+        return edge_map
+
+    def hed(self, width, height, strokes_per_mp):
+        """A soft uint8 edge map, as HED gives."""
+        return cv2.GaussianBlur(self.lineart(width, height, strokes_per_mp), (0, 0), 2.0)
+
+    def photo(self, width, height, strokes_per_mp):
+        """A BGR image with dark strokes on a noisy gradient, for Canny-based extraction."""
+        rng = self._rng(width, height, 0)
+        gradient = np.linspace(90, 200, width, dtype=np.float32)[None, :].repeat(height, axis=0)
+        noise = rng.normal(0, 6, size=(height, width)).astype(np.float32)
+        strokes = self.lineart(width, height, strokes_per_mp).astype(np.float32)
+        gray = np.clip(gradient + noise - strokes * 0.5, 0, 255).astype(np.uint8)
+        return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+    def run(self, detector, batch):
+        """Detector-backend interface (see detector_backends.py): lineart outputs for ``batch``."""
+        if detector != 'lineart':
+            raise ValueError(f"The stub only stands in for lineart here, not {detector}")
+        count, _, height, width = batch.shape
+        edge_map = self.lineart(width, height, DENSITIES['medium']).astype(np.float32) / 255.0
+        # The network draws dark lines on white
+        return [np.repeat((1.0 - edge_map)[None, None], count, axis=0)]
+
+
+def measure(fn, repeat):
+    """Best and median seconds of ``repeat`` runs after one warm-up, and the last result."""
+    result = fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times), result
+
+
+def build_cases(stub, sizes, workdir):
+    """``(name, fn, count)`` for every case; ``count(result)`` is the items it produced."""
+    cases = []
+    for size in sizes:
+        # Pages are wider than they are tall
+        width, height = size, size * 3 // 4
+        for density_name, density in DENSITIES.items():
+            suffix = f"{size}/{density_name}"
+            lineart_map = stub.lineart(width, height, density)
+            hed_map = stub.hed(width, height, density)
+            scale = dict(threshold=0.3, min_length=20, scale_x=1.5, scale_y=1.5)
+            paths = extract_paths(lineart_map, **scale)
+            points = sample_points(hed_map, NUM_POINTS, width * 2, height * 2)
+
+            photo_path = workdir / f"photo-{size}-{density_name}.png"
+            cv2.imwrite(str(photo_path), stub.photo(width, height, density))
+
+            def sample(hed_map=hed_map, width=width, height=height):
+                # A fresh sampler each run: building its table is part of the cost
+                sampler = PointSampler(edge_weights(hed_map))
+                return sample_points(hed_map, NUM_POINTS, width * 2, height * 2, sampler=sampler)
+
+            def raster(photo_path=photo_path):
+                # process_image prints and writes its JSON next to the image
+                with contextlib.redirect_stdout(io.StringIO()):
+                    return process_raster.process_image(str(photo_path))
+
+            cases += [
+                (f"extract_paths/{suffix}", lambda m=lineart_map: extract_paths(m, **scale), len),
+                (f"sample_points/{suffix}", sample, len),
+                (f"process_raster/{suffix}", raster, lambda result: len(result['contours'])),
+                (f"json_paths/{suffix}", lambda p=paths: json.dumps({'levels': [p]}), len),
+                (f"json_points/{suffix}",
+                 lambda p=points, w=width, h=height: json.dumps({
+                     'points': points_to_dicts(p), 'dimensions': {'width': w * 2, 'height': h * 2}}),
+                 len),
+            ]
+
+        def pipeline(photo_path=workdir / f"photo-{size}-medium.png", size=size):
+            # A fresh store each run, so every level goes through the stub
+            store = EdgeMapStore(tempfile.mkdtemp(dir=workdir))
+            with contextlib.redirect_stdout(io.StringIO()):
+                return extract_geometry(photo_path, 'lineart', {'resolutions': [size // 4, size // 2, size]},
+                                        store=store)
+
+        cases.append((f"extract_geometry/{size}/medium", pipeline,
+                      lambda geometry: int(geometry['level_offsets'][-1])))
+    return cases
+
+
+def machine_info():
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+    }
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        return None
+    if baseline.get('version') != BASELINE_VERSION:
+        print(f"Ignoring {path}: baseline version {baseline.get('version')}, expected {BASELINE_VERSION}")
+        return None
+    return baseline
+
+
+def compare(results, baseline, tolerance):
+    """Print each case against the baseline; returns the names of regressed cases."""
+    regressions = []
+    for name, result in results.items():
+        before = baseline['results'].get(name) if baseline else None
+        line = f"  {name:34s} {result['seconds'] * 1000:9.2f} ms  (median {result['median'] * 1000:9.2f})"
+        if before:
+            change = result['seconds'] / before['seconds'] - 1
+            line += f"  {change:+7.1%} vs baseline"
+            if change > tolerance:
+                line += '  REGRESSION'
+                regressions.append(name)
+            if before.get('items') != result['items']:
+                line += f"  (output changed: {before.get('items')} -> {result['items']} items)"
+        print(line)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--filter', default=None, help='Only run cases whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--quick', action='store_true', help=f"Only image sizes {QUICK_SIZES}")
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed slowdown against the baseline, as a fraction')
+    parser.add_argument('--save-baseline', action='store_true', help='Record these results as the baseline')
+    parser.add_argument('--output', type=Path, default=None, help='Also write the results to this file')
+    args = parser.parse_args(argv)
+
+    stub = StubDetector()
+    # The batched inference path calls the stub instead of the lineart network
+    lineart_batch().backend = stub
+
+    with tempfile.TemporaryDirectory(prefix='pile-bench-') as workdir:
+        cases = build_cases(stub, QUICK_SIZES if args.quick else SIZES, Path(workdir))
+        if args.filter:
+            cases = [case for case in cases if args.filter in case[0]]
+
+        results = {}
+        for name, fn, count in cases:
+            seconds, median, result = measure(fn, args.repeat)
+            results[name] = {'seconds': seconds, 'median': median, 'items': count(result)}
+
+    report = {'version': BASELINE_VERSION, 'machine': machine_info(), 'repeat': args.repeat, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        baseline = load_baseline(args.baseline)
+        if baseline and args.filter:
+            # Keep the cases this run skipped
+            report['results'] = dict(baseline['results'], **results)
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        compare(results, None, args.tolerance)
+        print(f"Saved {len(results)} results to {args.baseline}")
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one")
+    elif baseline['machine'] != report['machine']:
+        print(f"Warning: the baseline was recorded on {baseline['machine']['platform']} "
+              f"({baseline['machine']['cpus']} CPUs), timings may not compare")
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} case(s) more than {args.tolerance:.0%} slower than the baseline: "
+              f"{', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+In-memory index of scene and novel configs.
+
+Listing configs used to glob and parse every file on each request. A
+``ConfigIndex`` keeps the parsed configs of one directory in memory and
+revalidates them by file mtime and size: a listing rescans the directory
+(``os.scandir``, which reads no file contents) at most every
+``check_interval`` seconds and re-parses only the files that changed, and
+getting one config stats just that file. Edits made outside the app are
+therefore picked up without a restart.
+
+Each config carries an ETag (a hash of its file contents) and each listing
+one derived from its members' tags, so routes can answer ``If-None-Match``
+with 304 Not Modified.
+
+``PILE_CONFIG_CHECK_INTERVAL`` sets the rescan interval in seconds (default 1).
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+DEFAULT_CHECK_INTERVAL = 1.0
+
+SUFFIX = '.json'
+
+
+class _Entry:
+    def __init__(self, mtime_ns, size, data, etag):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.data = data
+        self.etag = etag
+
+
+class ConfigIndex:
+    def __init__(self, directory, check_interval=None):
+        self.directory = Path(directory)
+        if check_interval is None:
+            value = os.environ.get('PILE_CONFIG_CHECK_INTERVAL')
+            check_interval = float(value) if value else DEFAULT_CHECK_INTERVAL
+        self.check_interval = check_interval
+        self.loads = 0
+
+        self._entries = {}
+        self._scanned_at = None
+        self._lock = threading.Lock()
+
+    def _load_locked(self, config_id, stat):
+        """Parse ``config_id`` unless its mtime and size are unchanged."""
+        entry = self._entries.get(config_id)
+        if entry is not None and entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+            return entry
+        try:
+            with open(self.directory / f"{config_id}{SUFFIX}", 'rb') as f:
+                content = f.read()
+            data = json.loads(content)
+        except FileNotFoundError:
+            self._entries.pop(config_id, None)
+            return None
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            # Probably caught mid-write: keep serving the previous version
+            print(f"Could not parse config {config_id}: {e}")
+            return entry
+        entry = _Entry(stat.st_mtime_ns, stat.st_size, data, hashlib.sha1(content).hexdigest()[:20])
+        self._entries[config_id] = entry
+        self.loads += 1
+        return entry
+
+    def scan(self, force=False):
+        """Bring the index up to date with the directory (at most every ``check_interval`` seconds)."""
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._scanned_at is not None and now - self._scanned_at < self.check_interval:
+                return
+            seen = set()
+            try:
+                items = list(os.scandir(self.directory))
+            except FileNotFoundError:
+                items = []
+            for item in items:
+                if not item.name.endswith(SUFFIX) or item.name.startswith('.') or not item.is_file():
+                    continue
+                config_id = item.name[:-len(SUFFIX)]
+                try:
+                    if self._load_locked(config_id, item.stat()) is not None:
+                        seen.add(config_id)
+                except FileNotFoundError:
+                    continue
+            for config_id in list(self._entries):
+                if config_id not in seen:
+                    del self._entries[config_id]
+            self._scanned_at = now
+
+    def get(self, config_id):
+        """``(data, etag)`` of config ``config_id``, or None if there is none."""
+        if not config_id or config_id.startswith('.') or '/' in config_id or '\\' in config_id:
+            return None
+        with self._lock:
+            try:
+                stat = os.stat(self.directory / f"{config_id}{SUFFIX}")
+            except FileNotFoundError:
+                self._entries.pop(config_id, None)
+                return None
+            entry = self._load_locked(config_id, stat)
+        return None if entry is None else (entry.data, entry.etag)
+
+    def items(self):
+        """``([(config_id, data), ...], etag)`` of every config, sorted by id."""
+        self.scan()
+        with self._lock:
+            ids = sorted(self._entries)
+            sha = hashlib.sha1()
+            for config_id in ids:
+                sha.update(f"{config_id}:{self._entries[config_id].etag};".encode())
+            return [(config_id, self._entries[config_id].data) for config_id in ids], sha.hexdigest()[:20]
+
+    def invalidate(self, config_id=None):
+        """Forget ``config_id`` (default: everything) so it is re-read on next use."""
+        with self._lock:
+            if config_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(config_id, None)
+            self._scanned_at = None
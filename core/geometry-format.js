@@ -0,0 +1,84 @@
+// Decoder for the packed binary geometry format written by
+// effects/geometry/extractors/geometry_format.py. The coordinate and level
+// offset arrays are typed-array views over the response buffer, not copies.
+
+export const GEOMETRY_MIME_TYPE = 'application/vnd.pile.geometry';
+
+export const KIND_SEGMENTS = 1;
+export const KIND_POINTS = 2;
+export const KIND_POLYLINES = 3;
+
+const MAGIC = 'PGEO';
+const VERSION = 1;
+const HEADER_BYTES = 32;
+const GRID_MAGIC = 'PGRD';
+const GRID_HEADER_BYTES = 12;
+const ENCODING_UINT16 = 1;
+const QUANT_MAX = 65535;
+
+export function decodeGeometry(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== MAGIC) {
+        throw new Error('Not a pile geometry file');
+    }
+    const version = view.getUint16(4, true);
+    if (version !== VERSION) {
+        throw new Error(`Unsupported geometry format version ${version}`);
+    }
+
+    const kind = view.getUint8(6);
+    const encoding = view.getUint8(7);
+    const width = view.getUint32(8, true);
+    const height = view.getUint32(12, true);
+    const levelCount = view.getUint32(16, true);
+    const itemCount = view.getUint32(20, true);
+    const components = view.getUint32(24, true);
+    const vertexCount = view.getUint32(28, true);
+
+    const levelOffsets = new Uint32Array(buffer, HEADER_BYTES, levelCount + 1);
+    let coordsOffset = HEADER_BYTES + levelOffsets.byteLength;
+    let rows = itemCount;
+    // Polylines: path i is vertices pathOffsets[i] to pathOffsets[i + 1]
+    let pathOffsets = null;
+    if (kind === KIND_POLYLINES) {
+        pathOffsets = new Uint32Array(buffer, coordsOffset, itemCount + 1);
+        coordsOffset += pathOffsets.byteLength;
+        rows = vertexCount;
+    }
+    const quantized = encoding === ENCODING_UINT16;
+    const coords = quantized
+        ? new Uint16Array(buffer, coordsOffset, rows * components)
+        : new Float32Array(buffer, coordsOffset, rows * components);
+
+    // Polylines in grid order may be followed, 4-byte aligned, by their grid
+    // index: per level, the first path of each cell (row-major) and the end
+    let grid = null;
+    const gridOffset = Math.ceil((coordsOffset + coords.byteLength) / 4) * 4;
+    if (kind === KIND_POLYLINES && buffer.byteLength >= gridOffset + GRID_HEADER_BYTES &&
+            String.fromCharCode(...new Uint8Array(buffer, gridOffset, 4)) === GRID_MAGIC) {
+        const cols = view.getUint32(gridOffset + 4, true);
+        const gridRows = view.getUint32(gridOffset + 8, true);
+        grid = {
+            cols,
+            rows: gridRows,
+            cellOffsets: new Uint32Array(buffer, gridOffset + GRID_HEADER_BYTES, levelCount * (cols * gridRows + 1)),
+            order: null,
+        };
+    }
+
+    return {
+        kind,
+        width,
+        height,
+        components,
+        itemCount,
+        levelOffsets,
+        pathOffsets,
+        coords,
+        grid,
+        // Multiply a stored value by these to get image-space x / y
+        scaleX: quantized ? width / QUANT_MAX : 1,
+        scaleY: quantized ? height / QUANT_MAX : 1,
+    };
+}
@@ -1,3 +1,4 @@
+import { GEOMETRY_MIME_TYPE, decodeGeometry } from './geometry-format.js';
 import { LineArtGeometry } from '../effects/geometry/types/lineart.js';
 import { PointCloudGeometry } from '../effects/geometry/types/pointcloud.js';
 
@@ -19,5 +20,84 @@ export function getGeometryType(type) {
 
 // Helper function to get the correct asset path for a geometry type
 export function getGeometryAssetPath(type, filename) {
-    return `/assets/geometry/${type}/${filename}`;
-}
\ No newline at end of file
+    return `/api/geometry/${type}/${filename}`;
+}
+
+// Item budgets (segments for lineart, points for pointclouds) by device class.
+// Each segment or point becomes its own display object, so weak clients get
+// a coarser precomputed level of detail instead of dropping frames.
+const GEOMETRY_BUDGETS = {
+    low: 4000,
+    medium: 12000,
+};
+
+const BUDGET_PARAMS = {
+    'lineart': 'max_segments',
+    'pointcloud': 'max_points',
+};
+
+// A ?max_segments= / ?max_points= on the page URL overrides the guess
+export function getGeometryBudget(type) {
+    const param = BUDGET_PARAMS[type];
+    const override = param && new URLSearchParams(window.location.search).get(param);
+    if (override) {
+        return parseInt(override, 10);
+    }
+    const memory = navigator.deviceMemory || 8;
+    const cores = navigator.hardwareConcurrency || 8;
+    if (memory <= 2 || cores <= 2) {
+        return GEOMETRY_BUDGETS.low;
+    }
+    if (memory <= 4 || cores <= 4) {
+        return GEOMETRY_BUDGETS.medium;
+    }
+    return null;
+}
+
+// Fetch geometry, preferring the packed binary form over JSON
+export async function loadGeometryData(type, filename, budget = getGeometryBudget(type)) {
+    let url = getGeometryAssetPath(type, filename);
+    if (budget != null && BUDGET_PARAMS[type]) {
+        url += `?${BUDGET_PARAMS[type]}=${budget}`;
+    }
+    const response = await fetch(url, {
+        headers: { 'Accept': `${GEOMETRY_MIME_TYPE}, application/json;q=0.5` }
+    });
+    if (!response.ok) {
+        throw new Error(`Failed to load ${type} geometry ${filename}: ${response.status}`);
+    }
+    const contentType = response.headers.get('Content-Type') || '';
+    if (contentType.startsWith(GEOMETRY_MIME_TYPE)) {
+        return { packed: decodeGeometry(await response.arrayBuffer()) };
+    }
+    return response.json();
+}
+
+// Lineart pre-rendered into sprite atlases (see sprite_atlas.py) stands in for
+// the vectors on low-budget clients. ?atlas=1 / ?atlas=0 on the page URL
+// overrides the guess.
+export function prefersGeometryAtlas(type) {
+    if (type !== 'lineart') {
+        return false;
+    }
+    const override = new URLSearchParams(window.location.search).get('atlas');
+    if (override) {
+        return override === '1';
+    }
+    const budget = getGeometryBudget(type);
+    return budget != null && budget <= GEOMETRY_BUDGETS.low;
+}
+
+// The atlas metadata with its page textures, or null if none was generated
+export async function loadGeometryAtlas(type, filename) {
+    const response = await fetch(`${getGeometryAssetPath(type, filename)}/atlas`);
+    if (response.status === 404) {
+        return null;
+    }
+    if (!response.ok) {
+        throw new Error(`Failed to load ${type} atlas ${filename}: ${response.status}`);
+    }
+    const atlas = await response.json();
+    atlas.textures = await Promise.all(atlas.pages.map(url => PIXI.Assets.load(url)));
+    return atlas;
+}
@@ -5,6 +5,9 @@ export class NovelViewer {
         console.log('Initializing NovelViewer with novel:', novelId);
         this.novelId = novelId;
         this.novel = null;
+        // Filled from the novel bundle: scene configs and asset manifests by scene id
+        this.sceneConfigs = {};
+        this.assets = {};
         this.currentSceneIndex = -1;
         this.currentScene = null;
         this.app = app;
@@ -17,9 +20,21 @@ export class NovelViewer {
 
     async loadNovel() {
         try {
-            console.log('Loading novel data...');
-            const response = await fetch(`/api/novels/${this.novelId}`);
-            this.novel = await response.json();
+            console.log('Loading novel bundle...');
+            // The novel, every scene config and their asset URLs in one request
+            const response = await fetch(`/api/novels/${this.novelId}/bundle`);
+            if (response.ok) {
+                const bundle = await response.json();
+                this.novel = bundle.novel;
+                this.sceneConfigs = bundle.scenes;
+                this.assets = bundle.assets;
+                if (bundle.missing.length > 0) {
+                    console.warn('Scenes missing from the novel bundle:', bundle.missing);
+                }
+            } else {
+                console.warn(`Novel bundle failed (${response.status}), loading the novel and scenes one by one`);
+                await this.loadNovelUnbundled();
+            }
             console.log('Loaded novel:', this.novel);
             this.setupKeyboardControls();
             this.startNovel();
@@ -28,6 +43,30 @@ export class NovelViewer {
         }
     }
 
+    // The novel and its scene configs without the bundle; scene assets then
+    // come from their default URLs
+    async loadNovelUnbundled() {
+        const response = await fetch(`/api/novels/${this.novelId}`);
+        if (!response.ok) {
+            throw new Error(`Failed to load novel ${this.novelId}: ${response.status}`);
+        }
+        this.novel = await response.json();
+        this.sceneConfigs = {};
+        this.assets = {};
+        // loadScene retries any scene missing here
+        await Promise.all(this.novel.scenes.map(async sceneId => {
+            try {
+                const sceneResponse = await fetch(`/api/scenes/${sceneId}`);
+                if (!sceneResponse.ok) {
+                    throw new Error(`status ${sceneResponse.status}`);
+                }
+                this.sceneConfigs[sceneId] = await sceneResponse.json();
+            } catch (error) {
+                console.warn('Could not load scene', sceneId, error);
+            }
+        }));
+    }
+
     setupKeyboardControls() {
         console.log('Setting up keyboard controls');
         document.addEventListener('keydown', async (e) => {
@@ -67,8 +106,11 @@ export class NovelViewer {
             console.log('Loading scene:', sceneId);
             this.isTransitioning = true;
             
-            const response = await fetch(`/api/scenes/${sceneId}`);
-            const sceneConfig = await response.json();
+            let sceneConfig = this.sceneConfigs[sceneId];
+            if (!sceneConfig) {
+                const response = await fetch(`/api/scenes/${sceneId}`);
+                sceneConfig = await response.json();
+            }
             console.log('Loaded scene config:', sceneConfig);
             
             // Always clear the previous scene before loading the new one
@@ -76,16 +118,26 @@ export class NovelViewer {
             
             // Load and initialize the new scene
             console.log('Loading new scene into SceneManager');
-            await this.sceneManager.loadScene(sceneConfig);
+            await this.sceneManager.loadScene(sceneConfig, this.assets[sceneId]);
             
             this.currentScene = sceneConfig;
             this.isTransitioning = false;
+            this.prefetchNextScene();
         } catch (error) {
             console.error('Error loading scene:', error);
             this.isTransitioning = false;
         }
     }
 
+    // Warm the next scene's image and geometry while the current one plays
+    prefetchNextScene() {
+        const nextId = this.novel.scenes[this.currentSceneIndex + 1];
+        const config = nextId && this.sceneConfigs[nextId];
+        if (config) {
+            this.sceneManager.prefetchScene(config, this.assets[nextId]);
+        }
+    }
+
     async nextScene() {
         console.log('Starting next scene transition');
         if (this.currentSceneIndex < this.novel.scenes.length - 1) {
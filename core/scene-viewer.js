@@ -1,5 +1,6 @@
-import { getGeometryType, getGeometryAssetPath } from './geometry-registry.js';
+import { getGeometryType, loadGeometryAtlas, loadGeometryData, prefersGeometryAtlas } from './geometry-registry.js';
 import { getGeometryAnimation, getImageAnimation, getTextAnimation } from './animation-registry.js';
+import { TiledImage, fitScale, tierUrl } from './tiled-image.js';
 
 
 export class SceneManager {
@@ -26,6 +27,86 @@ export class SceneManager {
 
         // Store bound event handler so we can remove it later
         this.boundKeyHandler = this.handleKeyDown.bind(this);
+
+        // Scene id -> { image, geometry } promises started before loadScene
+        this.prefetched = new Map();
+    }
+
+    // The image's resized tiers and tile pyramid (see image_derivatives.py), or null
+    async getDerivatives(config, assets) {
+        if (config.image.derivatives === 'none') {
+            return null;
+        }
+        if (assets?.image) {
+            return assets.image.derivatives || null;
+        }
+        const response = await fetch(`/api/images/${encodeURIComponent(config.image.path)}/derivatives`);
+        return response.ok ? response.json() : null;
+    }
+
+    // Device pixels of image width the scene needs at its closest zoom; tiled
+    // scenes only need the fitted size, tiles cover the zoom
+    displayWidth(config, width, height) {
+        const keyframes = config.image.animation?.config?.keyframes || [];
+        const zoom = config.image.derivatives === 'tiles'
+            ? 1
+            : Math.max(1, ...keyframes.map(keyframe => keyframe.view?.scale || 1));
+        return width * fitScale(width, height, this.app, config.image.padding) * zoom *
+            this.app.renderer.resolution;
+    }
+
+    // Load the smallest copy of the scene's image that looks sharp on this screen
+    async loadImage(config, assets) {
+        const originalUrl = assets?.image?.url || '/assets/images/' + config.image.path;
+        const derivatives = await this.getDerivatives(config, assets).catch(error => {
+            console.warn('Could not load image derivatives:', error);
+            return null;
+        });
+        const url = derivatives
+            ? await tierUrl(derivatives, this.displayWidth(config, derivatives.width, derivatives.height), originalUrl)
+            : originalUrl;
+        return { url, derivatives, texture: await PIXI.Assets.load(url) };
+    }
+
+    async loadGeometry(geometryConfig) {
+        const GeometryClass = getGeometryType(geometryConfig.type);
+        const [geometryData, atlas] = await Promise.all([
+            loadGeometryData(geometryConfig.type, geometryConfig.data),
+            prefersGeometryAtlas(geometryConfig.type)
+                ? loadGeometryAtlas(geometryConfig.type, geometryConfig.data).catch(error => {
+                    console.warn('Could not load geometry atlas:', error);
+                    return null;
+                })
+                : null
+        ]);
+        const geometry = new GeometryClass(geometryData);
+        if (atlas) {
+            geometry.atlas = atlas;
+        }
+        return geometry;
+    }
+
+    // Fetch and decode a scene's image and geometry in the background, so
+    // loadScene finds them ready. Failures are left for loadScene to retry.
+    prefetchScene(config, assets) {
+        if (this.prefetched.has(config.id) || navigator.connection?.saveData) {
+            return;
+        }
+        const warn = error => {
+            console.warn('Prefetch failed for scene', config.id, error);
+            return null;
+        };
+        // Only the next scene or two are worth holding on to
+        while (this.prefetched.size >= 2) {
+            this.prefetched.delete(this.prefetched.keys().next().value);
+        }
+        console.log('Prefetching scene:', config.id);
+        this.prefetched.set(config.id, {
+            image: this.loadImage(config, assets).catch(warn),
+            geometry: config.image.geometry
+                ? this.loadGeometry(config.image.geometry).catch(warn)
+                : Promise.resolve(null)
+        });
     }
 
     // Move the event handling logic to its own method
@@ -75,38 +156,48 @@ export class SceneManager {
         this.textAnimation = null;
     }
 
-    async loadScene(config) {
+    async loadScene(config, assets) {
 
         try{
             // Clear previous scene first
             await this.clearCurrentScene();
             
             console.log('Loading new scene:', config.id);
+            const prefetched = this.prefetched.get(config.id);
+            this.prefetched.delete(config.id);
 
             // Load and setup base image
-            console.log('Loading texture from:', '/assets/images/' + config.image.path);
-            const texture = await PIXI.Assets.load('/assets/images/' + config.image.path);
-            console.log('Texture loaded:', texture);
-            const image = new PIXI.Sprite(texture);
-            console.log('Sprite created:', image);
+            const { url, derivatives, texture } = (prefetched && await prefetched.image) ||
+                await this.loadImage(config, assets);
+            console.log('Texture loaded from:', url, prefetched ? '(prefetched)' : '');
+            
+            // Animations and geometry work in the original image's pixels,
+            // whichever copy is drawn
+            const dimensions = derivatives
+                ? { width: derivatives.width, height: derivatives.height }
+                : { width: texture.width, height: texture.height };
+            let image;
+            if (derivatives) {
+                image = new TiledImage(derivatives, texture, this.app, {
+                    tiles: config.image.derivatives === 'tiles'
+                });
+            } else {
+                image = new PIXI.Sprite(texture);
+                image.anchor.set(0.5);
+            }
+            console.log('Image created:', image);
             
             // Calculate scale
-            const canvasScale = 1.0 - (config.image.padding || 0);
-            const imageScale = Math.min(
-                (this.app.screen.width * canvasScale) / texture.width,
-                (this.app.screen.height * canvasScale) / texture.height
-            );
+            const imageScale = fitScale(dimensions.width, dimensions.height, this.app, config.image.padding || 0);
             console.log('Calculated scales:', {
-                canvasScale,
                 imageScale,
                 screenWidth: this.app.screen.width,
                 screenHeight: this.app.screen.height,
-                textureWidth: texture.width,
-                textureHeight: texture.height
+                imageWidth: dimensions.width,
+                imageHeight: dimensions.height
             });
             
             // Setup base image
-            image.anchor.set(0.5);
             image.position.set(this.app.screen.width / 2, this.app.screen.height / 2);
             image.scale.set(imageScale);
             image.alpha = 0;
@@ -142,7 +233,7 @@ export class SceneManager {
             this.imageAnimation = animation.createTimeline(
                 this.imageContainer,
                 imageScale,
-                { width: texture.width, height: texture.height },
+                dimensions,
                 this.app.renderer
             );
             console.log('Image animation created:', {
@@ -152,14 +243,8 @@ export class SceneManager {
             
             // If there's geometry, set it up
             if (config.image.geometry) {
-                const GeometryClass = getGeometryType(config.image.geometry.type);
-                const geometryPath = getGeometryAssetPath(
-                    config.image.geometry.type,
-                    config.image.geometry.data
-                );
-                
-                const geometryData = await fetch(geometryPath).then(r => r.json());
-                const geometry = new GeometryClass(geometryData);
+                const geometry = (prefetched && await prefetched.geometry) ||
+                    await this.loadGeometry(config.image.geometry);
 
                 const GeometryAnimationClass = getGeometryAnimation(config.image.geometry.animation.type);
                 const geometryAnimation = new GeometryAnimationClass(geometry, {
@@ -170,7 +255,7 @@ export class SceneManager {
                 this.geometryAnimation = geometryAnimation.createTimeline(
                     this.geometryContainer,
                     imageScale,
-                    { width: texture.width, height: texture.height },
+                    dimensions,
                     this.app.renderer
                 );
             }
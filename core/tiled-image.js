@@ -0,0 +1,248 @@
+// Scene images drawn from their derivatives (see image_derivatives.py): the
+// smallest resized tier that covers the screen and, in tile mode, the
+// deep-zoom tiles the current view shows, at the resolution it needs.
+//
+// A TiledImage is a container the size of the original image, centred on its
+// position like an anchored sprite, so image and geometry animations can move
+// and scale it exactly like the full-resolution sprite it replaces.
+
+// Tiles kept in memory; the least recently shown are dropped first
+const MAX_TILES = 192;
+// Tile requests in flight at once
+const MAX_LOADING = 6;
+
+let formatsPromise = null;
+
+// Tier encodings this browser decodes, best first
+export function supportedFormats() {
+    if (!formatsPromise) {
+        const avif = PIXI.detectAvif?.test?.() ?? false;
+        formatsPromise = Promise.resolve(avif)
+            .catch(() => false)
+            .then(supported => supported ? ['avif', 'webp'] : ['webp']);
+    }
+    return formatsPromise;
+}
+
+// Scale that fits a width x height image on screen, as scenes lay images out
+export function fitScale(width, height, app, padding = 0) {
+    const canvasScale = 1.0 - padding;
+    return Math.min(
+        (app.screen.width * canvasScale) / width,
+        (app.screen.height * canvasScale) / height
+    );
+}
+
+// URL of the smallest tier at least `width` pixels wide, else `originalUrl`
+export async function tierUrl(manifest, width, originalUrl) {
+    const formats = await supportedFormats();
+    for (const tier of manifest.tiers) {
+        const format = formats.find(name => tier.files[name]);
+        if (tier.width >= width && format) {
+            return manifest.url + tier.files[format];
+        }
+    }
+    return originalUrl;
+}
+
+export class TiledImage extends PIXI.Container {
+    // `texture` is the tier drawn underneath; tiles, when enabled, load over it
+    constructor(manifest, texture, app, { tiles = false } = {}) {
+        super();
+        this.manifest = manifest;
+        this.app = app;
+        this.tilesEnabled = tiles && !!manifest.tiles;
+
+        const base = new PIXI.Sprite(texture);
+        base.anchor.set(0.5);
+        base.width = manifest.width;
+        base.height = manifest.height;
+        // Tier pixels per image pixel: no tiles are needed below this zoom
+        this.baseScale = texture.width / manifest.width;
+        this.addChild(base);
+
+        // Tiles are placed in image pixels from the top left corner
+        this.tileLayer = new PIXI.Container();
+        this.tileLayer.position.set(-manifest.width / 2, -manifest.height / 2);
+        this.tileLayer.sortableChildren = true;
+        this.addChild(this.tileLayer);
+
+        this.levelLayers = new Map();
+        this.tiles = new Map();
+        this.loading = new Set();
+        this.failed = new Set();
+        this.frame = 0;
+        this.lastView = null;
+
+        this.update = this.update.bind(this);
+        if (this.tilesEnabled) {
+            this.on('added', () => {
+                this.released = false;
+                this.app.ticker.add(this.update);
+            });
+            this.on('removed', () => this.release());
+        }
+    }
+
+    // Deep-zoom level whose resolution covers `scale` device pixels per image pixel
+    levelFor(scale) {
+        const maxLevel = this.manifest.tiles.levels.length - 1;
+        return Math.min(maxLevel, Math.max(0, maxLevel + Math.ceil(Math.log2(scale))));
+    }
+
+    update() {
+        if (!this.worldVisible || this.worldAlpha === 0) {
+            return;
+        }
+        // Only look again when the view moved or a tile finished loading
+        const t = this.worldTransform;
+        const screen = this.app.screen;
+        const view = [t.a, t.b, t.tx, t.ty, screen.width, screen.height];
+        if (this.lastView && view.every((value, i) => value === this.lastView[i])) {
+            return;
+        }
+        this.lastView = view;
+        this.frame++;
+
+        const scale = Math.hypot(t.a, t.b) * this.app.renderer.resolution;
+        if (scale <= this.baseScale) {
+            // The tier underneath is sharp enough
+            this.showLevel(null);
+            return;
+        }
+        const level = this.levelFor(scale);
+        const { width, height, tiles } = this.manifest;
+        const info = tiles.levels[level];
+
+        // The part of the image on screen, in image pixels
+        const corners = [[0, 0], [screen.width, 0], [0, screen.height], [screen.width, screen.height]]
+            .map(([x, y]) => this.tileLayer.toLocal(new PIXI.Point(x, y)));
+        const xs = corners.map(point => point.x);
+        const ys = corners.map(point => point.y);
+        const left = Math.max(0, Math.min(...xs));
+        const right = Math.min(width, Math.max(...xs));
+        const top = Math.max(0, Math.min(...ys));
+        const bottom = Math.min(height, Math.max(...ys));
+        if (right <= left || bottom <= top) {
+            return;
+        }
+
+        const sx = info.width / width;
+        const sy = info.height / height;
+        const size = tiles.tile_size;
+        const firstColumn = Math.floor(left * sx / size);
+        const lastColumn = Math.min(info.columns - 1, Math.floor(right * sx / size));
+        const firstRow = Math.floor(top * sy / size);
+        const lastRow = Math.min(info.rows - 1, Math.floor(bottom * sy / size));
+
+        // Centre tiles first
+        const centreColumn = (firstColumn + lastColumn) / 2;
+        const centreRow = (firstRow + lastRow) / 2;
+        const needed = [];
+        for (let column = firstColumn; column <= lastColumn; column++) {
+            for (let row = firstRow; row <= lastRow; row++) {
+                needed.push([column, row, Math.hypot(column - centreColumn, row - centreRow)]);
+            }
+        }
+        needed.sort((a, b) => a[2] - b[2]);
+
+        let missing = 0;
+        for (const [column, row] of needed) {
+            const url = this.manifest.url + tiles.path
+                .replace('{level}', level)
+                .replace('{column}', column)
+                .replace('{row}', row);
+            const tile = this.tiles.get(url);
+            if (tile) {
+                tile.seen = this.frame;
+                continue;
+            }
+            if (this.failed.has(url)) {
+                continue;
+            }
+            missing++;
+            if (!this.loading.has(url) && this.loading.size < MAX_LOADING) {
+                this.loadTile(url, level, column, row, sx, sy);
+            }
+        }
+        // Coarser tiles stay up until this level's visible tiles are all in
+        this.showLevel(level, missing === 0);
+        this.evict();
+    }
+
+    levelLayer(level) {
+        let layer = this.levelLayers.get(level);
+        if (!layer) {
+            layer = new PIXI.Container();
+            layer.zIndex = level;
+            this.tileLayer.addChild(layer);
+            this.levelLayers.set(level, layer);
+        }
+        return layer;
+    }
+
+    showLevel(level, complete = false) {
+        for (const [layerLevel, layer] of this.levelLayers) {
+            layer.visible = level !== null && (layerLevel === level || !complete);
+        }
+    }
+
+    loadTile(url, level, column, row, sx, sy) {
+        const { tile_size: size, overlap } = this.manifest.tiles;
+        // Tiles after the first in a row or column start `overlap` pixels early
+        const x = (column * size - (column > 0 ? overlap : 0)) / sx;
+        const y = (row * size - (row > 0 ? overlap : 0)) / sy;
+
+        this.loading.add(url);
+        PIXI.Assets.load(url)
+            .then(texture => {
+                if (this.destroyed || this.released) {
+                    PIXI.Assets.unload(url);
+                    return;
+                }
+                const sprite = new PIXI.Sprite(texture);
+                sprite.position.set(x, y);
+                sprite.width = texture.width / sx;
+                sprite.height = texture.height / sy;
+                this.levelLayer(level).addChild(sprite);
+                this.tiles.set(url, { sprite, seen: this.frame });
+            })
+            .catch(error => {
+                console.warn('Failed to load tile:', url, error);
+                this.failed.add(url);
+            })
+            .finally(() => {
+                this.loading.delete(url);
+                this.lastView = null;
+            });
+    }
+
+    evict() {
+        if (this.tiles.size <= MAX_TILES) {
+            return;
+        }
+        const stale = [...this.tiles.entries()]
+            .filter(([, tile]) => tile.seen < this.frame)
+            .sort((a, b) => a[1].seen - b[1].seen)
+            .slice(0, this.tiles.size - MAX_TILES);
+        for (const [url, tile] of stale) {
+            tile.sprite.destroy();
+            this.tiles.delete(url);
+            PIXI.Assets.unload(url);
+        }
+    }
+
+    // Stop following the view and free the tile textures
+    release() {
+        this.released = true;
+        this.app.ticker.remove(this.update);
+        for (const [url, tile] of this.tiles) {
+            tile.sprite.destroy();
+            PIXI.Assets.unload(url);
+        }
+        this.tiles.clear();
+        this.levelLayers.clear();
+        this.tileLayer.removeChildren();
+        this.lastView = null;
+    }
+}
@@ -30,6 +30,69 @@ export class FallingAnimation {
         return acceleratedProgress * (this.config.duration - 2);
     }
 
+    // Start of a grid row's fall within its level, easing in with acceleration
+    getRowDelay(row, rows, sweep) {
+        if (rows <= 1) {
+            return 0;
+        }
+        const linearProgress = row / rows;
+        return (1 - Math.pow(1 - linearProgress, 1 + (this.config.acceleration || 0))) * sweep;
+    }
+
+    // Normalize coordinates to -0.5 to 0.5 range (centered)
+    toContainer(x, y, dimensions, containerWidth, containerHeight) {
+        return [
+            (x / dimensions.width - 0.5) * containerWidth,
+            (y / dimensions.height - 0.5) * containerHeight
+        ];
+    }
+
+    // A band of one level (row null: the whole level) as one Graphics drawing
+    // all its paths, since the band moves as one; null if it has no paths
+    createBandGraphics(level, row, dimensions, containerWidth, containerHeight) {
+        const paths = row === null
+            ? this.geometry.getLevelPaths(level)
+            : this.geometry.getRowPaths(level, row);
+        if (paths.length === 0) {
+            return null;
+        }
+        const graphics = new PIXI.Graphics();
+        graphics.lineStyle(1, 0xFFFFFF);
+        paths.forEach(points => {
+            points.forEach((point, i) => {
+                const [x, y] = this.toContainer(point.x, point.y, dimensions, containerWidth, containerHeight);
+                if (i === 0) {
+                    graphics.moveTo(x, y);
+                } else {
+                    graphics.lineTo(x, y);
+                }
+            });
+        });
+        const levelContainer = new PIXI.Container();
+        levelContainer.addChild(graphics);
+        return levelContainer;
+    }
+
+    // The same band from the geometry's sprite atlas: one sprite per grid
+    // cell, cut from a shared page texture, instead of tessellated vectors
+    createBandSprites(level, row, dimensions, containerWidth, containerHeight) {
+        const sprites = this.geometry.getAtlasSprites(level, row);
+        if (sprites.length === 0) {
+            return null;
+        }
+        const { textures } = this.geometry.atlas;
+        const levelContainer = new PIXI.Container();
+        sprites.forEach(({ page, frame, bounds }) => {
+            const sprite = new PIXI.Sprite(new PIXI.Texture(textures[page].baseTexture, new PIXI.Rectangle(...frame)));
+            const [x, y] = this.toContainer(bounds[0], bounds[1], dimensions, containerWidth, containerHeight);
+            sprite.position.set(x, y);
+            sprite.width = bounds[2] / dimensions.width * containerWidth;
+            sprite.height = bounds[3] / dimensions.height * containerHeight;
+            levelContainer.addChild(sprite);
+        });
+        return levelContainer;
+    }
+
     createTimeline(container, imageScale, dimensions) {
         let currentPhase = 0;
     
@@ -40,7 +103,6 @@ export class FallingAnimation {
             }
         });
         
-        const totalSegments = this.geometry.getTotalSegments();
         const FALL_OFFSET = -window.innerHeight;
     
         // Center container
@@ -53,58 +115,46 @@ export class FallingAnimation {
         const containerWidth = dimensions.width * imageScale;
         const containerHeight = dimensions.height * imageScale;
         
-        // Group segments by level
-        const segmentsByLevel = new Map();
-        for (let i = 0; i < totalSegments; i++) {
-            const { segment, level } = this.geometry.getSegmentAt(i);
-            if (!segmentsByLevel.has(level)) {
-                segmentsByLevel.set(level, []);
-            }
-            segmentsByLevel.get(level).push(segment);
-        }
+        // Without a sweep each level falls as one; with one, each row of grid
+        // cells falls on its own, the top row first, over `sweep` seconds
+        const sweep = this.config.sweep || 0;
+        const { atlas } = this.geometry;
+        const bands = sweep > 0 ? (atlas || this.geometry.getGrid()).rows : 1;
+        const levelCount = atlas ? atlas.levels : this.geometry.getLevelCount();
         
-        // Process segments level by level
+        // Process paths level by level
         let levelDelay = 0;
-        for (const [level, segments] of segmentsByLevel) {
-            const levelContainer = new PIXI.Container();
-            container.addChild(levelContainer);
-            
-            // Process segments within this level
-            segments.forEach((segment, segmentIndex) => {
-                const graphics = new PIXI.Graphics();
-                graphics.lineStyle(1, 0xFFFFFF);
-                
-                // Normalize coordinates to -0.5 to 0.5 range (centered)
-                const startX = (segment.start.x / dimensions.width - 0.5) * containerWidth;
-                const startY = (segment.start.y / dimensions.height - 0.5) * containerHeight;
-                const endX = (segment.end.x / dimensions.width - 0.5) * containerWidth;
-                const endY = (segment.end.y / dimensions.height - 0.5) * containerHeight;
-                
-                graphics.moveTo(startX, startY);
-                graphics.lineTo(endX, endY);
-                
-                levelContainer.addChild(graphics);
-            });
+        for (let level = 0; level < levelCount; level++) {
+            for (let band = 0; band < bands; band++) {
+                const row = sweep > 0 ? band : null;
+                const levelContainer = atlas
+                    ? this.createBandSprites(level, row, dimensions, containerWidth, containerHeight)
+                    : this.createBandGraphics(level, row, dimensions, containerWidth, containerHeight);
+                if (!levelContainer) {
+                    continue;
+                }
+                container.addChild(levelContainer);
             
-            // Set initial position for level container
-            levelContainer.y = FALL_OFFSET;
-            levelContainer.alpha = 0;
+                // Set initial position for level container
+                levelContainer.y = FALL_OFFSET;
+                levelContainer.alpha = 0;
             
-            // Calculate timing for this level
-            const segmentDelay = levelDelay;
-            levelDelay += this.config.fallDuration * 0.5; // Overlap levels slightly
+                // Calculate timing for this band
+                const segmentDelay = levelDelay + this.getRowDelay(band, bands, sweep);
             
-            // Animate the entire level
-            tl.to(levelContainer, {
-                alpha: 1,
-                duration: 0.1
-            }, segmentDelay);
+                // Animate the entire band
+                tl.to(levelContainer, {
+                    alpha: 1,
+                    duration: 0.1
+                }, segmentDelay);
             
-            tl.to(levelContainer, {
-                y: 0,
-                duration: this.config.fallDuration,
-                ease: "power2.out"
-            }, segmentDelay);
+                tl.to(levelContainer, {
+                    y: 0,
+                    duration: this.config.fallDuration,
+                    ease: "power2.out"
+                }, segmentDelay);
+            }
+            levelDelay += this.config.fallDuration * 0.5; // Overlap levels slightly
         }
     
         // Add fades
@@ -170,10 +220,11 @@ export class FallingAnimation {
             timeline.kill();
         }
 
-        // Remove all segment containers and their graphics
+        // Remove all segment containers and their graphics; atlas sprites
+        // share their page's base texture, which stays loaded
         segmentContainers.forEach(segmentContainer => {
             segmentContainer.children.forEach(graphic => {
-                graphic.destroy(true);
+                graphic.destroy({ texture: true, baseTexture: false });
             });
             segmentContainer.removeChildren();
             container.removeChild(segmentContainer);
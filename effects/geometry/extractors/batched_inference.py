@@ -0,0 +1,167 @@
+"""
+Batched lineart inference.
+
+``LineartDetector.__call__`` handles one image at one resolution: every call
+converts and resizes the input, builds a new tensor, runs the generator and
+resizes the result again. ``LineartBatch`` drives the generator directly
+instead:
+
+- an image is decoded and converted once for all its resolution levels;
+- images with the same detection size (bulk precomputation) run as one batch,
+  as many at a time as fit the detection memory ceiling;
+- input arrays are preallocated per batch shape and reused between calls;
+- torch's intra-op thread count can be set explicitly.
+
+The network itself runs on the configured detector backend (see
+detector_backends.py).
+
+The maps are the ones ``detect_lineart`` returns for the same resolution.
+Levels of one image have different sizes, so they are not stacked into one
+tensor (padding them would change the output near the borders); with
+``level_source='derive'`` only the highest level runs through the model and
+the lower ones are area-downsampled from its map, which is faster but not
+identical to detecting at each resolution.
+
+``PILE_TORCH_THREADS`` sets the intra-op thread count. Without it the count
+is left alone: torch's default, or in job workers the share of the cores
+``jobs._init_worker`` gives each of them.
+"""
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from effects.geometry.extractors.detector_backends import get_backend, resize_shape
+from effects.geometry.extractors.tiled_detection import BYTES_PER_PIXEL, DEFAULT_MAX_BYTES
+
+LEVEL_SOURCES = ('detect', 'derive')
+
+# Input arrays kept for reuse, per thread (one per batch shape)
+_INPUTS_KEPT = 4
+
+_threads_configured = False
+
+
+def configure_threads(threads=None):
+    """
+    Set torch's intra-op thread count to ``threads``, or once per process to
+    ``PILE_TORCH_THREADS`` if that is set; returns the count in effect.
+    """
+    import torch
+    global _threads_configured
+    if threads is None and not _threads_configured:
+        value = os.environ.get('PILE_TORCH_THREADS')
+        threads = int(value) if value else None
+        _threads_configured = True
+    if threads is not None:
+        torch.set_num_threads(max(1, threads))
+    return torch.get_num_threads()
+
+
+def detection_shape(height, width, resolution):
+    """(height, width) of the lineart map at ``resolution`` for an image of this size."""
+    # The detector resizes its input, then sizes the output from that input again
+    return resize_shape(*resize_shape(height, width, resolution), resolution)
+
+
+def derive_level(edge_map, height, width, resolution):
+    """A lower level's map area-downsampled from a higher level's ``edge_map``."""
+    target = detection_shape(height, width, resolution)
+    if edge_map.shape[:2] == target:
+        return np.array(edge_map)
+    return cv2.resize(np.asarray(edge_map), (target[1], target[0]), interpolation=cv2.INTER_AREA)
+
+
+class LineartBatch:
+    def __init__(self, max_bytes=None, backend=None):
+        value = os.environ.get('PILE_DETECTION_MAX_BYTES')
+        self.max_bytes = max_bytes or (int(value) if value else DEFAULT_MAX_BYTES)
+        self.backend = backend
+        # Tiles are detected from several threads at once
+        self._local = threading.local()
+
+    def _input(self, count, height, width):
+        """The reused float32 input array for a batch of this shape."""
+        inputs = getattr(self._local, 'inputs', None)
+        if inputs is None:
+            inputs = self._local.inputs = {}
+        shape = (count, 3, height, width)
+        batch = inputs.pop(shape, None)
+        if batch is None:
+            batch = np.empty(shape, dtype=np.float32)
+        inputs[shape] = batch
+        if len(inputs) > _INPUTS_KEPT:
+            del inputs[next(iter(inputs))]
+        return batch
+
+    def batch_size(self, height, width):
+        """Images of this detection size that may run at once."""
+        return max(1, self.max_bytes // (BYTES_PER_PIXEL['lineart'] * height * width))
+
+    def run(self, images):
+        """
+        Lineart maps of HWC3 uint8 ``images`` that are already at their
+        detection size (all the same shape).
+        """
+        configure_threads()
+        backend = self.backend or get_backend()
+        height, width = images[0].shape[:2]
+        limit = self.batch_size(height, width)
+        maps = []
+        for start in range(0, len(images), limit):
+            chunk = images[start:start + limit]
+            batch = self._input(len(chunk), height, width)
+            for i, image in enumerate(chunk):
+                batch[i] = image.transpose(2, 0, 1)
+            batch /= 255.0
+            lines = backend.run('lineart', batch)[0][:, 0]
+            for line in lines:
+                maps.append(255 - (line * 255.0).clip(0, 255).astype(np.uint8))
+        return maps
+
+    def edge_maps(self, images, resolutions, level_source='detect'):
+        """
+        One ``{resolution: edge_map}`` dict per HWC3 uint8 image. Each
+        resolution runs once for all images, batched by detection size.
+        """
+        from controlnet_aux.util import resize_image
+        if level_source not in LEVEL_SOURCES:
+            raise ValueError(f"Unknown level source: {level_source}")
+        results = [{} for _ in images]
+        if not resolutions:
+            return results
+        detected = [max(resolutions)] if level_source == 'derive' else list(resolutions)
+
+        for resolution in detected:
+            groups = {}
+            for index, image in enumerate(images):
+                resized = resize_image(image, resolution)
+                groups.setdefault(resized.shape[:2], []).append((index, resized))
+            for shape, members in groups.items():
+                maps = self.run([resized for _, resized in members])
+                target = detection_shape(*images[members[0][0]].shape[:2], resolution)
+                for (index, _), edge_map in zip(members, maps):
+                    if edge_map.shape != target:
+                        edge_map = cv2.resize(edge_map, (target[1], target[0]), interpolation=cv2.INTER_LINEAR)
+                    results[index][resolution] = edge_map
+
+        if level_source == 'derive':
+            top = detected[0]
+            for index, image in enumerate(images):
+                height, width = image.shape[:2]
+                for resolution in resolutions:
+                    if resolution != top:
+                        results[index][resolution] = derive_level(results[index][top], height, width, resolution)
+        return results
+
+
+_batch = None
+
+
+def lineart_batch():
+    """The process-wide ``LineartBatch`` (its input arrays are reused)."""
+    global _batch
+    if _batch is None:
+        _batch = LineartBatch()
+    return _batch
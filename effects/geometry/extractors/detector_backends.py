@@ -0,0 +1,287 @@
+"""
+Inference backends for the geometry detectors.
+
+The lineart generator and the HED network are fully convolutional. A backend
+runs one of them on an NCHW float32 batch, preprocessed as controlnet_aux
+does, and returns the network's outputs as numpy arrays:
+
+``torch``
+    The controlnet_aux modules in fp32: the reference.
+``onnx``
+    ONNX Runtime sessions of the same networks, exported once from the
+    resident torch models (that is, from the locally cached weights).
+``quantized``
+    The exported graphs with int8 weights (ONNX Runtime dynamic
+    quantization).
+
+``PILE_DETECTOR_BACKEND`` selects the backend (default ``torch``) and
+``PILE_ONNX_DIR`` where exported graphs are kept. The ONNX backends need the
+``onnx`` extra (``onnx`` and ``onnxruntime``). Their maps differ slightly from
+torch's, so edge maps and geometry are stored under backend-specific keys.
+Export ahead of time and compare a backend against torch with::
+
+    python -m effects.geometry.extractors.detector_backends export --backend quantized
+    python -m effects.geometry.extractors.detector_backends check --backend quantized assets/images/page1.png
+"""
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from effects.geometry.extractors.model_registry import get_model
+
+BACKENDS = ('torch', 'onnx', 'quantized')
+
+DEFAULT_ONNX_DIR = Path(__file__).resolve().parents[3] / 'assets' / 'geometry' / 'onnx'
+
+# The torch module inside each controlnet_aux detector
+NETWORKS = {
+    'lineart': 'model',
+    'hed': 'netNetwork',
+}
+
+ONNX_OPSET = 17
+
+
+def resize_shape(height, width, resolution):
+    """(height, width) controlnet_aux's ``resize_image`` gives: shorter side to ``resolution``, multiples of 64."""
+    k = float(resolution) / min(height, width)
+    return int(np.round(height * k / 64.0)) * 64, int(np.round(width * k / 64.0)) * 64
+
+
+def network(detector):
+    """The torch network of a registered detector."""
+    return getattr(get_model(detector), NETWORKS[detector])
+
+
+def weights_digest(module):
+    """Short hash of a module's weights, naming its exported graphs."""
+    sha = hashlib.sha256()
+    for name, tensor in module.state_dict().items():
+        sha.update(name.encode())
+        sha.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return sha.hexdigest()[:16]
+
+
+class TorchBackend:
+    name = 'torch'
+
+    def run(self, detector, batch):
+        import torch
+        module = network(detector)
+        device = next(module.parameters()).device
+        with torch.no_grad():
+            outputs = module(torch.from_numpy(batch).to(device))
+        if isinstance(outputs, torch.Tensor):
+            outputs = [outputs]
+        return [output.cpu().numpy() for output in outputs]
+
+
+class OnnxBackend:
+    name = 'onnx'
+    quantized = False
+
+    def __init__(self, root=None):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise RuntimeError(f"The {self.name} detector backend needs onnxruntime and onnx "
+                               "(pip install 'pile[onnx]')") from e
+        self._ort = onnxruntime
+        self.root = Path(root or os.environ.get('PILE_ONNX_DIR', DEFAULT_ONNX_DIR))
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def graph_path(self, detector):
+        """Where the graph of ``detector`` lives, exporting it on first use."""
+        module = network(detector)
+        path = self.root / f"{detector}-{weights_digest(module)}.onnx"
+        if not path.exists():
+            export_onnx(module, path)
+        if not self.quantized:
+            return path
+        quantized = path.with_suffix('.int8.onnx')
+        if not quantized.exists():
+            quantize_onnx(path, quantized)
+        return quantized
+
+    def session(self, detector):
+        with self._lock:
+            session = self._sessions.get(detector)
+            if session is None:
+                import torch
+                options = self._ort.SessionOptions()
+                options.intra_op_num_threads = torch.get_num_threads()
+                session = self._ort.InferenceSession(
+                    str(self.graph_path(detector)), options, providers=['CPUExecutionProvider'])
+                self._sessions[detector] = session
+        return session
+
+    def run(self, detector, batch):
+        session = self.session(detector)
+        return session.run(None, {session.get_inputs()[0].name: np.ascontiguousarray(batch)})
+
+
+class QuantizedBackend(OnnxBackend):
+    name = 'quantized'
+    quantized = True
+
+
+_BACKEND_CLASSES = {
+    'torch': TorchBackend,
+    'onnx': OnnxBackend,
+    'quantized': QuantizedBackend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def backend_name():
+    name = os.environ.get('PILE_DETECTOR_BACKEND') or 'torch'
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown detector backend: {name}")
+    return name
+
+
+def get_backend(name=None):
+    """The shared backend ``name`` (default: the configured one)."""
+    name = name or backend_name()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown detector backend: {name}")
+    with _backends_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            backend = _backends[name] = _BACKEND_CLASSES[name]()
+    return backend
+
+
+def store_name(detector, backend=None):
+    """Edge-map store name of ``detector``'s maps; torch keeps the plain name."""
+    name = backend.name if backend is not None else backend_name()
+    return detector if name == 'torch' else f"{detector}-{name}"
+
+
+def _write_atomic(path, write):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def export_onnx(module, path):
+    """Export a detector network with dynamic batch and image size."""
+    import torch
+    start = time.perf_counter()
+    example = torch.zeros(1, 3, 256, 256)
+    with torch.no_grad():
+        outputs = module(example)
+    count = 1 if isinstance(outputs, torch.Tensor) else len(outputs)
+    output_names = [f"output{i}" for i in range(count)]
+    dynamic_axes = {name: {0: 'batch', 2: 'height', 3: 'width'} for name in ['image'] + output_names}
+    _write_atomic(Path(path), lambda tmp_path: torch.onnx.export(
+        module.eval(), example, str(tmp_path),
+        input_names=['image'], output_names=output_names,
+        dynamic_axes=dynamic_axes, opset_version=ONNX_OPSET, dynamo=False))
+    print(f"Exported {path.name} in {time.perf_counter() - start:.1f}s")
+
+
+def quantize_onnx(path, quantized_path):
+    """int8 weights for an exported graph (activations are quantized on the fly)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    start = time.perf_counter()
+    _write_atomic(Path(quantized_path), lambda tmp_path: quantize_dynamic(
+        str(path), str(tmp_path), weight_type=QuantType.QUInt8))
+    print(f"Quantized {Path(quantized_path).name} in {time.perf_counter() - start:.1f}s")
+
+
+def compare_maps(reference, candidate, threshold=0.3):
+    """Differences between two uint8 edge maps of the same detector."""
+    difference = np.abs(reference.astype(np.int16) - candidate.astype(np.int16))
+    level = int(threshold * 255)
+    return {
+        'mean_abs_diff': float(difference.mean()),
+        'max_abs_diff': int(difference.max()),
+        # Share of pixels on the same side of the extraction threshold
+        'agreement': float(np.mean((reference > level) == (candidate > level))),
+    }
+
+
+def check_backend(name, image_paths, resolution=512):
+    """Compare ``name``'s edge maps and timing with the torch reference."""
+    import cv2
+    from controlnet_aux.util import HWC3
+    from effects.geometry.extractors.batched_inference import LineartBatch
+    from effects.geometry.extractors.pointcloud_processor import detect_hed
+
+    detectors = {
+        'lineart': lambda image, backend: LineartBatch(backend=backend).edge_maps(
+            [image], [resolution])[0][resolution],
+        'hed': lambda image, backend: detect_hed(image, resolution, backend=backend),
+    }
+    reference, candidate = get_backend('torch'), get_backend(name)
+    results = []
+    for image_path in image_paths:
+        image = HWC3(cv2.imread(str(image_path)))
+        for detector, detect in detectors.items():
+            # First calls export graphs and warm up; time the second
+            detect(image, reference)
+            detect(image, candidate)
+            timings = {}
+            maps = {}
+            for backend in (reference, candidate):
+                start = time.perf_counter()
+                maps[backend.name] = detect(image, backend)
+                timings[backend.name] = time.perf_counter() - start
+            results.append(dict(
+                compare_maps(maps['torch'], maps[name]),
+                image=Path(image_path).name,
+                detector=detector,
+                torch_seconds=timings['torch'],
+                seconds=timings[name],
+            ))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export detector graphs and check backend quality')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help='Export (and quantize) the detector graphs')
+    export.add_argument('--backend', choices=BACKENDS[1:], default='quantized')
+    check = commands.add_parser('check', help='Compare a backend\'s edge maps with torch')
+    check.add_argument('--backend', choices=BACKENDS[1:], default='quantized')
+    check.add_argument('--resolution', type=int, default=512)
+    check.add_argument('--min-agreement', type=float, default=0.99,
+                       help='Fail when fewer pixels than this agree with torch at the threshold')
+    check.add_argument('images', nargs='+')
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        backend = get_backend(args.backend)
+        for detector in NETWORKS:
+            print(backend.graph_path(detector))
+        return
+
+    failed = False
+    for result in check_backend(args.backend, args.images, args.resolution):
+        ok = result['agreement'] >= args.min_agreement
+        failed = failed or not ok
+        print(f"{result['image']:<16} {result['detector']:<8} "
+              f"agreement {result['agreement'] * 100:6.2f}%  "
+              f"mean diff {result['mean_abs_diff']:5.2f}  max diff {result['max_abs_diff']:3d}  "
+              f"{result['torch_seconds']:6.2f}s -> {result['seconds']:6.2f}s "
+              f"({result['torch_seconds'] / result['seconds']:.2f}x)  {'ok' if ok else 'FAIL'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Persistent store of raw detector outputs.
+
+The neural detectors are by far the most expensive part of extraction, while
+``threshold``, ``min_length`` and ``num_points`` only affect the cheap
+post-processing. Detector outputs (one lineart map per resolution, the HED map
+for pointclouds) are saved as ``.npy`` files keyed on the image content hash,
+detector and resolution, and loaded back memory-mapped, so re-extracting with
+new post-processing parameters never touches the models.
+"""
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+# Bump whenever detector preprocessing changes so stale maps stop matching
+STORE_VERSION = 1
+
+DEFAULT_ROOT = Path(__file__).resolve().parents[3] / 'assets' / 'geometry' / 'edges'
+DEFAULT_MAX_BYTES = 2 << 30
+
+
+# EXIF orientations that swap width and height (cv2.imread applies them)
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+_image_sizes = {}
+
+
+def image_size(image_path):
+    """
+    (width, height) as cv2.imread would decode it, reading only the header;
+    memoized on path, size and mtime.
+    """
+    stat = os.stat(image_path)
+    memo_key = (str(image_path), stat.st_size, stat.st_mtime_ns)
+    size = _image_sizes.get(memo_key)
+    if size is None:
+        with Image.open(image_path) as image:
+            width, height = image.size
+            # PIL decodes a whole PNG to look for an EXIF chunk after the
+            # pixels; one ahead of them is already in info
+            if image.format != 'PNG' or 'exif' in image.info:
+                if image.getexif().get(0x0112) in _TRANSPOSED_ORIENTATIONS:
+                    width, height = height, width
+        size = _image_sizes[memo_key] = (width, height)
+    return size
+
+
+class MissingEdgeMap(LookupError):
+    """Raised when a map is needed but detection is not allowed."""
+
+
+class EdgeMapStore:
+    def __init__(self, root=DEFAULT_ROOT, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+
+    def image_dir(self, image_hash):
+        return self.root / f"v{STORE_VERSION}" / image_hash[:2] / image_hash
+
+    def path_for(self, image_hash, detector, resolution):
+        return self.image_dir(image_hash) / f"{detector}_{resolution}.npy"
+
+    def load(self, image_hash, detector, resolution):
+        """Return the stored map as a read-only memmap, or None."""
+        path = self.path_for(image_hash, detector, resolution)
+        try:
+            edge_map = np.load(path, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return None
+        os.utime(path.parent)
+        return edge_map
+
+    def has(self, image_hash, detector, resolution):
+        return self.path_for(image_hash, detector, resolution).exists()
+
+    def save(self, image_hash, detector, resolution, edge_map):
+        path = self.path_for(image_hash, detector, resolution)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.ascontiguousarray(edge_map))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.prune()
+
+    def get_or_compute(self, image_hash, detector, resolution, compute, allow_detect=True):
+        """
+        Return the stored map, running ``compute()`` and storing its result on
+        a miss. With ``allow_detect=False`` a miss raises MissingEdgeMap.
+        """
+        edge_map = self.load(image_hash, detector, resolution)
+        if edge_map is not None:
+            return edge_map
+        if not allow_detect:
+            raise MissingEdgeMap(f"No {detector} map at {resolution} for image {image_hash[:12]}")
+        edge_map = compute()
+        self.save(image_hash, detector, resolution, edge_map)
+        return edge_map
+
+    def prune(self, max_bytes=None):
+        """Remove least recently used images' maps until the store fits in ``max_bytes``."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if max_bytes is None or not self.root.exists():
+            return []
+        images = []
+        for image_dir in self.root.glob('v*/*/*'):
+            if not image_dir.is_dir():
+                continue
+            try:
+                size = sum(f.stat().st_size for f in image_dir.iterdir())
+                images.append((image_dir.stat().st_mtime, size, image_dir))
+            except FileNotFoundError:
+                continue
+        images.sort()
+        total = sum(size for _, size, _ in images)
+        removed = []
+        for _, size, image_dir in images:
+            if total <= max_bytes:
+                break
+            shutil.rmtree(image_dir, ignore_errors=True)
+            total -= size
+            removed.append(image_dir.name)
+        return removed
+
+
+def default_store():
+    max_bytes = os.environ.get('PILE_EDGE_STORE_MAX_BYTES')
+    return EdgeMapStore(
+        root=os.environ.get('PILE_EDGE_STORE_DIR', DEFAULT_ROOT),
+        max_bytes=int(max_bytes) if max_bytes else DEFAULT_MAX_BYTES,
+    )
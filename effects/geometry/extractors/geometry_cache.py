@@ -0,0 +1,249 @@
+"""
+Content-addressed cache of generated geometry.
+
+Entries are keyed on the SHA-256 of the source image bytes, the geometry type
+and its extraction options, so re-saving a scene whose image and geometry
+settings have not changed copies the cached files instead of re-running the
+detectors. Each entry is a directory holding the geometry files (named
+``geometry<suffix>``) and a ``meta.json`` whose mtime records the last use;
+the least recently used entries are evicted once the cache exceeds
+``max_bytes``.
+
+Inspect and prune the cache with::
+
+    python -m effects.geometry.extractors.geometry_cache stats
+    python -m effects.geometry.extractors.geometry_cache list
+    python -m effects.geometry.extractors.geometry_cache prune --max-bytes 500000000
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+# Bump whenever extraction output changes so stale entries stop matching
+CACHE_VERSION = 5
+
+DEFAULT_ROOT = Path(__file__).resolve().parents[3] / 'assets' / 'geometry' / 'cache'
+DEFAULT_MAX_BYTES = 1 << 30
+
+ENTRY_PREFIX = 'geometry'
+META_FILE = 'meta.json'
+
+# The files of one geometry, by what follows the JSON file's stem: the JSON,
+# its packed binary and LOD tiers, and its sprite atlas
+GEOMETRY_SUFFIX = re.compile(r'\.(json|bin|lod\d+\.bin|atlas\.json|atlas\d+\.png)')
+
+_image_hashes = {}
+
+
+def hash_image(image_path):
+    """SHA-256 of an image file, memoized on path, size and mtime."""
+    stat = os.stat(image_path)
+    memo_key = (str(image_path), stat.st_size, stat.st_mtime_ns)
+    digest = _image_hashes.get(memo_key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        _image_hashes[memo_key] = digest
+    return digest
+
+
+def cache_key(image_path, geometry_type, options):
+    params = json.dumps({
+        'version': CACHE_VERSION,
+        'image': hash_image(image_path),
+        'type': geometry_type,
+        'options': options,
+    }, sort_keys=True)
+    return hashlib.sha256(params.encode()).hexdigest()
+
+
+def geometry_files(output_path):
+    """The existing files of the geometry written to ``output_path``, itself included."""
+    output_path = Path(output_path)
+    stem = output_path.stem
+    return [
+        path for path in output_path.parent.glob(f"{glob.escape(stem)}.*")
+        if GEOMETRY_SUFFIX.fullmatch(path.name[len(stem):]) and path.is_file()
+    ]
+
+
+def _dir_size(path):
+    return sum(f.stat().st_size for f in Path(path).iterdir() if f.is_file())
+
+
+class GeometryCache:
+    def __init__(self, root=DEFAULT_ROOT, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+
+    def entry_dir(self, key):
+        return self.root / key[:2] / key
+
+    def get(self, key):
+        """Return the metadata of entry ``key`` and mark it used, or None on a miss."""
+        meta_path = self.entry_dir(key) / META_FILE
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            os.utime(meta_path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return meta
+
+    def fetch(self, key, output_path):
+        """
+        Copy entry ``key`` to ``output_path`` (and its sibling files); returns
+        the entry metadata, or None on a miss.
+        """
+        meta = self.get(key)
+        if meta is None:
+            return None
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        entry = self.entry_dir(key)
+        try:
+            # The JSON last, as the pipeline writes it
+            for src in sorted(entry.iterdir(), key=lambda src: src.name == f"{ENTRY_PREFIX}.json"):
+                if not (src.name.startswith(ENTRY_PREFIX)
+                        and GEOMETRY_SUFFIX.fullmatch(src.name[len(ENTRY_PREFIX):])):
+                    continue
+                dest = output_path.with_name(output_path.stem + src.name[len(ENTRY_PREFIX):])
+                fd, tmp_path = tempfile.mkstemp(dir=dest.parent, prefix=f".{dest.name}.", suffix='.tmp')
+                os.close(fd)
+                shutil.copyfile(src, tmp_path)
+                os.replace(tmp_path, dest)
+        except FileNotFoundError:
+            # Evicted by another process while copying
+            return None
+        return meta
+
+    def put(self, key, output_path, meta=None):
+        """Store ``output_path`` and its sibling geometry files as entry ``key``."""
+        output_path = Path(output_path)
+        entry = self.entry_dir(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+
+        # Build the entry beside its final location, then move it into place
+        tmp_entry = Path(tempfile.mkdtemp(dir=entry.parent, prefix=f".{key}."))
+        try:
+            for src in geometry_files(output_path):
+                shutil.copyfile(src, tmp_entry / (ENTRY_PREFIX + src.name[len(output_path.stem):]))
+            with open(tmp_entry / META_FILE, 'w') as f:
+                json.dump(dict(meta or {}, key=key, created_at=time.time()), f)
+            try:
+                os.rename(tmp_entry, entry)
+            except OSError:
+                # Another worker stored the same entry first
+                shutil.rmtree(tmp_entry, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            raise
+
+        self.prune()
+
+    def entries(self):
+        """List entries as dicts, least recently used first."""
+        entries = []
+        if not self.root.exists():
+            return entries
+        for shard in self.root.iterdir():
+            if not shard.is_dir():
+                continue
+            for entry in shard.iterdir():
+                meta_path = entry / META_FILE
+                if entry.name.startswith('.') or not meta_path.exists():
+                    continue
+                try:
+                    with open(meta_path) as f:
+                        meta = json.load(f)
+                    entries.append(dict(
+                        meta,
+                        key=entry.name,
+                        bytes=_dir_size(entry),
+                        last_used=meta_path.stat().st_mtime,
+                    ))
+                except (FileNotFoundError, json.JSONDecodeError):
+                    continue
+        entries.sort(key=lambda e: e['last_used'])
+        return entries
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            'root': str(self.root),
+            'entries': len(entries),
+            'bytes': sum(e['bytes'] for e in entries),
+            'max_bytes': self.max_bytes,
+        }
+
+    def prune(self, max_bytes=None):
+        """Evict least recently used entries until the cache fits in ``max_bytes``."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if max_bytes is None:
+            return []
+        entries = self.entries()
+        total = sum(e['bytes'] for e in entries)
+        evicted = []
+        for entry in entries:
+            if total <= max_bytes:
+                break
+            self.remove(entry['key'])
+            total -= entry['bytes']
+            evicted.append(entry['key'])
+        return evicted
+
+    def remove(self, key):
+        shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+
+
+def default_cache():
+    max_bytes = os.environ.get('PILE_GEOMETRY_CACHE_MAX_BYTES')
+    return GeometryCache(
+        root=os.environ.get('PILE_GEOMETRY_CACHE_DIR', DEFAULT_ROOT),
+        max_bytes=int(max_bytes) if max_bytes else DEFAULT_MAX_BYTES,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect and prune the geometry cache')
+    parser.add_argument('--root', default=None, help='Cache directory (default: assets/geometry/cache)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help='Show entry count and total size')
+    commands.add_parser('list', help='List entries, least recently used first')
+    prune = commands.add_parser('prune', help='Evict least recently used entries')
+    prune.add_argument('--max-bytes', type=int, default=None,
+                       help='Target size (default: the configured cap)')
+    commands.add_parser('clear', help='Remove every entry')
+    args = parser.parse_args(argv)
+
+    cache = default_cache()
+    if args.root:
+        cache.root = Path(args.root)
+
+    if args.command == 'stats':
+        print(json.dumps(cache.stats(), indent=2))
+    elif args.command == 'list':
+        for entry in cache.entries():
+            last_used = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['last_used']))
+            print(f"{entry['key'][:16]}  {entry.get('type', '?'):<10}  {entry['bytes']:>10}  "
+                  f"{last_used}  {entry.get('image', '')}")
+    elif args.command == 'prune':
+        evicted = cache.prune(args.max_bytes)
+        print(f"Evicted {len(evicted)} entries")
+    elif args.command == 'clear':
+        evicted = cache.prune(0)
+        print(f"Evicted {len(evicted)} entries")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+"""
+Packed binary geometry format.
+
+The JSON geometry files spell out every coordinate as a keyed object, which
+is several times larger than the numbers themselves and slow to parse in the
+browser. The binary form is a fixed little-endian header, the level offsets
+and one flat coordinate array, laid out so the client can wrap each part in a
+typed array without copying (see core/geometry-format.js):
+
+    offset  type      field
+    0       4s        magic, b'PGEO'
+    4       u16       format version
+    6       u8        kind: 1 = segments (x0, y0, x1, y1), 2 = points (x, y),
+                      3 = polylines (x, y vertices)
+    7       u8        encoding: 0 = float32, 1 = uint16 quantized to width/height
+    8       u32       source image width (0 if unknown)
+    12      u32       source image height (0 if unknown)
+    16      u32       level count L
+    20      u32       item count N (segments, points or polylines)
+    24      u32       components per coordinate row (4 for segments, else 2)
+    28      u32       vertex count V for polylines, otherwise 0
+    32      u32[L+1]  level offsets, in items
+    ...     u32[N+1]  polylines only: path offsets, in vertices
+    ...     f32|u16   coordinates, N rows (V rows for polylines)
+
+Polylines in grid order (see spatial_index.py) may be followed by their grid
+index, starting at the next multiple of 4 bytes:
+
+    0       4s        magic, b'PGRD'
+    4       u32       grid columns C
+    8       u32       grid rows R
+    12      u32[L, C*R+1]  per level, the first path of each cell (row-major)
+                      and the level's end
+
+Every other length comes from the header, so readers that do not know the
+index just ignore it.
+
+Quantized coordinates store ``round(x / width * 65535)``, well under a pixel
+of error for any image we display.
+"""
+import struct
+
+import numpy as np
+
+import effects.geometry.extractors.spatial_index as spatial_index
+
+MAGIC = b'PGEO'
+VERSION = 1
+MIME_TYPE = 'application/vnd.pile.geometry'
+
+KIND_SEGMENTS = 1
+KIND_POINTS = 2
+KIND_POLYLINES = 3
+COMPONENTS = {KIND_SEGMENTS: 4, KIND_POINTS: 2, KIND_POLYLINES: 2}
+
+ENCODING_FLOAT32 = 0
+ENCODING_UINT16 = 1
+QUANT_MAX = 65535
+
+_HEADER = struct.Struct('<4sHBBIIIIII')
+HEADER_SIZE = _HEADER.size
+
+GRID_MAGIC = b'PGRD'
+_GRID_HEADER = struct.Struct('<4sII')
+
+
+def encode_geometry(kind, coords, level_offsets, width=0, height=0, quantize=True, path_offsets=None,
+                    grid=None):
+    """
+    Pack an (N, components) coordinate array into the binary format;
+    polylines also need their ``path_offsets`` and may carry a ``grid`` index
+    (as ``spatial_index.grid_index`` returns it).
+
+    Coordinates are quantized to uint16 when ``quantize`` is set and the
+    image dimensions are known, and stored as float32 otherwise.
+    """
+    components = COMPONENTS[kind]
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, components)
+    level_offsets = np.asarray(level_offsets, dtype='<u4')
+    if kind == KIND_POLYLINES:
+        path_offsets = np.asarray(path_offsets, dtype='<u4')
+        item_count, vertex_count = len(path_offsets) - 1, len(coords)
+        offsets = level_offsets.tobytes() + path_offsets.tobytes()
+    else:
+        item_count, vertex_count = len(coords), 0
+        offsets = level_offsets.tobytes()
+
+    if quantize and width and height:
+        encoding = ENCODING_UINT16
+        extent = np.array([width, height] * (components // 2), dtype=np.float64)
+        packed = np.rint(np.clip(coords / extent, 0.0, 1.0) * QUANT_MAX).astype('<u2')
+    else:
+        encoding = ENCODING_FLOAT32
+        packed = coords.astype('<f4')
+
+    header = _HEADER.pack(MAGIC, VERSION, kind, encoding, int(width), int(height),
+                          len(level_offsets) - 1, item_count, components, vertex_count)
+    data = header + offsets + packed.tobytes()
+    if grid is not None:
+        data += _grid_bytes(len(data), grid)
+    return data
+
+
+def _grid_bytes(offset, grid):
+    """The grid index section for data ending at ``offset``, padded to 4 bytes."""
+    return (b'\0' * (-offset % 4)
+            + _GRID_HEADER.pack(GRID_MAGIC, grid['cols'], grid['rows'])
+            + np.asarray(grid['cell_offsets'], dtype='<u4').tobytes())
+
+
+def _read_grid(data, offset, level_count):
+    """The grid index following coordinates that end at ``offset``, or None."""
+    offset += -offset % 4
+    if len(data) < offset + _GRID_HEADER.size:
+        return None
+    magic, cols, rows = _GRID_HEADER.unpack_from(data, offset)
+    if magic != GRID_MAGIC:
+        return None
+    cells = cols * rows + 1
+    cell_offsets = np.frombuffer(data, dtype='<u4', count=level_count * cells, offset=offset + _GRID_HEADER.size)
+    return {'cols': cols, 'rows': rows, 'cell_offsets': cell_offsets.reshape(level_count, cells)}
+
+
+def read_header(data):
+    """Parse the fixed header (the first ``HEADER_SIZE`` bytes are enough)."""
+    magic, version, kind, encoding, width, height, level_count, item_count, components, vertex_count = \
+        _HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('Not a pile geometry file')
+    if version != VERSION:
+        raise ValueError(f"Unsupported geometry format version {version}")
+    return {
+        'kind': kind,
+        'encoding': encoding,
+        'width': width,
+        'height': height,
+        'level_count': level_count,
+        'item_count': item_count,
+        'components': components,
+        'vertex_count': vertex_count,
+    }
+
+
+def detail_count(header):
+    """Segments (lineart) or points in a geometry: the unit of client item budgets."""
+    if header['kind'] == KIND_POLYLINES:
+        return header['vertex_count'] - header['item_count']
+    return header['item_count']
+
+
+def truncate_geometry(data, max_items):
+    """
+    Keep only the first ``max_items`` segments or points of packed geometry
+    (whole polylines only), clamping the offsets and any grid index. Later
+    levels (finer lineart resolutions) and less important points are the
+    ones dropped.
+    """
+    header = read_header(data)
+    if detail_count(header) <= max_items:
+        return data
+
+    level_count = header['level_count']
+    level_offsets = np.frombuffer(data, dtype='<u4', count=level_count + 1, offset=HEADER_SIZE)
+    offset = HEADER_SIZE + level_offsets.nbytes
+    row_size = header['components'] * (2 if header['encoding'] == ENCODING_UINT16 else 4)
+
+    grid = None
+    if header['kind'] == KIND_POLYLINES:
+        path_offsets = np.frombuffer(data, dtype='<u4', count=header['item_count'] + 1, offset=offset)
+        offset += path_offsets.nbytes
+        grid = _read_grid(data, offset + header['vertex_count'] * row_size, level_count)
+        # Segments before path i are path_offsets[i] - i
+        segments_before = path_offsets.astype(np.int64) - np.arange(len(path_offsets))
+        item_count = int(np.searchsorted(segments_before, max_items, side='right')) - 1
+        rows = int(path_offsets[item_count])
+        vertex_count = rows
+        offsets = np.minimum(level_offsets, item_count).astype('<u4').tobytes() \
+            + path_offsets[:item_count + 1].tobytes()
+    else:
+        item_count = rows = max_items
+        vertex_count = 0
+        offsets = np.minimum(level_offsets, item_count).astype('<u4').tobytes()
+
+    truncated = (
+        _HEADER.pack(MAGIC, VERSION, header['kind'], header['encoding'], header['width'], header['height'],
+                     level_count, item_count, header['components'], vertex_count)
+        + offsets
+        + bytes(data[offset:offset + rows * row_size])
+    )
+    if grid is not None:
+        grid = dict(grid, cell_offsets=np.minimum(grid['cell_offsets'], item_count))
+        truncated += _grid_bytes(len(truncated), grid)
+    return truncated
+
+
+def decode_geometry(data):
+    """
+    Unpack binary geometry into a dict of arrays. Coordinates are returned as
+    float32 in image space; the offset arrays are views into ``data``.
+    Polylines with a grid index also get ``grid``.
+    """
+    header = read_header(data)
+    kind, encoding = header['kind'], header['encoding']
+    width, height = header['width'], header['height']
+    level_count, item_count, components = header['level_count'], header['item_count'], header['components']
+
+    offset = HEADER_SIZE
+    level_offsets = np.frombuffer(data, dtype='<u4', count=level_count + 1, offset=offset)
+    offset += level_offsets.nbytes
+
+    geometry = {
+        'kind': kind,
+        'width': width,
+        'height': height,
+        'level_offsets': level_offsets,
+    }
+    rows = item_count
+    if kind == KIND_POLYLINES:
+        geometry['path_offsets'] = np.frombuffer(data, dtype='<u4', count=item_count + 1, offset=offset)
+        offset += geometry['path_offsets'].nbytes
+        rows = header['vertex_count']
+
+    if kind == KIND_POLYLINES:
+        row_size = components * (2 if encoding == ENCODING_UINT16 else 4)
+        grid = _read_grid(data, offset + rows * row_size, level_count)
+        if grid is not None:
+            geometry['grid'] = grid
+
+    if encoding == ENCODING_UINT16:
+        packed = np.frombuffer(data, dtype='<u2', count=rows * components, offset=offset)
+        extent = np.array([width, height] * (components // 2), dtype=np.float32)
+        coords = packed.reshape(-1, components).astype(np.float32) / QUANT_MAX * extent
+    else:
+        coords = np.frombuffer(data, dtype='<f4', count=rows * components, offset=offset)
+        coords = coords.reshape(-1, components)
+
+    geometry['coords'] = coords
+    return geometry
+
+
+def json_to_arrays(geometry_data):
+    """
+    Convert JSON geometry (lineart levels of polylines or segments, or a
+    pointcloud) to a dict with ``kind``, ``coords``, ``level_offsets`` and,
+    for polylines, ``path_offsets``.
+    """
+    if 'levels' in geometry_data:
+        levels = geometry_data['levels']
+        level_offsets = np.cumsum([0] + [len(level) for level in levels])
+        if any(level and 'points' in level[0] for level in levels):
+            paths = [path['points'] for level in levels for path in level]
+            return {
+                'kind': KIND_POLYLINES,
+                'coords': np.array([(p['x'], p['y']) for path in paths for p in path],
+                                   dtype=np.float64).reshape(-1, 2),
+                'level_offsets': level_offsets,
+                'path_offsets': np.cumsum([0] + [len(path) for path in paths]),
+            }
+        # Geometry written before polylines: independent start/end segments
+        coords = np.array([
+            (s['start']['x'], s['start']['y'], s['end']['x'], s['end']['y'])
+            for level in levels for s in level
+        ], dtype=np.float64).reshape(-1, 4)
+        return {'kind': KIND_SEGMENTS, 'coords': coords, 'level_offsets': level_offsets}
+
+    coords = np.array([(p['x'], p['y']) for p in geometry_data['points']], dtype=np.float64).reshape(-1, 2)
+    return {'kind': KIND_POINTS, 'coords': coords, 'level_offsets': [0, len(coords)]}
+
+
+def json_to_binary(geometry_data, width=0, height=0):
+    """
+    Pack a JSON geometry document, e.g. one written before the binary format
+    existed. Polylines of known image size are put in grid order and get
+    their grid index, as the pipeline writes them.
+    """
+    dimensions = geometry_data.get('dimensions') or {}
+    width = width or dimensions.get('width', 0)
+    height = height or dimensions.get('height', 0)
+    arrays = json_to_arrays(geometry_data)
+    coords, level_offsets, path_offsets = arrays['coords'], arrays['level_offsets'], arrays.get('path_offsets')
+    grid = None
+    if arrays['kind'] == KIND_POLYLINES and width and height:
+        coords, path_offsets, level_offsets = spatial_index.sort_paths(
+            coords, path_offsets, level_offsets, width, height)
+        grid = spatial_index.grid_index(coords, path_offsets, level_offsets, width, height)
+    return encode_geometry(arrays['kind'], coords, level_offsets, width=width, height=height,
+                           path_offsets=path_offsets, grid=grid)
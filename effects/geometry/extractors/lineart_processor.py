@@ -3,133 +3,245 @@ import numpy as np
 from PIL import Image
 import json
 from pathlib import Path
-from controlnet_aux import LineartDetector
-from controlnet_aux.util import HWC3
-import torch
+
+from effects.geometry.extractors.batched_inference import LEVEL_SOURCES, derive_level, lineart_batch
+from effects.geometry.extractors.detector_backends import store_name
+from effects.geometry.extractors.edge_store import image_size
+from effects.geometry.extractors.geometry_cache import hash_image
+from effects.geometry.extractors.metrics import timed
+from effects.geometry.extractors.tiled_detection import TILED_ABOVE, detect_tiled, scale_for_tiling
 
 import os
 import sys
 
 
+RESOLUTIONS = [512, 768, 1024]
+
+# approxPolyDP tolerance for contours, in detection pixels
+EPSILON = 2.0
+
+
 def save_features(features, output_path):
     with open(output_path, 'w') as f:
         json.dump({
             'levels': features
         }, f)
 
-def process_image_hierarchical(image_path):
-    # Load image
-    image = cv2.imread(str(image_path))
-    image = HWC3(image)
-    original_height, original_width = image.shape[:2]
-    original_aspect = original_width / original_height
-    
-    # Initialize detector
-    lineart = LineartDetector.from_pretrained("lllyasviel/Annotators")
+def detect_lineart(image, detect_resolution):
+    """Run the lineart detector on an HWC3 image and return a grayscale uint8 map."""
+    # Shared detector and input buffers, see batched_inference.py
+    return lineart_batch().edge_maps([image], [detect_resolution])[0][detect_resolution]
+
+def detect_lineart_tiled(image, detect_resolution):
+    """
+    Lineart map with the image's shorter side at ``detect_resolution`` (as
+    the detector itself scales), capped at native size and run in tiles.
+    """
+    scaled = scale_for_tiling(image, detect_resolution / min(image.shape[:2]))
+    return detect_tiled(scaled, lambda tile: detect_lineart(tile, tile.shape[0]), 'lineart')
+
+def lineart_edge_maps(image_path, resolutions=RESOLUTIONS, store=None, allow_detect=True, level_source='detect'):
+    """
+    Yield ``(detect_resolution, edge_map)`` for each resolution. Resolutions
+    above ``TILED_ABOVE`` are detected in tiles (see tiled_detection.py), the
+    others through the batched inference path (see batched_inference.py).
+    With ``level_source='derive'`` only the highest resolution is detected
+    and the other levels are downsampled from its map.
+
+    With a ``store``, maps are read from (and saved to) the edge-map store and
+    the image is only decoded if some resolution has to be detected.
+    """
+    if level_source not in LEVEL_SOURCES:
+        raise ValueError(f"Unknown level source: {level_source}")
+    image = None
+    image_hash = hash_image(image_path) if store is not None else None
+    # Each backend's maps are stored apart
+    name = store_name('lineart')
+    top = max(resolutions) if resolutions else None
+    top_map = None
+
+    def detect(detect_resolution):
+        nonlocal image
+        if image is None:
+            from controlnet_aux.util import HWC3
+            with timed('decode'):
+                image = HWC3(cv2.imread(str(image_path)))
+        with timed('forward', detector='lineart', resolution=detect_resolution):
+            if detect_resolution > TILED_ABOVE:
+                return detect_lineart_tiled(image, detect_resolution)
+            return detect_lineart(image, detect_resolution)
+
+    def source_map():
+        nonlocal top_map
+        if top_map is None:
+            top_map = get_or_detect(name, top, lambda: detect(top))
+        return top_map
+
+    def get_or_detect(map_name, detect_resolution, compute):
+        if store is None:
+            return compute()
+        return store.get_or_compute(image_hash, map_name, detect_resolution, compute, allow_detect=allow_detect)
+
+    for detect_resolution in resolutions:
+        if level_source == 'derive' and detect_resolution != top:
+            # Stored apart from detected maps, and per source resolution
+            width, height = image_size(image_path)
+            yield detect_resolution, get_or_detect(
+                f'{name}_from{top}', detect_resolution,
+                lambda: derive_level(source_map(), height, width, detect_resolution))
+        elif detect_resolution == top:
+            yield detect_resolution, source_map()
+        else:
+            yield detect_resolution, get_or_detect(name, detect_resolution, lambda: detect(detect_resolution))
+
+def iter_level_segments(image_path, resolutions=RESOLUTIONS, threshold=0.3, min_length=10,
+                        store=None, allow_detect=True, dtype=np.float32, level_source='detect'):
+    """
+    Yield ``(level, detect_resolution, segments, edge_map)`` per resolution,
+    where ``segments`` is an (N, 4) array of x0, y0, x1, y1 in original
+    image coordinates.
+    """
+    for level, detect_resolution, contours, detected in iter_level_contours(
+            image_path, resolutions, threshold, min_length, store, allow_detect, level_source):
+        yield level, detect_resolution, contours_to_segments(contours, dtype), detected
+
+def iter_level_contours(image_path, resolutions=RESOLUTIONS, threshold=0.3, min_length=10,
+                        store=None, allow_detect=True, level_source='detect'):
+    """
+    Yield ``(level, detect_resolution, contours, edge_map)`` per resolution,
+    where ``contours`` are the approximated contours as (n, 2) float64 vertex
+    arrays in original image coordinates.
+    """
+    # Only the header is read here; the pixels are decoded if a detector must run
+    original_width, original_height = image_size(image_path)
     
-    resolutions = [512, 768, 1024]
+    # Get different levels of features at increasing detection resolutions
+    edge_maps = lineart_edge_maps(image_path, resolutions, store, allow_detect, level_source)
+    for level, (detect_resolution, detected) in enumerate(edge_maps):
+        # Get actual dimensions of the detected image
+        detected_height, detected_width = detected.shape[:2]
+        
+        # Scale factor to normalize back to original image size
+        scale_x = original_width / detected_width
+        scale_y = original_height / detected_height
+        
+        # Process paths and scale coordinates back to original size
+        contours = extract_contours(
+            detected,
+            threshold=threshold,
+            min_length=min_length * (detect_resolution / 512),  # Scale min_length with resolution
+            scale_x=scale_x,
+            scale_y=scale_y
+        )
+        
+        yield level, detect_resolution, contours, detected
+
+def hierarchical_segments(image_path, resolutions=RESOLUTIONS, threshold=0.3, min_length=10,
+                          store=None, allow_detect=True, dtype=np.float32, level_source='detect'):
+    """
+    Array form of ``process_image_hierarchical``: all levels' segments in one
+    (N, 4) array plus ``level_offsets``, so level ``i`` is
+    ``segments[level_offsets[i]:level_offsets[i + 1]]``.
+    """
+    levels = [segments for _, _, segments, _ in iter_level_segments(
+        image_path, resolutions, threshold, min_length, store, allow_detect, dtype, level_source)]
+    level_offsets = np.zeros(len(levels) + 1, dtype=np.int64)
+    level_offsets[1:] = np.cumsum([len(segments) for segments in levels])
+    if not levels:
+        return np.empty((0, 4), dtype=dtype), level_offsets
+    return np.concatenate(levels), level_offsets
+
+def process_image_hierarchical(image_path, on_level=None, resolutions=RESOLUTIONS, threshold=0.3, min_length=10,
+                               store=None, allow_detect=True, level_source='detect'):
     all_features = []
     debug_images = []
     
-    # Get different levels of features using different thresholds
-    with torch.no_grad():
-        for detect_resolution in resolutions:
-            # Calculate detection dimensions maintaining aspect ratio
-            if original_width > original_height:
-                detect_width = detect_resolution
-                detect_height = int(detect_resolution / original_aspect)
-            else:
-                detect_height = detect_resolution
-                detect_width = int(detect_resolution * original_aspect)
-            
-            # Get features at this resolution
-            detected = lineart(image, 
-                             detect_resolution=detect_resolution,
-                             image_resolution=detect_resolution)
-            detected = np.array(detected)
-            
-            if len(detected.shape) == 3:
-                detected = cv2.cvtColor(detected, cv2.COLOR_RGB2GRAY)
-            
-            # Get actual dimensions of the detected image
-            detected_height, detected_width = detected.shape[:2]
-            
-            # Scale factor to normalize back to original image size
-            scale_x = original_width / detected_width
-            scale_y = original_height / detected_height
-            
-            # Process paths and scale coordinates back to original size
-            paths = extract_paths(
-                detected,
-                threshold=0.3,
-                min_length=10 * (detect_resolution / 512),  # Scale min_length with resolution
-                scale_x=scale_x,
-                scale_y=scale_y
-            )
-            
-            all_features.append(paths)
-            debug_images.append(detected)
-            
-            print(f"Resolution {detect_resolution}:")
-            print(f"Original dimensions: {original_width}x{original_height}")
-            print(f"Detected dimensions: {detected_width}x{detected_height}")
-            print(f"Scale factors: x={scale_x}, y={scale_y}")
+    # float64 keeps the serialized coordinates exactly as they have always been
+    for level, detect_resolution, segments, detected in iter_level_segments(
+            image_path, resolutions, threshold, min_length, store, allow_detect, dtype=np.float64,
+            level_source=level_source):
+        paths = segments_to_dicts(segments)
+        all_features.append(paths)
+        debug_images.append(detected)
+
+        if on_level:
+            on_level(level, detect_resolution, paths)
     
     return all_features, debug_images
 
-# Rest of the code remains the same...
-
-def extract_paths(image, threshold=0.2, min_length=20, scale_x=1.0, scale_y=1.0):
+def clean_binary(image, threshold=0.2, min_area=50):
+    """Threshold an edge map and drop connected components smaller than ``min_area`` pixels."""
     if len(image.shape) == 3:
         image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
     
     image = image.astype(np.uint8)
     _, binary = cv2.threshold(image, int(threshold * 255), 255, cv2.THRESH_BINARY)
     
-    # Remove small objects
-    min_area = 50  # Adjust this threshold to control minimum object size
     nb_components, output, stats, centroids = cv2.connectedComponentsWithStats(binary, connectivity=8)
-    sizes = stats[1:, -1]
-    nb_components = nb_components - 1
-    
-    # Create a new image with only large enough components
-    cleaned_binary = np.zeros((output.shape))
-    for i in range(0, nb_components):
-        if sizes[i] >= min_area:
-            cleaned_binary[output == i + 1] = 255
-    
-    cleaned_binary = cleaned_binary.astype(np.uint8)
-    
-    # Find contours on cleaned image
-    contours, _ = cv2.findContours(cleaned_binary, 
-                                 cv2.RETR_LIST, 
-                                 cv2.CHAIN_APPROX_NONE)
     
-    paths = []
-    for contour in contours:
-        if cv2.arcLength(contour, False) > min_length:
-            epsilon = 2.0
-            approx = cv2.approxPolyDP(contour, epsilon, False)
-            
-            segments = []
-            for i in range(len(approx) - 1):
-                start = approx[i][0]
-                end = approx[i + 1][0]
-                segments.append({
-                    'start': {
-                        'x': float(start[0] * scale_x),
-                        'y': float(start[1] * scale_y)
-                    },
-                    'end': {
-                        'x': float(end[0] * scale_x),
-                        'y': float(end[1] * scale_y)
-                    }
-                })
-            
-            if segments:
-                paths.extend(segments)
+    # One lookup-table pass keeps only large enough components (label 0 is background)
+    keep = np.zeros(nb_components, dtype=np.uint8)
+    keep[1:][stats[1:, cv2.CC_STAT_AREA] >= min_area] = 255
+    return keep[output]
+
+def extract_segments(image, threshold=0.2, min_length=20, scale_x=1.0, scale_y=1.0, dtype=np.float32):
+    """
+    Extract line segments from an edge map as an (N, 4) array of x0, y0, x1, y1,
+    scaled by ``scale_x``/``scale_y``. Segments of one contour are contiguous.
+    """
+    return contours_to_segments(extract_contours(image, threshold, min_length, scale_x, scale_y), dtype)
+
+def extract_contours(image, threshold=0.2, min_length=20, scale_x=1.0, scale_y=1.0, epsilon=EPSILON):
+    """
+    Approximated contours of an edge map as a list of (n, 2) float64 vertex
+    arrays, scaled by ``scale_x``/``scale_y``.
+    """
+    with timed('threshold'):
+        cleaned_binary = clean_binary(image, threshold)
     
-    return paths
+    with timed('contours'):
+        # Find contours on cleaned image
+        contours, _ = cv2.findContours(cleaned_binary, 
+                                     cv2.RETR_LIST, 
+                                     cv2.CHAIN_APPROX_NONE)
+        
+        # Scale in float64 (as the per-segment code did)
+        scale = np.array([scale_x, scale_y])
+        approximated = []
+        for contour in contours:
+            if cv2.arcLength(contour, False) > min_length:
+                approx = cv2.approxPolyDP(contour, epsilon, False)[:, 0, :]
+                if len(approx) > 1:
+                    approximated.append(approx * scale)
+    return approximated
+
+def contours_to_segments(contours, dtype=np.float32):
+    """Split vertex arrays into one (N, 4) array of their consecutive segments."""
+    if not contours:
+        return np.empty((0, 4), dtype=dtype)
+    return np.concatenate([
+        np.concatenate([vertices[:-1], vertices[1:]], axis=1) for vertices in contours
+    ]).astype(dtype, copy=False)
+
+def segments_to_dicts(segments):
+    """Convert an (N, 4) segment array to the JSON ``{'start': .., 'end': ..}`` form."""
+    return [
+        {
+            'start': {'x': x0, 'y': y0},
+            'end': {'x': x1, 'y': y1}
+        }
+        for x0, y0, x1, y1 in segments.tolist()
+    ]
+
+def levels_to_dicts(segments, level_offsets):
+    return [
+        segments_to_dicts(segments[level_offsets[i]:level_offsets[i + 1]])
+        for i in range(len(level_offsets) - 1)
+    ]
+
+def extract_paths(image, threshold=0.2, min_length=20, scale_x=1.0, scale_y=1.0):
+    segments = extract_segments(image, threshold, min_length, scale_x, scale_y, dtype=np.float64)
+    return segments_to_dicts(segments)
 
 if __name__ == "__main__":
     image_path = sys.argv[1]
@@ -0,0 +1,231 @@
+"""
+Process-wide counters, gauges and histograms, rendered in the Prometheus
+text format by ``GET /api/metrics``.
+
+Extraction stages are timed with ``timed``::
+
+    with timed('contours'):
+        ...
+
+which observes ``pile_stage_duration_seconds{stage="contours"}``. Job
+workers keep their own ``metrics`` and send what they recorded to the
+server after each job (``drain`` there, ``merge`` here, see jobs.py), so
+the endpoint covers work done in every process.
+
+``reset_peak_rss`` and ``peak_rss_bytes`` measure a job's peak resident
+memory (per job on Linux, where the kernel's high-water mark can be reset;
+elsewhere the process's lifetime peak).
+"""
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+# Seconds, from a quick threshold to a cold model load
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = tuple(float(mb << 20) for mb in (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384))
+MODEL_BYTES_BUCKETS = tuple(float(mb << 20) for mb in (8, 16, 32, 64, 128, 256, 512, 1024, 2048))
+
+
+def _key(name, labels):
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metrics:
+    def __init__(self):
+        self._families = {}
+        # (name, labels) -> value, or [bucket counts, sum, count] for histograms
+        self._samples = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, help_text, buckets=None):
+        """Declare a metric; histograms need their ``buckets`` (upper bounds)."""
+        with self._lock:
+            self._families[name] = {
+                'kind': kind,
+                'help': help_text,
+                'buckets': tuple(buckets or DURATION_BUCKETS) if kind == HISTOGRAM else None,
+            }
+
+    def collector(self, collect):
+        """Register ``collect()``, called at render time, yielding ``(name, labels, value)`` gauges."""
+        self._collectors.append(collect)
+        return collect
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._samples[key] = self._samples.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._samples[_key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            buckets = self._families[name]['buckets']
+            sample = self._samples.get(key)
+            if sample is None:
+                sample = self._samples[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    sample[0][i] += 1
+            sample[1] += value
+            sample[2] += 1
+
+    def drain(self):
+        """Return the counters and histograms recorded so far and reset them (for ``merge``)."""
+        with self._lock:
+            drained = [
+                (name, labels, value) for (name, labels), value in self._samples.items()
+                if self._families[name]['kind'] != GAUGE
+            ]
+            for name, labels, _ in drained:
+                del self._samples[(name, labels)]
+        return drained
+
+    def merge(self, drained):
+        """Add another process's ``drain`` output to these metrics."""
+        with self._lock:
+            for name, labels, value in drained:
+                key = (name, tuple(labels))
+                if self._families[name]['kind'] == COUNTER:
+                    self._samples[key] = self._samples.get(key, 0) + value
+                    continue
+                sample = self._samples.get(key)
+                if sample is None:
+                    sample = self._samples[key] = [[0] * len(value[0]), 0.0, 0]
+                sample[0] = [a + b for a, b in zip(sample[0], value[0])]
+                sample[1] += value[1]
+                sample[2] += value[2]
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format."""
+        collected = []
+        for collect in self._collectors:
+            for name, labels, value in collect():
+                collected.append((_key(name, labels), value))
+
+        with self._lock:
+            samples = sorted(list(self._samples.items()) + collected, key=lambda item: item[0])
+            families = dict(self._families)
+
+        lines = []
+        described = set()
+        for (name, labels), value in samples:
+            family = families[name]
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {family['help']}")
+                lines.append(f"# TYPE {name} {family['kind']}")
+            if family['kind'] != HISTOGRAM:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            counts, total, count = value
+            for bound, bucket_count in zip(family['buckets'], counts):
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', _format_value(bound))])} {bucket_count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+# Shared by everything in this process
+metrics = Metrics()
+metrics.describe('pile_stage_duration_seconds', HISTOGRAM,
+                 'Time spent in each geometry extraction stage.')
+metrics.describe('pile_job_duration_seconds', HISTOGRAM,
+                 'Time from a background job starting to it finishing.')
+metrics.describe('pile_job_peak_memory_bytes', HISTOGRAM,
+                 'Peak resident memory of the worker process while running a job.', BYTES_BUCKETS)
+metrics.describe('pile_jobs_finished_total', COUNTER,
+                 'Background jobs finished, by final status.')
+metrics.describe('pile_model_load_bytes', HISTOGRAM,
+                 'Estimated memory of each detector model loaded (load time is stage "model_load").',
+                 MODEL_BYTES_BUCKETS)
+metrics.describe('pile_model_evictions_total', COUNTER,
+                 'Detector models evicted from the warm registry.')
+metrics.describe('pile_tiled_detections_total', COUNTER,
+                 'Detections run in tiles because the image was too large for one pass.')
+metrics.describe('pile_detection_tiles_total', COUNTER,
+                 'Tiles run by tiled detections.')
+
+
+@contextmanager
+def timed(stage, **labels):
+    """Observe the duration of the ``with`` block as extraction stage ``stage``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe('pile_stage_duration_seconds', time.perf_counter() - start, stage=stage, **labels)
+
+
+def _status_kib(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def rss_bytes():
+    """Current resident memory of this process, or None where it cannot be read."""
+    return _status_kib('VmRSS')
+
+
+def reset_peak_rss():
+    """Restart the peak memory count; returns False where the peak cannot be reset."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes():
+    """Peak resident memory since ``reset_peak_rss`` (or since the process started)."""
+    peak = _status_kib('VmHWM')
+    if peak is not None:
+        return peak
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
@@ -0,0 +1,215 @@
+"""
+Process-wide registry of warm geometry detectors.
+
+Loading the controlnet_aux detectors costs seconds and hundreds of MB, so each
+one is loaded once per process and kept resident. Models that have not been
+used for ``idle_timeout`` seconds are evicted, and when ``max_bytes`` is set the
+least recently used models are evicted to keep the resident set under it.
+"""
+import os
+import threading
+import time
+
+from effects.geometry.extractors.metrics import metrics, timed
+
+ANNOTATORS_REPO = "lllyasviel/Annotators"
+
+
+def _load_lineart():
+    from controlnet_aux import LineartDetector
+    return LineartDetector.from_pretrained(ANNOTATORS_REPO)
+
+
+def _load_hed():
+    from controlnet_aux import HEDdetector
+    return HEDdetector.from_pretrained(ANNOTATORS_REPO)
+
+
+LOADERS = {
+    'lineart': _load_lineart,
+    'hed': _load_hed,
+}
+
+
+def model_nbytes(model):
+    """Estimate the resident size of a detector from its torch parameters and buffers."""
+    total = 0
+    seen = set()
+    for module in vars(model).values():
+        if not hasattr(module, 'parameters') or not hasattr(module, 'buffers'):
+            continue
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            if id(tensor) in seen:
+                continue
+            seen.add(id(tensor))
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class _Entry:
+    def __init__(self, model, nbytes):
+        self.model = model
+        self.nbytes = nbytes
+        self.loaded_at = time.time()
+        self.last_used = time.monotonic()
+
+
+class ModelRegistry:
+    def __init__(self, loaders=None, idle_timeout=None, max_bytes=None):
+        self._loaders = dict(LOADERS if loaders is None else loaders)
+        self.idle_timeout = idle_timeout
+        self.max_bytes = max_bytes
+
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in self._loaders}
+        self._reaper = None
+
+        self.loads = {name: 0 for name in self._loaders}
+        self.hits = {name: 0 for name in self._loaders}
+        self.evictions = {name: 0 for name in self._loaders}
+
+    def register(self, name, loader):
+        with self._lock:
+            self._loaders[name] = loader
+            self._load_locks.setdefault(name, threading.Lock())
+            for counter in (self.loads, self.hits, self.evictions):
+                counter.setdefault(name, 0)
+
+    def get(self, name):
+        """Return the resident model ``name``, loading it on first use."""
+        if name not in self._loaders:
+            raise KeyError(f"Unknown model: {name}")
+
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                entry.last_used = time.monotonic()
+                self.hits[name] += 1
+                return entry.model
+
+        # Only one thread loads a given model; the others wait and then hit
+        with self._load_locks[name]:
+            with self._lock:
+                entry = self._entries.get(name)
+                if entry is not None:
+                    entry.last_used = time.monotonic()
+                    self.hits[name] += 1
+                    return entry.model
+
+            with timed('model_load', model=name):
+                model = self._loaders[name]()
+            nbytes = model_nbytes(model)
+            metrics.observe('pile_model_load_bytes', nbytes, model=name)
+
+            with self._lock:
+                self._entries[name] = _Entry(model, nbytes)
+                self.loads[name] += 1
+                self._enforce_memory_limit(keep=name)
+
+        self._ensure_reaper()
+        return model
+
+    def warm(self, names=None):
+        """Load ``names`` (default: every known model) ahead of the first request."""
+        for name in names or list(self._loaders):
+            self.get(name)
+
+    def evict(self, name):
+        with self._lock:
+            return self._evict_locked(name)
+
+    def clear(self):
+        with self._lock:
+            for name in list(self._entries):
+                self._evict_locked(name)
+
+    def evict_idle(self):
+        """Evict every model unused for longer than ``idle_timeout`` seconds."""
+        if not self.idle_timeout:
+            return []
+        now = time.monotonic()
+        with self._lock:
+            idle = [name for name, entry in self._entries.items()
+                    if now - entry.last_used > self.idle_timeout]
+            for name in idle:
+                self._evict_locked(name)
+        return idle
+
+    def resident_bytes(self):
+        with self._lock:
+            return sum(entry.nbytes for entry in self._entries.values())
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            resident = {
+                name: {
+                    'bytes': entry.nbytes,
+                    'loaded_at': entry.loaded_at,
+                    'idle_seconds': now - entry.last_used,
+                }
+                for name, entry in self._entries.items()
+            }
+            return {
+                'loads': dict(self.loads),
+                'hits': dict(self.hits),
+                'evictions': dict(self.evictions),
+                'resident': resident,
+                'resident_bytes': sum(r['bytes'] for r in resident.values()),
+                'idle_timeout': self.idle_timeout,
+                'max_bytes': self.max_bytes,
+            }
+
+    def _evict_locked(self, name):
+        entry = self._entries.pop(name, None)
+        if entry is None:
+            return False
+        self.evictions[name] += 1
+        metrics.inc('pile_model_evictions_total', model=name)
+        return True
+
+    def _enforce_memory_limit(self, keep):
+        if not self.max_bytes:
+            return
+        by_age = sorted(self._entries.items(), key=lambda item: item[1].last_used)
+        total = sum(entry.nbytes for entry in self._entries.values())
+        for name, entry in by_age:
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            self._evict_locked(name)
+            total -= entry.nbytes
+
+    def _ensure_reaper(self):
+        if not self.idle_timeout or self._reaper is not None:
+            return
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap, name='model-reaper', daemon=True)
+            self._reaper.start()
+
+    def _reap(self):
+        interval = max(1.0, min(self.idle_timeout / 2, 60.0))
+        while True:
+            time.sleep(interval)
+            self.evict_idle()
+
+
+def _env_number(name, cast):
+    value = os.environ.get(name)
+    return cast(value) if value else None
+
+
+# Shared by every extractor in this process. Both limits are optional:
+# PILE_MODEL_IDLE_TIMEOUT is in seconds, PILE_MODEL_MAX_BYTES in bytes.
+registry = ModelRegistry(
+    idle_timeout=_env_number('PILE_MODEL_IDLE_TIMEOUT', float),
+    max_bytes=_env_number('PILE_MODEL_MAX_BYTES', int),
+)
+
+
+def get_model(name):
+    return registry.get(name)
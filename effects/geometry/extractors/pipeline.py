@@ -0,0 +1,535 @@
+"""
+Geometry generation for a scene image.
+
+``extract_geometry`` runs the extractor for a geometry type and returns its
+array form, ``build_geometry`` the serializable JSON document, and
+``generate_geometry_file`` writes the JSON and packed binary files to disk,
+going through the content-addressed geometry cache. All are safe to call from
+a worker process.
+
+``iter_geometry_levels`` yields each level as soon as it is extracted:
+``generate_geometry_file`` writes lineart JSON one level at a time and
+``stream_geometry`` streams levels to a job's readers (see jobs.py), so
+callers see level 0 long before the last level is done.
+
+Lineart contours are deduplicated and chained into polylines (see
+polylines.py), put in spatial grid order per level with a cell index (see
+spatial_index.py), and get a level-of-detail pyramid: the polylines
+simplified with stronger ``approxPolyDP`` tolerances, written as
+``<name>.lod<i>.bin``. Pointclouds are stored ranked by importance, so a
+lower-detail tier is just a prefix. ``select_geometry_binary`` picks the tier
+that fits a client's item budget. With ``atlas_scale`` set, lineart is also
+pre-rendered into sprite atlas pages (see sprite_atlas.py),
+``<name>.atlas.json`` and ``<name>.atlas<i>.png``, for clients too weak to
+draw the vectors.
+"""
+import json
+import os
+import tempfile
+from contextlib import nullcontext
+from pathlib import Path
+
+import numpy as np
+
+import effects.geometry.extractors.lineart_processor as lineart
+import effects.geometry.extractors.polylines as polylines
+import effects.geometry.extractors.spatial_index as spatial_index
+import effects.geometry.extractors.sprite_atlas as sprite_atlas
+from effects.geometry.extractors.detector_backends import backend_name
+from effects.geometry.extractors.edge_store import default_store, image_size
+from effects.geometry.extractors.geometry_cache import cache_key, default_cache, geometry_files
+from effects.geometry.extractors.geometry_format import (
+    HEADER_SIZE,
+    KIND_POINTS,
+    KIND_POLYLINES,
+    detail_count,
+    encode_geometry,
+    read_header,
+    truncate_geometry,
+)
+from effects.geometry.extractors.metrics import timed
+from effects.geometry.extractors.pointcloud_processor import extract_point_array, hed_edge_map, points_to_dicts
+
+GEOMETRY_TYPES = ('pointcloud', 'lineart')
+
+BINARY_SUFFIX = '.bin'
+
+# Extraction parameters per geometry type; scenes may override them with
+# image.geometry.options. They are part of the geometry cache key.
+DEFAULT_OPTIONS = {
+    'pointcloud': {
+        'num_points': 10000,
+        'detect_resolution': 512,
+        'sampling': 'weighted',
+        'seed': 0,
+    },
+    'lineart': {
+        'resolutions': list(lineart.RESOLUTIONS),
+        'threshold': 0.3,
+        'min_length': 10,
+        'level_source': 'detect',
+        # Atlas pixels per image pixel of the pre-rendered sprites; 0 for none
+        'atlas_scale': 0,
+    },
+}
+
+
+def resolve_options(geometry_type, options=None):
+    """Merge scene overrides into the defaults, ignoring unknown keys."""
+    if geometry_type not in DEFAULT_OPTIONS:
+        raise ValueError(f"Unknown geometry type: {geometry_type}")
+    resolved = dict(DEFAULT_OPTIONS[geometry_type])
+    for name, value in (options or {}).items():
+        if name in resolved and value is not None:
+            resolved[name] = value
+    return resolved
+
+
+def iter_geometry_levels(image_path, geometry_type, options=None, on_progress=None, store=None, allow_detect=True,
+                         merge=True):
+    """
+    Extract geometry one level at a time, yielding each level as soon as it
+    is done: a dict with ``level``, ``levels_total``, the image
+    ``width``/``height`` and, for lineart, the detection ``resolution`` and
+    the level's merged ``paths`` (a list of (n, 2) vertex arrays), for a
+    pointcloud (a single level) its ``points`` array.
+
+    Edge maps are dropped as soon as their level is extracted. Arguments are
+    as for ``extract_geometry``.
+    """
+    options = resolve_options(geometry_type, options)
+    store = store or default_store()
+    width, height = image_size(image_path)
+
+    if geometry_type == 'pointcloud':
+        points, _ = extract_point_array(
+            str(image_path),
+            num_points=options['num_points'],
+            detect_resolution=options['detect_resolution'],
+            store=store,
+            allow_detect=allow_detect,
+            seed=int(options['seed']),
+            method=options['sampling'],
+        )
+        if on_progress:
+            on_progress(stage='points', levels_done=1, levels_total=1)
+        yield {'level': 0, 'levels_total': 1, 'points': points, 'width': width, 'height': height}
+        return
+
+    resolutions = options['resolutions']
+
+    def level_contours():
+        for _, _, contours, _ in lineart.iter_level_contours(
+                image_path,
+                resolutions=resolutions,
+                threshold=options['threshold'],
+                min_length=options['min_length'],
+                store=store,
+                allow_detect=allow_detect,
+                level_source=options['level_source']):
+            yield contours
+
+    if merge:
+        levels = polylines.iter_merged_levels(level_contours(), width, height)
+    else:
+        levels = ([path for path in contours if len(path) > 1] for contours in level_contours())
+    for level, paths in enumerate(levels):
+        paths = spatial_index.order_level(paths, width, height)
+        if on_progress:
+            on_progress(stage='level', level=level, resolution=resolutions[level],
+                        levels_done=level + 1, levels_total=len(resolutions))
+        yield {
+            'level': level,
+            'levels_total': len(resolutions),
+            'resolution': resolutions[level],
+            'paths': paths,
+            'width': width,
+            'height': height,
+        }
+
+
+def extract_geometry(image_path, geometry_type, options=None, on_progress=None, store=None, allow_detect=True,
+                     on_level=None, merge=True, lod=True):
+    """
+    Extract geometry of ``geometry_type`` from the image at ``image_path`` in
+    array form: a dict with the format ``kind``, ``coords`` (float64, one row
+    per polyline vertex or point), ``level_offsets``, for lineart
+    ``path_offsets`` and its coarser ``lod`` tiers, and the image
+    ``width``/``height``.
+
+    Detector outputs go through the edge-map ``store`` (default: the shared
+    one); with ``allow_detect=False`` a missing map raises MissingEdgeMap
+    instead of running a detector. ``on_progress`` is called with keyword
+    arguments describing each finished stage (for lineart, one call per
+    resolution level), and ``on_level`` with each level from
+    ``iter_geometry_levels`` as soon as it is done.
+
+    Lineart contours are merged into polylines unless ``merge`` is false
+    (each contour is then its own path), and get LOD tiers only with ``lod``.
+    """
+    width, height = image_size(image_path)
+    levels = []
+    for level in iter_geometry_levels(image_path, geometry_type, options, on_progress, store, allow_detect, merge):
+        if on_level:
+            on_level(level)
+        levels.append(level)
+
+    if geometry_type == 'pointcloud':
+        points = levels[0]['points']
+        return {
+            'kind': KIND_POINTS,
+            'coords': points,
+            'level_offsets': [0, len(points)],
+            'width': width,
+            'height': height,
+        }
+
+    # Levels are already in grid order
+    vertices, path_offsets, level_offsets = polylines.pack_levels([level['paths'] for level in levels])
+    geometry = _polyline_geometry(vertices, path_offsets, level_offsets, width, height)
+    if not lod:
+        return geometry
+    with timed('lod'):
+        geometry['lod'] = [
+            # Simplified paths can move to another cell
+            _polyline_geometry(*spatial_index.sort_paths(
+                *polylines.simplify(vertices, path_offsets, level_offsets, epsilon, width, height), width, height),
+                width, height)
+            for epsilon in polylines.LOD_EPSILONS
+        ]
+    return geometry
+
+
+def _polyline_geometry(vertices, path_offsets, level_offsets, width, height):
+    return {
+        'kind': KIND_POLYLINES,
+        'coords': vertices,
+        'path_offsets': path_offsets,
+        'level_offsets': level_offsets,
+        'width': width,
+        'height': height,
+        'grid': spatial_index.grid_index(vertices, path_offsets, level_offsets, width, height),
+    }
+
+
+@timed('serialize', format='json')
+def geometry_to_json(geometry):
+    """Serialize array-form geometry to the JSON document the client loads."""
+    if geometry['kind'] == KIND_POINTS:
+        return {
+            'points': points_to_dicts(geometry['coords']),
+            'dimensions': {
+                'width': geometry['width'],
+                'height': geometry['height']
+            }
+        }
+    if geometry['kind'] == KIND_POLYLINES:
+        return {
+            'levels': polylines.polylines_to_dicts(
+                geometry['coords'], geometry['path_offsets'], geometry['level_offsets'])
+        }
+    return {
+        'levels': lineart.levels_to_dicts(geometry['coords'], geometry['level_offsets'])
+    }
+
+
+@timed('serialize', format='json')
+def level_event(level):
+    """
+    The streamed form of one level from ``iter_geometry_levels``: its JSON
+    (``paths`` as in the document's ``levels``, or ``points`` and
+    ``dimensions``) and where it belongs.
+    """
+    event = {'event': 'level', 'level': level['level'], 'levels_total': level['levels_total']}
+    if 'points' in level:
+        event['points'] = points_to_dicts(level['points'])
+        event['dimensions'] = {'width': level['width'], 'height': level['height']}
+    else:
+        event['resolution'] = level['resolution']
+        event['paths'] = polylines.level_to_dicts(level['paths'])
+    return event
+
+
+def stream_geometry(image_path, geometry_type, options=None, on_progress=None, on_output=None, store=None):
+    """
+    Extract geometry without writing it, passing each level's ``level_event``
+    to ``on_output`` as soon as it is done (a job function for streamed
+    previews). Returns the item count of each level.
+    """
+    counts = []
+    for level in iter_geometry_levels(image_path, geometry_type, options, on_progress, store):
+        event = level_event(level)
+        counts.append(len(event.get('paths', event.get('points'))))
+        if on_output:
+            on_output(**event)
+    return {'counts': counts}
+
+
+@timed('serialize', format='binary')
+def geometry_to_binary(geometry):
+    return encode_geometry(geometry['kind'], geometry['coords'], geometry['level_offsets'],
+                           width=geometry['width'], height=geometry['height'],
+                           path_offsets=geometry.get('path_offsets'), grid=geometry.get('grid'))
+
+
+def build_geometry(image_path, geometry_type, options=None, on_progress=None, store=None, allow_detect=True,
+                   merge=True, lod=True):
+    """Extract geometry and return it as the JSON-serializable document."""
+    return geometry_to_json(extract_geometry(image_path, geometry_type, options, on_progress, store, allow_detect,
+                                             merge=merge, lod=lod))
+
+
+def preview_geometry(image_path, geometry_type, options=None, store=None):
+    """
+    Re-run only the post-processing on stored detector outputs: thresholding
+    and contours, without the polyline merge or LOD tiers, so options can be
+    tuned interactively. Saved geometry gets both.
+
+    Raises MissingEdgeMap if the detectors have not run for this image yet;
+    ``prepare_edge_maps`` computes them.
+    """
+    return build_geometry(image_path, geometry_type, options, store=store, allow_detect=False, merge=False, lod=False)
+
+
+def prepare_edge_maps(image_path, geometry_type, options=None, on_progress=None, store=None):
+    """Run the detectors needed by ``geometry_type`` and store their outputs."""
+    options = resolve_options(geometry_type, options)
+    store = store or default_store()
+    if geometry_type == 'pointcloud':
+        hed_edge_map(str(image_path), options['detect_resolution'], store)
+        if on_progress:
+            on_progress(stage='points', levels_done=1, levels_total=1)
+        return {'maps': 1}
+
+    resolutions = options['resolutions']
+    edge_maps = lineart.lineart_edge_maps(image_path, resolutions, store, level_source=options['level_source'])
+    for level, _ in enumerate(edge_maps):
+        if on_progress:
+            on_progress(stage='level', level=level, resolution=resolutions[level],
+                        levels_done=level + 1, levels_total=len(resolutions))
+    return {'maps': len(resolutions)}
+
+
+@timed('write', format='json')
+def write_json_atomic(data, output_path):
+    """Write ``data`` as JSON so readers never see a partially written file."""
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=output_path.parent, prefix=f".{output_path.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class LevelJsonWriter:
+    """
+    Writes a lineart JSON document (``{"levels": [...]}``) one level at a
+    time, so only the level being written is ever held as Python objects.
+    The document goes to a temporary file that replaces ``output_path`` on
+    ``commit``, so readers never see it partially written; leaving the
+    ``with`` block without committing discards it.
+    """
+
+    def __init__(self, output_path):
+        self.output_path = Path(output_path)
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(
+            dir=self.output_path.parent, prefix=f".{self.output_path.name}.", suffix='.tmp')
+        self._file = os.fdopen(fd, 'w')
+        # Same bytes as json.dump of the whole document
+        self._file.write('{"levels": [')
+        self.count = 0
+
+    @timed('write', format='json')
+    def write_level(self, paths):
+        if self.count:
+            self._file.write(', ')
+        json.dump(paths, self._file)
+        self.count += 1
+
+    @timed('write', format='json')
+    def commit(self):
+        self._file.write(']}')
+        self._file.close()
+        os.replace(self.tmp_path, self.output_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self._file.closed:
+            self._file.close()
+            os.unlink(self.tmp_path)
+
+
+def geometry_cache_key(image_path, geometry_type, options=None):
+    options = resolve_options(geometry_type, options)
+    backend = backend_name()
+    if backend != 'torch':
+        # Other detector backends' output differs slightly; torch keys are unchanged
+        options = dict(options, backend=backend)
+    return cache_key(image_path, geometry_type, options)
+
+
+def fetch_cached_geometry(image_path, geometry_type, output_path, options=None, cache=None):
+    """
+    Copy cached geometry to ``output_path``; returns a summary, or None on a
+    miss. Any atlas there belongs to the geometry being replaced and is
+    removed; cached geometry brings its own.
+    """
+    cache = cache or default_cache()
+    remove_atlas(output_path)
+    meta = cache.fetch(geometry_cache_key(image_path, geometry_type, options), output_path)
+    if meta is None:
+        return None
+    return {
+        'geometry_path': str(output_path),
+        'counts': meta.get('counts'),
+        'lod_counts': meta.get('lod_counts'),
+        'cached': True,
+    }
+
+
+@timed('write', format='binary')
+def write_bytes_atomic(data, output_path):
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=output_path.parent, prefix=f".{output_path.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def binary_path(output_path):
+    """Where the packed binary copy of a JSON geometry file lives."""
+    return Path(output_path).with_suffix(BINARY_SUFFIX)
+
+
+def lod_path(output_path, tier):
+    """Where LOD tier ``tier`` (1 = first simplified tier) of a geometry file lives."""
+    return Path(output_path).with_suffix(f".lod{tier}{BINARY_SUFFIX}")
+
+
+def atlas_path(output_path):
+    """Where the sprite atlas metadata of a lineart geometry file lives."""
+    return Path(output_path).with_suffix('.atlas.json')
+
+
+def remove_atlas(output_path):
+    """Delete a geometry file's sprite atlas, if it has one."""
+    stem = Path(output_path).stem
+    for path in geometry_files(output_path):
+        if path.name.startswith(f"{stem}.atlas"):
+            path.unlink(missing_ok=True)
+
+
+def write_atlas(geometry, scale, output_path):
+    """Render lineart to sprite atlas pages next to ``output_path``, then their metadata."""
+    output_path = Path(output_path)
+    with timed('atlas'):
+        meta, pages = sprite_atlas.build_atlas(geometry, scale, output_path.stem)
+    for name, data in zip(meta['pages'], pages):
+        write_bytes_atomic(data, output_path.with_name(name))
+    write_json_atomic(meta, atlas_path(output_path))
+    return meta
+
+
+def _detail_count(path):
+    with open(path, 'rb') as f:
+        return detail_count(read_header(f.read(HEADER_SIZE)))
+
+
+def select_geometry_binary(output_path, max_items=None):
+    """
+    Packed geometry for the JSON file ``output_path`` within a budget of
+    ``max_items`` segments or points: the most detailed LOD tier that fits,
+    or the coarsest one truncated to the budget.
+    """
+    path = binary_path(output_path)
+    if max_items is not None and _detail_count(path) > max_items:
+        tier = 1
+        while lod_path(output_path, tier).exists():
+            path = lod_path(output_path, tier)
+            if _detail_count(path) <= max_items:
+                break
+            tier += 1
+    with open(path, 'rb') as f:
+        data = f.read()
+    return data if max_items is None else truncate_geometry(data, max_items)
+
+
+def _replay_levels(output_path, on_output):
+    """Pass the levels of an existing geometry file to ``on_output``."""
+    with open(output_path) as f:
+        document = json.load(f)
+    if 'points' in document:
+        on_output(event='level', level=0, levels_total=1, **document)
+        return
+    for level, paths in enumerate(document['levels']):
+        on_output(event='level', level=level, levels_total=len(document['levels']), paths=paths)
+
+
+def generate_geometry_file(image_path, geometry_type, output_path, options=None, on_progress=None, cache=None,
+                           on_output=None):
+    """
+    Extract geometry (or reuse a cached copy) and write it to ``output_path``
+    as JSON, plus its packed binary form next to it. Lineart levels are
+    written to the JSON as each is extracted; with ``on_output``, each
+    level's ``level_event`` is also passed to it as soon as it is done.
+    """
+    cache = cache or default_cache()
+    summary = fetch_cached_geometry(image_path, geometry_type, output_path, options, cache)
+    if summary is not None:
+        if on_output:
+            _replay_levels(output_path, on_output)
+        return summary
+
+    options = resolve_options(geometry_type, options)
+    with LevelJsonWriter(output_path) if geometry_type == 'lineart' else nullcontext() as writer:
+        def on_level(level):
+            if writer is None and on_output is None:
+                return
+            event = level_event(level)
+            if writer is not None:
+                writer.write_level(event['paths'])
+            if on_output:
+                on_output(**event)
+
+        geometry = extract_geometry(image_path, geometry_type, options, on_progress=on_progress, on_level=on_level)
+        write_bytes_atomic(geometry_to_binary(geometry), binary_path(output_path))
+        for tier, lod in enumerate(geometry.get('lod', []), start=1):
+            write_bytes_atomic(geometry_to_binary(lod), lod_path(output_path, tier))
+        if options.get('atlas_scale'):
+            write_atlas(geometry, options['atlas_scale'], output_path)
+        # The JSON goes last, so a file that exists always has its binaries
+        if writer is not None:
+            writer.commit()
+        else:
+            write_json_atomic(geometry_to_json(geometry), output_path)
+
+    offsets = geometry['level_offsets']
+    counts = [int(offsets[i + 1] - offsets[i]) for i in range(len(offsets) - 1)]
+    # Tier sizes in segments, the unit of client budgets
+    lod_counts = [len(lod['coords']) - (len(lod['path_offsets']) - 1) for lod in geometry.get('lod', [])]
+
+    cache.put(geometry_cache_key(image_path, geometry_type, options), output_path, meta={
+        'image': Path(image_path).name,
+        'type': geometry_type,
+        'options': options,
+        'counts': counts,
+        'lod_counts': lod_counts,
+    })
+    return {
+        'geometry_path': str(output_path),
+        'counts': counts,
+        'lod_counts': lod_counts,
+        'cached': False,
+    }
@@ -2,97 +2,153 @@ import cv2
 import numpy as np
 import json
 from pathlib import Path
-from controlnet_aux import LineartDetector, HEDdetector
-from controlnet_aux.util import HWC3
-import torch
+
+from effects.geometry.extractors.detector_backends import get_backend, resize_shape, store_name
+from effects.geometry.extractors.edge_store import image_size
+from effects.geometry.extractors.geometry_cache import hash_image
+from effects.geometry.extractors.metrics import timed
+from effects.geometry.extractors.point_sampler import PointSampler, cached_sampler
+from effects.geometry.extractors.tiled_detection import TILED_ABOVE, detect_tiled, scale_for_tiling
 import os
 import sys
 
-def extract_points(image_path, num_points=5000, detect_resolution=512):
-    """
-    Extract points using HED edge detection.
-    """
-    # Read image
-    image = cv2.imread(str(image_path))
-    image = HWC3(image)
-    original_height, original_width = image.shape[:2]
-    
-    # Calculate detection dimensions maintaining aspect ratio
+def detection_size(original_width, original_height, detect_resolution):
+    """Detection dimensions with the longer side at ``detect_resolution``."""
     if original_width > original_height:
         detect_width = detect_resolution
         detect_height = int(detect_resolution * original_height / original_width)
     else:
         detect_height = detect_resolution
         detect_width = int(detect_resolution * original_width / original_height)
+    return detect_width, detect_height
 
-    print(f"Detection dimensions: {detect_width}x{detect_height}")
+def detect_hed(image, detect_resolution=512, backend=None):
+    """Run HED on an HWC3 image; returns a uint8 edge map at the detection dimensions."""
+    from controlnet_aux.util import HWC3, resize_image
+    original_height, original_width = image.shape[:2]
+    detect_width, detect_height = detection_size(original_width, original_height, detect_resolution)
     
-    # Initialize HED detector
-    hed = HEDdetector.from_pretrained("lllyasviel/Annotators")
+    # HEDdetector's preprocessing, with the network on the detector backend
+    resized = resize_image(HWC3(image), detect_width)
+    height, width = resized.shape[:2]
+    batch = resized.transpose(2, 0, 1)[None].astype(np.float32)
+    sides = (backend or get_backend()).run('hed', batch)
     
-    # Get edge detection
-    with torch.no_grad():
-        hed_detection = hed(image, detect_resolution=detect_width, image_resolution=detect_width)
+    # Average the side outputs at the input size, then squash to an edge probability
+    sides = [cv2.resize(side[0, 0].astype(np.float32), (width, height), interpolation=cv2.INTER_LINEAR)
+             for side in sides]
+    edge = 1 / (1 + np.exp(-np.mean(np.stack(sides, axis=2), axis=2).astype(np.float64)))
+    hed_detection = (edge * 255.0).clip(0, 255).astype(np.uint8)
     
-    # Convert to numpy array and ensure grayscale
-    hed_detection = np.array(hed_detection)
-    if len(hed_detection.shape) == 3:
-        hed_detection = cv2.cvtColor(hed_detection, cv2.COLOR_RGB2GRAY)
+    # The detector sizes its output from the resized input again
+    output_height, output_width = resize_shape(height, width, detect_width)
+    if (output_height, output_width) != (height, width):
+        hed_detection = cv2.resize(hed_detection, (output_width, output_height), interpolation=cv2.INTER_LINEAR)
     
     # Resize to detection dimensions
-    hed_detection = cv2.resize(hed_detection, (detect_width, detect_height))
-    
-    # Normalize and enhance edges
-    prob_map = hed_detection / 255.0
-    # Enhance contrast to make edges more prominent
-    prob_map = np.power(prob_map, 0.7)  # Adjust power for edge enhancement
-    
-    # Normalize probability map
-    prob_map = prob_map / prob_map.sum()
-    
-    # Flatten for sampling
-    flat_prob = prob_map.flatten()
-    indices = np.arange(len(flat_prob))
-    
-    # Sample points based on probability
-    sampled_indices = np.random.choice(
-        indices, 
-        size=num_points, 
-        p=flat_prob,
-        replace=True
-    )
+    return cv2.resize(hed_detection, (detect_width, detect_height))
+
+def detect_hed_tiled(image, detect_resolution):
+    """HED map with the longer side at ``detect_resolution`` (capped at native size), run in tiles."""
+    scaled = scale_for_tiling(image, detect_resolution / max(image.shape[:2]))
+    return detect_tiled(scaled, lambda tile: detect_hed(tile, tile.shape[0]), 'hed')
+
+def hed_edge_map(image_path, detect_resolution=512, store=None, allow_detect=True):
+    """
+    HED map for an image, read from (and saved to) the edge-map ``store`` if
+    given. Resolutions above ``TILED_ABOVE`` are detected in tiles.
+    """
+    def detect():
+        from controlnet_aux.util import HWC3
+        with timed('decode'):
+            image = HWC3(cv2.imread(str(image_path)))
+        with timed('forward', detector='hed', resolution=detect_resolution):
+            if detect_resolution > TILED_ABOVE:
+                return detect_hed_tiled(image, detect_resolution)
+            return detect_hed(image, detect_resolution)
+    
+    if store is None:
+        return detect()
+    return store.get_or_compute(
+        hash_image(image_path), store_name('hed'), detect_resolution, detect, allow_detect=allow_detect)
+
+def edge_weights(hed_detection):
+    """Sampling weights for a HED map: edge strength with enhanced contrast."""
+    return np.power(hed_detection / 255.0, 0.7)  # Adjust power for edge enhancement
+
+def sample_points(hed_detection, num_points, original_width, original_height, seed=0, method='weighted',
+                  sampler=None):
+    """
+    Sample ``num_points`` pixels of a HED map (see point_sampler.py for
+    ``method``). Returns an (N, 2) float64 array in original image
+    coordinates, ordered by importance. Pass a ``sampler`` built from
+    ``edge_weights`` to reuse its distribution table.
+    """
+    detect_height, detect_width = hed_detection.shape[:2]
+    sampler = sampler or PointSampler(edge_weights(hed_detection))
+    sampled_indices = sampler.sample(num_points, seed=seed, method=method)
     
     # Convert indices back to 2D coordinates in detection resolution
-    y_coords = sampled_indices // detect_width
-    x_coords = sampled_indices % detect_width
+    y_coords, x_coords = np.divmod(sampled_indices, detect_width)
     
     # Scale coordinates back to original image size
     scale_x = original_width / detect_width
     scale_y = original_height / detect_height
     
-    # Create points list with scaled coordinates
-    points = [
-        {
-            "x": float(x * scale_x),
-            "y": float(y * scale_y)
-        }
-        for x, y in zip(x_coords, y_coords)
-    ]
+    return np.stack([x_coords * scale_x, y_coords * scale_y], axis=1)
+
+def extract_point_array(image_path, num_points=5000, detect_resolution=512, store=None, allow_detect=True,
+                        seed=0, method='weighted'):
+    """
+    Array form of ``extract_points``: returns an (N, 2) float64 array of
+    points and the original ``(width, height)``.
+    """
+    original_width, original_height = image_size(image_path)
+    hed_detection = hed_edge_map(image_path, detect_resolution, store, allow_detect)
+    # Keyed on content, so a preview with a new point count reuses the table
+    with timed('sampling'):
+        sampler = cached_sampler((hash_image(image_path), detect_resolution), lambda: edge_weights(hed_detection))
+        points = sample_points(hed_detection, num_points, original_width, original_height, seed, method, sampler)
+    return points, (original_width, original_height)
+
+def points_to_dicts(points):
+    return [{"x": x, "y": y} for x, y in points.tolist()]
+
+def write_debug_images(debug_dir, hed_detection, points, original_width, original_height):
+    """Write the HED map, sampling distribution and point layout as PNGs to ``debug_dir``."""
+    debug_dir = Path(debug_dir)
+    debug_dir.mkdir(parents=True, exist_ok=True)
+    weights = edge_weights(hed_detection)
     
-    # Save debug visualizations
-    cv2.imwrite('debug_hed.png', (hed_detection).astype(np.uint8))
-    cv2.imwrite('debug_prob_map.png', (prob_map * 255).astype(np.uint8))
+    cv2.imwrite(str(debug_dir / 'debug_hed.png'), hed_detection.astype(np.uint8))
+    cv2.imwrite(str(debug_dir / 'debug_prob_map.png'), (weights / weights.sum() * 255).astype(np.uint8))
     
-    # Create visualization of point distribution
+    # Mark every point at once, then grow the marks into small dots
     point_viz = np.zeros((original_height, original_width), dtype=np.uint8)
-    for point in points:
-        cv2.circle(point_viz, 
-                  (int(point['x']), int(point['y'])), 
-                  1, 255, -1)
-    cv2.imwrite('debug_points.png', point_viz)
+    pixels = np.clip(points.astype(np.intp), 0, [original_width - 1, original_height - 1])
+    point_viz[pixels[:, 1], pixels[:, 0]] = 255
+    point_viz = cv2.dilate(point_viz, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    cv2.imwrite(str(debug_dir / 'debug_points.png'), point_viz)
+
+def extract_points(image_path, num_points=5000, detect_resolution=512, store=None, allow_detect=True,
+                   seed=0, method='weighted', debug_dir=None):
+    """
+    Extract points using HED edge detection.
+
+    With a ``store`` the HED map is read from (and saved to) the edge-map
+    store, so only the sampling runs when the map already exists. Debug
+    images are written only when ``debug_dir`` is given.
+    """
+    original_width, original_height = image_size(image_path)
+    
+    hed_detection = hed_edge_map(image_path, detect_resolution, store, allow_detect)
+    point_array = sample_points(hed_detection, num_points, original_width, original_height, seed, method)
+    
+    if debug_dir is not None:
+        write_debug_images(debug_dir, hed_detection, point_array, original_width, original_height)
     
     return {
-        "points": points,
+        "points": points_to_dicts(point_array),
         "dimensions": {
             "width": original_width,
             "height": original_height
@@ -113,7 +169,8 @@ if __name__ == "__main__":
         image_path,
         num_points=2500,  # Increased point count
         # edge_weight=0.8,    # Strong emphasis on edges
-        detect_resolution=768
+        detect_resolution=768,
+        debug_dir='.' if '--debug' in sys.argv else None
     )
     
     with open(output_path, 'w') as f:
@@ -0,0 +1,246 @@
+"""
+Polyline post-processing for lineart geometry.
+
+``findContours`` traces both sides of a thin stroke, and every resolution
+level traces the same strokes again, so the raw contours draw most lines two
+to six times. ``merge_levels`` walks the contours coarsest level first and
+rasterizes each kept segment into a coverage mask; a segment lying almost
+entirely on already covered pixels is a duplicate and is dropped. The
+surviving runs are chained end to end into polylines and vertices that no
+longer bend the line are removed. ``iter_merged_levels`` does the same one
+level at a time, as levels are extracted.
+
+The result is a flat vertex array plus ``path_offsets`` (polyline ``i`` is
+``vertices[path_offsets[i]:path_offsets[i + 1]]``) and ``level_offsets`` in
+polylines, the layout of the binary ``KIND_POLYLINES`` geometry.
+``simplify`` derives the coarser level-of-detail tiers from it.
+"""
+import cv2
+import numpy as np
+
+from effects.geometry.extractors.metrics import timed
+
+# Coverage mask resolution (longer side) and the distance, in mask pixels,
+# within which two lines count as the same line
+MASK_SIZE = 1024
+TOLERANCE = 2
+
+# A segment is a duplicate when this share of its samples is already covered
+COVERED_FRACTION = 0.8
+
+# Vertices closer than this (in mask pixels) to the line through their
+# neighbours are dropped
+COLLINEAR_EPSILON = 0.5
+
+# approxPolyDP tolerances (in mask pixels) of the level-of-detail tiers
+LOD_EPSILONS = [4.0, 8.0, 16.0]
+
+
+def _segment_covered(mask, a, b, skip):
+    """Whether segment ``a``-``b`` (mask coordinates) lies on covered pixels."""
+    delta = b - a
+    length = float(np.hypot(delta[0], delta[1]))
+    count = int(length)
+    if count == 0:
+        return False
+    # Samples next to ``a`` overlap the previous segment of the same polyline
+    t = (np.arange(count) + 0.5) / count
+    t = t[t * length > skip]
+    if len(t) == 0:
+        return False
+    samples = np.rint(a + t[:, None] * delta).astype(np.intp)
+    np.clip(samples, 0, [mask.shape[1] - 1, mask.shape[0] - 1], out=samples)
+    covered = mask[samples[:, 1], samples[:, 0]]
+    return np.count_nonzero(covered) >= COVERED_FRACTION * len(covered)
+
+
+def uncovered_runs(vertices, mask, scale, tolerance=TOLERANCE):
+    """
+    Split a polyline into its runs of segments not already drawn in ``mask``,
+    drawing the kept segments into it. Returns a list of vertex arrays.
+    """
+    points = vertices * scale
+    pixels = np.rint(points).astype(np.int32)
+    thickness = 2 * tolerance + 1
+    skip = 1.5 * tolerance
+
+    runs = []
+    start = 0
+    for i in range(len(points) - 1):
+        if _segment_covered(mask, points[i], points[i + 1], skip):
+            if i > start:
+                runs.append(vertices[start:i + 1])
+            start = i + 1
+        else:
+            cv2.line(mask, tuple(pixels[i].tolist()), tuple(pixels[i + 1].tolist()), 255, thickness)
+    if len(points) - 1 > start:
+        runs.append(vertices[start:])
+    return runs
+
+
+def chain_polylines(polylines, max_gap):
+    """
+    Join polylines whose endpoints lie within ``max_gap`` of each other,
+    reversing them as needed. Greedy: each chain grows from its tail, then
+    from its head, until no free endpoint is close enough.
+    """
+    cell = max(max_gap, 1e-9)
+    grid = {}
+    for index, polyline in enumerate(polylines):
+        for end, point in ((0, polyline[0]), (1, polyline[-1])):
+            key = (int(point[0] // cell), int(point[1] // cell))
+            grid.setdefault(key, []).append((index, end))
+
+    used = [False] * len(polylines)
+
+    def take_nearest(point):
+        cx, cy = int(point[0] // cell), int(point[1] // cell)
+        best, best_distance = None, max_gap
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for index, end in grid.get((cx + dx, cy + dy), ()):
+                    if used[index]:
+                        continue
+                    other = polylines[index][-1 if end else 0]
+                    distance = float(np.hypot(other[0] - point[0], other[1] - point[1]))
+                    if distance <= best_distance:
+                        best, best_distance = (index, end), distance
+        return best, best_distance
+
+    chains = []
+    for index, polyline in enumerate(polylines):
+        if used[index]:
+            continue
+        used[index] = True
+        parts = [polyline]
+        for _ in range(2):
+            while True:
+                match, distance = take_nearest(parts[-1][-1])
+                if match is None:
+                    break
+                other, end = match
+                used[other] = True
+                following = polylines[other][::-1] if end else polylines[other]
+                # Drop the shared vertex when the ends coincide exactly
+                parts.append(following[1:] if distance == 0 else following)
+            # Reverse the whole chain to grow it from the head next
+            parts = [part[::-1] for part in reversed(parts)]
+        chains.append(np.concatenate(parts) if len(parts) > 1 else parts[0])
+    return chains
+
+
+def drop_collinear(vertices, epsilon):
+    """Remove vertices within ``epsilon`` of the line from the last kept vertex to the next one."""
+    if len(vertices) < 3:
+        return vertices
+    keep = [0]
+    for i in range(1, len(vertices) - 1):
+        a, p, b = vertices[keep[-1]], vertices[i], vertices[i + 1]
+        ab = b - a
+        length = float(np.hypot(ab[0], ab[1]))
+        if length == 0:
+            distance = float(np.hypot(p[0] - a[0], p[1] - a[1]))
+        else:
+            distance = abs(ab[0] * (p[1] - a[1]) - ab[1] * (p[0] - a[0])) / length
+        if distance > epsilon:
+            keep.append(i)
+    keep.append(len(vertices) - 1)
+    return vertices[keep]
+
+
+def iter_merged_levels(levels, width, height, tolerance=TOLERANCE, mask_size=MASK_SIZE):
+    """
+    Deduplicate, chain and simplify the contours of each level as it arrives.
+
+    ``levels`` is an iterable, coarsest first, of lists of (n, 2) vertex
+    arrays in image coordinates; it is consumed lazily, so a generator of
+    levels still being extracted works. Yields each level's polylines (a list
+    of vertex arrays), keeping only what earlier levels did not already draw.
+    """
+    scale = mask_size / max(width, height, 1)
+    mask = np.zeros((int(np.ceil(height * scale)) + 1, int(np.ceil(width * scale)) + 1), dtype=np.uint8)
+    # Chaining bridges gaps with a new segment, so keep those short even
+    # when a coarse tier deduplicates with a wider tolerance
+    max_gap = min(tolerance, TOLERANCE) / scale
+    collinear_epsilon = COLLINEAR_EPSILON / scale
+
+    for contours in levels:
+        with timed('merge'):
+            runs = []
+            for vertices in contours:
+                runs.extend(uncovered_runs(vertices, mask, scale, tolerance))
+            paths = []
+            for polyline in chain_polylines(runs, max_gap):
+                polyline = drop_collinear(polyline, collinear_epsilon)
+                if len(polyline) > 1:
+                    paths.append(polyline)
+        yield paths
+
+
+def pack_levels(levels):
+    """
+    Flatten per-level lists of polylines to ``(vertices, path_offsets,
+    level_offsets)``.
+    """
+    paths = [path for level in levels for path in level]
+    path_offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+    path_offsets[1:] = np.cumsum([len(path) for path in paths])
+    level_offsets = np.zeros(len(levels) + 1, dtype=np.int64)
+    level_offsets[1:] = np.cumsum([len(level) for level in levels])
+    vertices = np.concatenate(paths) if paths else np.empty((0, 2))
+    return vertices, path_offsets, level_offsets
+
+
+def merge_levels(levels, width, height, tolerance=TOLERANCE, mask_size=MASK_SIZE):
+    """
+    Deduplicate, chain and simplify the contours of every level.
+
+    ``levels`` is a list, coarsest first, of lists of (n, 2) vertex arrays in
+    image coordinates. Returns ``(vertices, path_offsets, level_offsets)``.
+    Later levels keep only what earlier levels did not already draw.
+    """
+    return pack_levels(list(iter_merged_levels(levels, width, height, tolerance, mask_size)))
+
+
+def simplify(vertices, path_offsets, level_offsets, epsilon, width, height, mask_size=MASK_SIZE):
+    """
+    A coarser tier of merged polylines: each one re-approximated with
+    tolerance ``epsilon`` (mask pixels), dropping those shorter than
+    ``2 * epsilon``. Returns ``(vertices, path_offsets, level_offsets)``.
+    """
+    epsilon = epsilon * max(width, height, 1) / mask_size
+    paths = []
+    new_level_offsets = [0]
+    for level in range(len(level_offsets) - 1):
+        for i in range(level_offsets[level], level_offsets[level + 1]):
+            polyline = vertices[path_offsets[i]:path_offsets[i + 1]].astype(np.float32)
+            if cv2.arcLength(polyline, False) < 2 * epsilon:
+                continue
+            paths.append(cv2.approxPolyDP(polyline, epsilon, False)[:, 0, :])
+        new_level_offsets.append(len(paths))
+
+    new_path_offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+    new_path_offsets[1:] = np.cumsum([len(path) for path in paths])
+    new_vertices = np.concatenate(paths).astype(np.float64) if paths else np.empty((0, 2))
+    return new_vertices, new_path_offsets, np.array(new_level_offsets, dtype=np.int64)
+
+
+def polylines_to_dicts(vertices, path_offsets, level_offsets):
+    """JSON ``levels`` form: one list per level of ``{'points': [{'x', 'y'}, ...]}``."""
+    points = [{'x': x, 'y': y} for x, y in vertices.tolist()]
+    paths = [
+        {'points': points[path_offsets[i]:path_offsets[i + 1]]}
+        for i in range(len(path_offsets) - 1)
+    ]
+    return [
+        paths[level_offsets[i]:level_offsets[i + 1]]
+        for i in range(len(level_offsets) - 1)
+    ]
+
+
+def level_to_dicts(paths):
+    """JSON form of one level's polylines, as ``polylines_to_dicts`` gives it."""
+    return [
+        {'points': [{'x': x, 'y': y} for x, y in np.asarray(path, dtype=np.float64).tolist()]}
+        for path in paths
+    ]
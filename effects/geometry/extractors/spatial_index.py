@@ -0,0 +1,92 @@
+"""
+Spatial order and grid index for lineart polylines.
+
+Contours come out of ``findContours`` and the merge in no useful order, so
+an animation staggering paths by index jumps all over the image. Each
+level's paths are sorted by the cell of a uniform grid their bounding-box
+centre falls in (row-major: top to bottom, then left to right), and within a
+cell by the centre's y and x. A cell's paths are then one contiguous range,
+which ``grid_index`` records: per level, ``cols * rows + 1`` path offsets,
+so cell ``(cx, cy)`` of level ``l`` holds paths
+``cell_offsets[l, cy * cols + cx]`` up to ``cell_offsets[l, cy * cols + cx + 1]``.
+The index is stored with the packed geometry (see geometry_format.py).
+"""
+import numpy as np
+
+# Cells along the image's longer side
+GRID_CELLS = 16
+
+
+def grid_shape(width, height, cells=GRID_CELLS):
+    """``(cols, rows)`` of a grid of near-square cells, ``cells`` along the longer side."""
+    cell = max(width, height, 1) / cells
+    return max(1, int(np.ceil(width / cell))), max(1, int(np.ceil(height / cell)))
+
+
+def path_centres(vertices, path_offsets):
+    """Bounding-box centre of each polyline, as an (N, 2) array."""
+    if len(path_offsets) < 2:
+        return np.empty((0, 2))
+    vertices = np.asarray(vertices, dtype=np.float64)
+    starts = np.asarray(path_offsets[:-1], dtype=np.int64)
+    return (np.minimum.reduceat(vertices, starts) + np.maximum.reduceat(vertices, starts)) / 2
+
+
+def path_cells(centres, width, height, cols, rows):
+    """Row-major grid cell of each centre."""
+    cx = np.clip((centres[:, 0] * cols / max(width, 1)).astype(np.int64), 0, cols - 1)
+    cy = np.clip((centres[:, 1] * rows / max(height, 1)).astype(np.int64), 0, rows - 1)
+    return cy * cols + cx
+
+
+def _grid_order(centres, width, height, cells, levels=None):
+    cols, rows = grid_shape(width, height, cells)
+    keys = (centres[:, 0], centres[:, 1], path_cells(centres, width, height, cols, rows))
+    # Stable, so equal centres keep their extraction order
+    return np.lexsort(keys if levels is None else keys + (levels,))
+
+
+def order_level(paths, width, height, cells=GRID_CELLS):
+    """One level's polylines (a list of vertex arrays) in grid order."""
+    if len(paths) < 2:
+        return list(paths)
+    offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(path) for path in paths])
+    order = _grid_order(path_centres(np.concatenate(paths), offsets), width, height, cells)
+    return [paths[i] for i in order]
+
+
+def sort_paths(vertices, path_offsets, level_offsets, width, height, cells=GRID_CELLS):
+    """
+    Packed polylines with each level's paths in grid order; returns
+    ``(vertices, path_offsets, level_offsets)``. Levels keep their place.
+    """
+    path_offsets = np.asarray(path_offsets, dtype=np.int64)
+    levels = np.repeat(np.arange(len(level_offsets) - 1), np.diff(level_offsets))
+    order = _grid_order(path_centres(vertices, path_offsets), width, height, cells, levels)
+
+    lengths = np.diff(path_offsets)[order]
+    new_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    new_offsets[1:] = np.cumsum(lengths)
+    # Vertex j of new path i comes from old vertex path_offsets[order[i]] + j
+    index = np.repeat(path_offsets[:-1][order] - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+    return np.asarray(vertices)[index], new_offsets, level_offsets
+
+
+def grid_index(vertices, path_offsets, level_offsets, width, height, cells=GRID_CELLS):
+    """
+    The cell ranges of polylines already in grid order: a dict with ``cols``,
+    ``rows`` and ``cell_offsets``, an (L, cols * rows + 1) array of path
+    indices. Raises ValueError if the paths are not in grid order.
+    """
+    cols, rows = grid_shape(width, height, cells)
+    cell_of = path_cells(path_centres(vertices, path_offsets), width, height, cols, rows)
+    cell_offsets = np.zeros((len(level_offsets) - 1, cols * rows + 1), dtype=np.int64)
+    for level in range(len(level_offsets) - 1):
+        start, end = int(level_offsets[level]), int(level_offsets[level + 1])
+        level_cells = cell_of[start:end]
+        if np.any(np.diff(level_cells) < 0):
+            raise ValueError(f"Level {level} is not in grid order")
+        cell_offsets[level, 0] = start
+        cell_offsets[level, 1:] = start + np.cumsum(np.bincount(level_cells, minlength=cols * rows))
+    return {'cols': cols, 'rows': rows, 'cell_offsets': cell_offsets}
@@ -0,0 +1,125 @@
+"""
+Pre-rendered sprite atlases for lineart.
+
+A lineart scene of tens of thousands of polylines is that many vector paths
+for the client to tessellate, which weak devices cannot keep up with. The
+paths are already grouped by level and grid cell (see spatial_index.py), so
+each group is drawn here once, antialiased, into a white-on-transparent
+sprite, and the sprites are shelf-packed into a few PNG atlas pages. The
+client then moves one sprite per cell instead of every path.
+
+``build_atlas`` returns the pages and their metadata:
+
+    {'width', 'height'   source image size
+     'scale'             atlas pixels per image pixel
+     'cols', 'rows'      the grid the sprites follow
+     'levels'            level count
+     'pages'             page file names
+     'sprites'           [{'level', 'cell' (row-major), 'page',
+                           'frame': [x, y, w, h] on the page,
+                           'bounds': [x, y, w, h] in image space}]}
+
+Sprites too large for a page at ``scale`` are drawn smaller; ``bounds``
+still gives their place in the image.
+"""
+import cv2
+import numpy as np
+
+# Largest page side, in pixels; WebGL guarantees at least 2048
+PAGE_SIZE = 2048
+# Transparent border around each sprite, so filtering never bleeds
+PADDING = 2
+LINE_WIDTH = 1
+# Fractional bits of the coordinates given to cv2.polylines
+SHIFT = 4
+
+
+def render_sprite(paths, scale, max_size=PAGE_SIZE - 2 * PADDING):
+    """
+    Draw polylines (a list of (n, 2) image-space vertex arrays) into an alpha
+    mask at ``scale``, reduced so neither side exceeds ``max_size``. Returns
+    the mask and its image-space bounds ``[x, y, w, h]``.
+    """
+    vertices = np.concatenate(paths)
+    left, top = np.floor(vertices.min(axis=0)) - LINE_WIDTH
+    right, bottom = np.ceil(vertices.max(axis=0)) + LINE_WIDTH
+    width, height = right - left, bottom - top
+    scale = min(scale, max_size / max(width, height))
+    size = (max(1, int(np.ceil(height * scale))), max(1, int(np.ceil(width * scale))))
+
+    mask = np.zeros(size, dtype=np.uint8)
+    origin = np.array([left, top])
+    points = [np.rint((path - origin) * scale * (1 << SHIFT)).astype(np.int32) for path in paths]
+    cv2.polylines(mask, points, False, 255, LINE_WIDTH, cv2.LINE_AA, SHIFT)
+    return mask, [float(left), float(top), float(width), float(height)]
+
+
+def pack_shelves(sizes, page_size=PAGE_SIZE):
+    """
+    Place ``(w, h)`` rectangles on pages of ``page_size``, tallest first, in
+    rows (shelves). Returns each rectangle's ``(page, x, y)`` and the used
+    ``(w, h)`` of each page.
+    """
+    placements = [None] * len(sizes)
+    pages = []
+    x = y = shelf_height = 0
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+        w, h = sizes[i]
+        if x + w > page_size:
+            x, y, shelf_height = 0, y + shelf_height, 0
+        if not pages or y + h > page_size:
+            pages.append([0, 0])
+            x = y = shelf_height = 0
+        placements[i] = (len(pages) - 1, x, y)
+        pages[-1][0] = max(pages[-1][0], x + w)
+        pages[-1][1] = max(pages[-1][1], y + h)
+        x += w
+        shelf_height = max(shelf_height, h)
+    return placements, pages
+
+
+def build_atlas(geometry, scale, name, page_size=PAGE_SIZE):
+    """
+    Render lineart in array form (with its ``grid``, see pipeline.py) to
+    sprites, one per non-empty level and cell, packed into atlas pages.
+    Returns the metadata and the PNG bytes of each page, which are to be
+    stored as ``<name>.atlas<i>.png``.
+    """
+    vertices, path_offsets = geometry['coords'], geometry['path_offsets']
+    grid = geometry['grid']
+    cell_offsets = grid['cell_offsets']
+
+    sprites, masks = [], []
+    for level in range(len(cell_offsets)):
+        for cell in range(len(cell_offsets[level]) - 1):
+            start, end = int(cell_offsets[level, cell]), int(cell_offsets[level, cell + 1])
+            if start == end:
+                continue
+            paths = [vertices[path_offsets[i]:path_offsets[i + 1]] for i in range(start, end)]
+            mask, bounds = render_sprite(paths, scale, page_size - 2 * PADDING)
+            sprites.append({'level': level, 'cell': cell, 'bounds': bounds})
+            masks.append(mask)
+
+    placements, page_sizes = pack_shelves(
+        [(mask.shape[1] + 2 * PADDING, mask.shape[0] + 2 * PADDING) for mask in masks], page_size)
+    # White lines, so the client can tint them; coverage goes in alpha
+    pages = [np.zeros((h, w, 4), dtype=np.uint8) for w, h in page_sizes]
+    for page in pages:
+        page[..., :3] = 255
+    for sprite, mask, (page, x, y) in zip(sprites, masks, placements):
+        h, w = mask.shape
+        pages[page][y + PADDING:y + PADDING + h, x + PADDING:x + PADDING + w, 3] = mask
+        sprite['page'] = page
+        sprite['frame'] = [x + PADDING, y + PADDING, w, h]
+
+    meta = {
+        'width': geometry['width'],
+        'height': geometry['height'],
+        'scale': scale,
+        'cols': grid['cols'],
+        'rows': grid['rows'],
+        'levels': len(cell_offsets),
+        'pages': [f"{name}.atlas{i}.png" for i in range(len(pages))],
+        'sprites': sprites,
+    }
+    return meta, [cv2.imencode('.png', page)[1].tobytes() for page in pages]
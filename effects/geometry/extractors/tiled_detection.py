@@ -0,0 +1,179 @@
+"""
+Tiled detection for large images.
+
+The detectors' activations grow with the square of the input size (about
+1.2 KB per pixel for lineart), so detecting a big page in one pass either
+has to downscale it or risks running out of memory. ``detect_tiled`` runs a
+detector over overlapping fixed-size tiles instead and blends them back into
+one edge map, with linear ramps across each overlap so no seams show.
+
+Tiles run on a thread pool sharing one model: torch releases the GIL inside
+its kernels, and threads avoid a model copy per worker. How many tiles are
+in flight at once is capped so their estimated activation memory stays under
+``max_bytes``; when the full-size blending buffers would take a large share
+of that too, they are memory-mapped to a scratch directory.
+
+Settings come from the environment:
+
+``PILE_DETECTION_MAX_BYTES``   memory ceiling for tiled detection (default 2 GiB)
+``PILE_DETECTION_TILE_SIZE``   tile side in pixels (default 512)
+``PILE_DETECTION_WORKERS``     tiles run in parallel at most (default: CPU count)
+"""
+import os
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+from effects.geometry.extractors.metrics import metrics
+
+# Detection resolutions above this are run tiled
+TILED_ABOVE = 1024
+
+DEFAULT_TILE_SIZE = 512
+DEFAULT_OVERLAP = 64
+DEFAULT_MAX_BYTES = 2 << 30
+
+# Measured peak activation memory per input pixel
+BYTES_PER_PIXEL = {
+    'lineart': 1200,
+    'hed': 900,
+}
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def plan_tiles(width, height, tile_size, overlap):
+    """
+    ``(x0, y0, x1, y1)`` boxes of at most ``tile_size`` covering the image,
+    overlapping their neighbours by at least ``overlap`` pixels.
+    """
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        stride = tile_size - overlap
+        positions = list(range(0, length - tile_size, stride))
+        # Last tile flush with the edge, so every tile is full size
+        positions.append(length - tile_size)
+        return positions
+
+    return [
+        (x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+        for y0 in starts(height)
+        for x0 in starts(width)
+    ]
+
+
+def _ramp(start, end, length, overlap):
+    """1-D blending weights of a tile spanning ``start:end`` of ``length``."""
+    weights = np.ones(end - start, dtype=np.float32)
+    if overlap <= 0:
+        return weights
+    positions = np.arange(end - start, dtype=np.float32) + 0.5
+    if start > 0:
+        weights = np.minimum(weights, positions / overlap)
+    if end < length:
+        weights = np.minimum(weights, (end - start - positions) / overlap)
+    return weights
+
+
+def tile_concurrency(detector, tile_size, max_bytes, workers):
+    """Tiles that may run at once without their activations exceeding ``max_bytes``."""
+    per_tile = BYTES_PER_PIXEL.get(detector, max(BYTES_PER_PIXEL.values())) * tile_size * tile_size
+    return max(1, min(workers, max_bytes // per_tile))
+
+
+def detect_tiled(image, run_tile, detector, tile_size=None, overlap=DEFAULT_OVERLAP, workers=None,
+                 max_bytes=None):
+    """
+    Run ``run_tile`` over overlapping tiles of ``image`` (HWC uint8) and
+    blend the results into one uint8 edge map of the image's size.
+
+    ``run_tile`` takes a square ``tile_size`` RGB tile (edge tiles are
+    reflect-padded) and returns a single-channel map of the same size.
+    ``detector`` names the model for the memory estimate.
+    """
+    tile_size = tile_size or _env_int('PILE_DETECTION_TILE_SIZE', DEFAULT_TILE_SIZE)
+    workers = workers or _env_int('PILE_DETECTION_WORKERS', os.cpu_count() or 1)
+    max_bytes = max_bytes or _env_int('PILE_DETECTION_MAX_BYTES', DEFAULT_MAX_BYTES)
+    overlap = min(overlap, tile_size // 2)
+
+    height, width = image.shape[:2]
+    tiles = plan_tiles(width, height, tile_size, overlap)
+    concurrency = min(tile_concurrency(detector, tile_size, max_bytes, workers), len(tiles))
+    metrics.inc('pile_tiled_detections_total', detector=detector)
+    metrics.inc('pile_detection_tiles_total', len(tiles), detector=detector)
+
+    def detect(box):
+        x0, y0, x1, y1 = box
+        tile = image[y0:y1, x0:x1]
+        pad_y, pad_x = tile_size - (y1 - y0), tile_size - (x1 - x0)
+        if pad_x or pad_y:
+            tile = cv2.copyMakeBorder(tile, 0, pad_y, 0, pad_x, cv2.BORDER_REFLECT)
+        edges = run_tile(np.ascontiguousarray(tile))
+        if edges.shape[:2] != (tile_size, tile_size):
+            # Detectors snap their input to multiples of 64
+            edges = cv2.resize(edges, (tile_size, tile_size))
+        return box, edges[:y1 - y0, :x1 - x0]
+
+    with tempfile.TemporaryDirectory(prefix='pile-tiles-') as scratch:
+        # Blending buffers: float32 sums and weights for every pixel
+        if width * height * 8 > max_bytes // 4:
+            total = np.memmap(os.path.join(scratch, 'total'), dtype=np.float32, mode='w+', shape=(height, width))
+            weight = np.memmap(os.path.join(scratch, 'weight'), dtype=np.float32, mode='w+', shape=(height, width))
+        else:
+            total = np.zeros((height, width), dtype=np.float32)
+            weight = np.zeros((height, width), dtype=np.float32)
+
+        def blend(box, edges):
+            x0, y0, x1, y1 = box
+            tile_weight = np.outer(_ramp(y0, y1, height, overlap), _ramp(x0, x1, width, overlap))
+            total[y0:y1, x0:x1] += edges * tile_weight
+            weight[y0:y1, x0:x1] += tile_weight
+
+        with _torch_threads(concurrency), ThreadPoolExecutor(max_workers=concurrency) as pool:
+            pending = set()
+            for box in tiles:
+                # Keep at most ``concurrency`` tiles (and their activations) alive
+                if len(pending) >= concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        blend(*future.result())
+                pending.add(pool.submit(detect, box))
+            for future in pending:
+                blend(*future.result())
+
+        edge_map = np.empty((height, width), dtype=np.uint8)
+        rows = max(1, (max_bytes // 16) // max(width * 4, 1))
+        for y in range(0, height, rows):
+            np.rint(total[y:y + rows] / np.maximum(weight[y:y + rows], 1e-6), out=total[y:y + rows])
+            edge_map[y:y + rows] = np.clip(total[y:y + rows], 0, 255)
+        del total, weight
+    return edge_map
+
+
+@contextmanager
+def _torch_threads(concurrency):
+    """Split torch's intra-op threads between the tiles running at once."""
+    import torch
+    previous = torch.get_num_threads()
+    torch.set_num_threads(max(1, previous // concurrency))
+    try:
+        yield
+    finally:
+        torch.set_num_threads(previous)
+
+
+def scale_for_tiling(image, scale):
+    """Resize ``image`` by ``scale`` (at most 1: never past native resolution)."""
+    scale = min(scale, 1.0)
+    if scale == 1.0:
+        return image
+    height, width = image.shape[:2]
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
@@ -1,57 +1,260 @@
+import { KIND_POLYLINES, KIND_SEGMENTS } from '../../../core/geometry-format.js';
+
+// Cells along the image's longer side, as in spatial_index.py
+const GRID_CELLS = 16;
+
+// Every input form (packed binary, JSON polylines, JSON start/end segments) is
+// held as polylines: levelOffsets index paths, pathOffsets index vertices and
+// coords holds x, y per vertex, multiplied by scaleX / scaleY on read.
+//
+// The grid (see getGrid) finds the paths of any cell of a uniform grid over
+// the image in O(1), so animations can sweep the image in spatial order.
 export class LineArtGeometry {
     static type = 'lineart';
-    
+
     constructor(data) {
+        // Pre-rendered sprites of each level and cell, attached by the loader
+        // when the client is too weak for the vectors (see geometry-registry.js)
+        this.atlas = null;
+        if (data.packed) {
+            this.fromPacked(data.packed);
+            return;
+        }
         if (!data.levels) {
             throw new Error('LineArt geometry data must contain levels array');
         }
-        this.levels = data.levels;
-        this.validateData();
+        this.validateData(data.levels);
+        this.fromLevels(data.levels);
+    }
+
+    // The decoder checked the header; only the layout needs confirming
+    fromPacked(packed) {
+        const { kind, components, itemCount, levelOffsets, coords } = packed;
+        if (kind === KIND_POLYLINES) {
+            this.pathOffsets = packed.pathOffsets;
+        } else if (kind === KIND_SEGMENTS && components === 4) {
+            // A segment is a two-vertex path over the same coordinates
+            this.pathOffsets = new Uint32Array(itemCount + 1);
+            for (let i = 0; i <= itemCount; i++) {
+                this.pathOffsets[i] = i * 2;
+            }
+        } else {
+            throw new Error('LineArt geometry data must contain segments or polylines');
+        }
+        if (levelOffsets[levelOffsets.length - 1] !== itemCount ||
+            coords.length !== this.pathOffsets[itemCount] * 2) {
+            throw new Error('LineArt geometry data is truncated');
+        }
+        this.levelOffsets = levelOffsets;
+        this.coords = coords;
+        this.scaleX = packed.scaleX;
+        this.scaleY = packed.scaleY;
+        this.width = packed.width;
+        this.height = packed.height;
+        // Extracted in grid order, with the index; older files get one built
+        this.grid = packed.grid;
+    }
+
+    fromLevels(levels) {
+        const paths = levels.flat().map(item =>
+            item.points ? item.points : [item.start, item.end]
+        );
+        this.levelOffsets = new Uint32Array(levels.length + 1);
+        levels.forEach((level, i) => {
+            this.levelOffsets[i + 1] = this.levelOffsets[i] + level.length;
+        });
+        this.pathOffsets = new Uint32Array(paths.length + 1);
+        paths.forEach((points, i) => {
+            this.pathOffsets[i + 1] = this.pathOffsets[i] + points.length;
+        });
+        this.coords = new Float32Array(this.pathOffsets[paths.length] * 2);
+        let offset = 0;
+        paths.forEach(points => points.forEach(point => {
+            this.coords[offset++] = point.x;
+            this.coords[offset++] = point.y;
+        }));
+        this.scaleX = 1;
+        this.scaleY = 1;
+        this.width = 0;
+        this.height = 0;
+        this.grid = null;
     }
 
     // Validation specific to LineArt format
-    validateData() {
-        if (!Array.isArray(this.levels)) {
+    validateData(levels) {
+        if (!Array.isArray(levels)) {
             throw new Error('LineArt geometry data must contain levels array');
         }
-        
-        this.levels.forEach((level, i) => {
+
+        const isPoint = point => point &&
+            typeof point.x === 'number' &&
+            typeof point.y === 'number';
+
+        levels.forEach((level, i) => {
             if (!Array.isArray(level)) {
                 throw new Error(`Level ${i} must be an array`);
             }
 
-            level.forEach((segment, j) => {
-                const valid = segment && 
-                    typeof segment === 'object' &&
-                    segment.start && segment.end &&
-                    typeof segment.start.x === 'number' &&
-                    typeof segment.start.y === 'number' &&
-                    typeof segment.end.x === 'number' &&
-                    typeof segment.end.y === 'number';
+            level.forEach((item, j) => {
+                const valid = item && typeof item === 'object' && (
+                    item.points
+                        ? Array.isArray(item.points) && item.points.length > 1 && item.points.every(isPoint)
+                        : isPoint(item.start) && isPoint(item.end)
+                );
 
                 if (!valid) {
-                    console.error('Invalid segment:', segment);
-                    throw new Error(`Invalid segment at level ${i}, index ${j}`);
+                    console.error('Invalid path:', item);
+                    throw new Error(`Invalid path at level ${i}, index ${j}`);
                 }
             });
         });
     }
 
+    getLevelCount() {
+        return this.levelOffsets.length - 1;
+    }
+
+    // One path as an array of { x, y } points
+    getPath(path) {
+        const points = [];
+        for (let v = this.pathOffsets[path]; v < this.pathOffsets[path + 1]; v++) {
+            points.push({ x: this.coords[v * 2] * this.scaleX, y: this.coords[v * 2 + 1] * this.scaleY });
+        }
+        return points;
+    }
+
+    // Paths of one level, each an array of { x, y } points
+    getLevelPaths(level) {
+        const paths = [];
+        for (let path = this.levelOffsets[level]; path < this.levelOffsets[level + 1]; path++) {
+            paths.push(this.getPath(path));
+        }
+        return paths;
+    }
+
+    // { cols, rows, cellOffsets, order }: the paths of cell c (row-major) of a
+    // level are entries cellOffsets[level * (cols * rows + 1) + c] up to the
+    // next offset, each entry k being path order[k] (or k when order is null)
+    getGrid() {
+        if (!this.grid) {
+            this.grid = this.buildGrid();
+        }
+        return this.grid;
+    }
+
+    // A counting sort of each level's paths by the cell of their bounding-box
+    // centre, for geometry that came without an index
+    buildGrid() {
+        const pathCount = this.pathOffsets.length - 1;
+        let width = this.width;
+        let height = this.height;
+        const centres = new Float64Array(pathCount * 2);
+        for (let path = 0; path < pathCount; path++) {
+            let minX = Infinity, minY = Infinity, maxX = -Infinity, maxY = -Infinity;
+            for (let v = this.pathOffsets[path]; v < this.pathOffsets[path + 1]; v++) {
+                const x = this.coords[v * 2] * this.scaleX;
+                const y = this.coords[v * 2 + 1] * this.scaleY;
+                minX = Math.min(minX, x);
+                maxX = Math.max(maxX, x);
+                minY = Math.min(minY, y);
+                maxY = Math.max(maxY, y);
+            }
+            centres[path * 2] = (minX + maxX) / 2;
+            centres[path * 2 + 1] = (minY + maxY) / 2;
+            if (!this.width) {
+                width = Math.max(width, maxX);
+                height = Math.max(height, maxY);
+            }
+        }
+        width = Math.max(width, 1);
+        height = Math.max(height, 1);
+        const cell = Math.max(width, height) / GRID_CELLS;
+        const cols = Math.max(1, Math.ceil(width / cell));
+        const rows = Math.max(1, Math.ceil(height / cell));
+        const cellOf = path => {
+            const cx = Math.min(cols - 1, Math.max(0, Math.floor(centres[path * 2] * cols / width)));
+            const cy = Math.min(rows - 1, Math.max(0, Math.floor(centres[path * 2 + 1] * rows / height)));
+            return cy * cols + cx;
+        };
+
+        const stride = cols * rows + 1;
+        const levelCount = this.getLevelCount();
+        const cellOffsets = new Uint32Array(levelCount * stride);
+        const order = new Uint32Array(pathCount);
+        for (let level = 0; level < levelCount; level++) {
+            const base = level * stride;
+            const start = this.levelOffsets[level];
+            const end = this.levelOffsets[level + 1];
+            for (let path = start; path < end; path++) {
+                cellOffsets[base + cellOf(path) + 1]++;
+            }
+            cellOffsets[base] = start;
+            for (let c = 1; c < stride; c++) {
+                cellOffsets[base + c] += cellOffsets[base + c - 1];
+            }
+            const next = cellOffsets.slice(base, base + stride - 1);
+            for (let path = start; path < end; path++) {
+                order[next[cellOf(path)]++] = path;
+            }
+        }
+        return { cols, rows, cellOffsets, order };
+    }
+
+    // Paths of one row of grid cells (row 0 at the top), left to right
+    getRowPaths(level, row) {
+        const { cols, rows, cellOffsets, order } = this.getGrid();
+        const base = level * (cols * rows + 1) + row * cols;
+        const paths = [];
+        for (let k = cellOffsets[base]; k < cellOffsets[base + cols]; k++) {
+            paths.push(this.getPath(order ? order[k] : k));
+        }
+        return paths;
+    }
+
+    // Atlas sprites of a level, of one row of grid cells or (row null) all of them
+    getAtlasSprites(level, row = null) {
+        return this.atlas.sprites.filter(sprite => sprite.level === level &&
+            (row === null || Math.floor(sprite.cell / this.atlas.cols) === row));
+    }
+
     getTotalSegments() {
-        return this.levels.reduce((sum, level) => sum + level.length, 0);
+        const pathCount = this.pathOffsets.length - 1;
+        return this.pathOffsets[pathCount] - pathCount;
     }
 
     getSegmentAt(globalIndex) {
-        let remainingIndex = globalIndex;
-        for (let level = 0; level < this.levels.length; level++) {
-            if (remainingIndex < this.levels[level].length) {
-                return {
-                    segment: this.levels[level][remainingIndex],
-                    level
-                };
+        if (globalIndex < 0 || globalIndex >= this.getTotalSegments()) {
+            throw new Error('Segment index out of bounds');
+        }
+        // Path p holds segments (pathOffsets[p] - p) up to (pathOffsets[p + 1] - p - 1)
+        let lo = 0;
+        let hi = this.pathOffsets.length - 2;
+        while (lo < hi) {
+            const mid = (lo + hi + 1) >> 1;
+            if (this.pathOffsets[mid] - mid <= globalIndex) {
+                lo = mid;
+            } else {
+                hi = mid - 1;
+            }
+        }
+        // The last level starting at or before path lo
+        let level = 0;
+        let top = this.getLevelCount() - 1;
+        while (level < top) {
+            const mid = (level + top + 1) >> 1;
+            if (this.levelOffsets[mid] <= lo) {
+                level = mid;
+            } else {
+                top = mid - 1;
             }
-            remainingIndex -= this.levels[level].length;
         }
-        throw new Error('Segment index out of bounds');
+        const v = globalIndex + lo;
+        return {
+            segment: {
+                start: { x: this.coords[v * 2] * this.scaleX, y: this.coords[v * 2 + 1] * this.scaleY },
+                end: { x: this.coords[v * 2 + 2] * this.scaleX, y: this.coords[v * 2 + 3] * this.scaleY }
+            },
+            level
+        };
     }
-}
\ No newline at end of file
+}
@@ -1,14 +1,34 @@
+import { KIND_POINTS } from '../../../core/geometry-format.js';
+
 export class PointCloudGeometry {
     static type = 'pointcloud';
     
     constructor(data) {
+        if (data.packed) {
+            // Binary geometry: point objects are only built if asked for
+            this.packed = data.packed;
+            this.points = null;
+            this.validatePacked();
+            return;
+        }
         if (!Array.isArray(data.points)) {
             throw new Error('PointCloud geometry data must contain points array');
         }
+        this.packed = null;
         this.points = data.points;
         this.validateData();
     }
 
+    validatePacked() {
+        const { kind, components, itemCount, coords } = this.packed;
+        if (kind !== KIND_POINTS || components !== 2) {
+            throw new Error('PointCloud geometry data must contain points');
+        }
+        if (coords.length !== itemCount * 2) {
+            throw new Error('PointCloud geometry data is truncated');
+        }
+    }
+
     validateData() {
         this.points.forEach((point, i) => {
             if (!point || 
@@ -20,6 +40,13 @@ export class PointCloudGeometry {
     }
 
     getPoints() {
+        if (!this.points) {
+            const { itemCount, coords, scaleX, scaleY } = this.packed;
+            this.points = new Array(itemCount);
+            for (let i = 0; i < itemCount; i++) {
+                this.points[i] = { x: coords[i * 2] * scaleX, y: coords[i * 2 + 1] * scaleY };
+            }
+        }
         return this.points;
     }
-}
\ No newline at end of file
+}
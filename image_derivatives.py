@@ -0,0 +1,224 @@
+"""
+Resized, re-encoded and tiled copies of uploaded images.
+
+The viewer used to load every scene image at full resolution, however small
+the screen. ``build_derivatives`` (run as a job after each upload) writes,
+in a directory named by the original's content hash::
+
+    assets/images/derived/<image>/<hash>/
+        manifest.json           sizes and file names of everything below
+        <width>.webp, .avif     resized tiers (AVIF when Pillow can encode it)
+        image.dzi               Deep Zoom descriptor
+        image_files/<level>/<col>_<row>.webp
+                                the Deep Zoom tile pyramid
+
+The viewer picks the smallest tier that covers the screen, and for scenes
+with ``image.derivatives: "tiles"`` it loads only the tiles the current
+panzoom view shows, see ``core/tiled-image.js``. Files under a hash directory
+never change, so they are served as immutable. Build copies for images that
+were uploaded before with::
+
+    python image_derivatives.py [image ...]
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import time
+from pathlib import Path
+
+from PIL import Image, features
+
+from static_assets import assets
+
+BASE_DIR = Path(__file__).parent
+IMAGES_DIR = BASE_DIR / 'assets' / 'images'
+DERIVED_DIR = IMAGES_DIR / 'derived'
+
+MANIFEST = 'manifest.json'
+
+# Longer side of each resized tier; tiers not smaller than the original are skipped
+TIER_SIZES = (640, 1280, 1920, 2560)
+QUALITY = {'webp': 82, 'avif': 60}
+
+# Deep Zoom defaults: 254px tiles with a 1px overlap make 256px files
+TILE_SIZE = 254
+TILE_OVERLAP = 1
+TILE_FORMAT = 'webp'
+TILE_QUALITY = 80
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+
+
+def tier_formats():
+    """Encodings written for each tier, smallest first."""
+    return ['avif', 'webp'] if features.check('avif') else ['webp']
+
+
+def derived_dir(image_path):
+    """Directory of the derivatives of ``image_path``'s current content."""
+    image_path = Path(image_path)
+    return DERIVED_DIR / image_path.name / assets.digest(image_path)
+
+
+def load_manifest(image_path):
+    """The derivative manifest of ``image_path``, or None if not built yet."""
+    try:
+        with open(derived_dir(image_path) / MANIFEST) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _save(image, path, image_format, quality):
+    if image_format == 'avif':
+        image.save(path, 'AVIF', quality=quality)
+    else:
+        image.save(path, 'WEBP', quality=quality, method=4)
+
+
+def _normalize(image):
+    """RGB, or RGBA when the image has transparency."""
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    return image.convert('RGBA' if has_alpha else 'RGB')
+
+
+def dzi_levels(width, height):
+    """``(level, width, height)`` of each Deep Zoom level, 1x1 up to full size."""
+    max_level = math.ceil(math.log2(max(width, height)))
+    return [
+        (level, math.ceil(width / 2 ** (max_level - level)), math.ceil(height / 2 ** (max_level - level)))
+        for level in range(max_level + 1)
+    ]
+
+
+def write_tiers(image, directory):
+    """Copies of ``image`` at each tier size smaller than it."""
+    width, height = image.size
+    tiers = []
+    for size in TIER_SIZES:
+        if size >= max(width, height):
+            break
+        scale = size / max(width, height)
+        tier_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        resized = image.resize(tier_size, Image.Resampling.LANCZOS)
+        files = {}
+        for image_format in tier_formats():
+            name = f"{size}.{image_format}"
+            _save(resized, directory / name, image_format, QUALITY[image_format])
+            files[image_format] = name
+        tiers.append({'width': tier_size[0], 'height': tier_size[1], 'files': files})
+    return tiers
+
+
+def write_tiles(image, directory, on_progress=None):
+    """The Deep Zoom pyramid of ``image``; returns its level sizes."""
+    width, height = image.size
+    levels = dzi_levels(width, height)
+    tiles_dir = directory / 'image_files'
+    level_image = image
+    described = []
+    for level, level_width, level_height in reversed(levels):
+        if level_image.size != (level_width, level_height):
+            # Each level halves the one above, as Deep Zoom viewers expect
+            level_image = level_image.resize((level_width, level_height), Image.Resampling.LANCZOS)
+        columns = math.ceil(level_width / TILE_SIZE)
+        rows = math.ceil(level_height / TILE_SIZE)
+        level_dir = tiles_dir / str(level)
+        level_dir.mkdir(parents=True)
+        for column in range(columns):
+            left = max(column * TILE_SIZE - TILE_OVERLAP, 0)
+            right = min((column + 1) * TILE_SIZE + TILE_OVERLAP, level_width)
+            for row in range(rows):
+                top = max(row * TILE_SIZE - TILE_OVERLAP, 0)
+                bottom = min((row + 1) * TILE_SIZE + TILE_OVERLAP, level_height)
+                tile = level_image.crop((left, top, right, bottom))
+                _save(tile, level_dir / f"{column}_{row}.{TILE_FORMAT}", TILE_FORMAT, TILE_QUALITY)
+        described.append({'level': level, 'width': level_width, 'height': level_height,
+                           'columns': columns, 'rows': rows})
+        if on_progress:
+            on_progress(stage='tiles', levels_done=len(described), levels_total=len(levels))
+
+    with open(directory / 'image.dzi', 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{TILE_FORMAT}" '
+                f'Overlap="{TILE_OVERLAP}" TileSize="{TILE_SIZE}">'
+                f'<Size Width="{width}" Height="{height}"/></Image>\n')
+    return sorted(described, key=lambda item: item['level'])
+
+
+def build_derivatives(image_path, on_progress=None):
+    """
+    Build the tiers and tile pyramid of ``image_path`` unless they exist for
+    its current content; copies of its earlier versions are removed. A job
+    function, see jobs.py.
+    """
+    image_path = Path(image_path)
+    directory = derived_dir(image_path)
+    url = '/' + directory.relative_to(BASE_DIR).as_posix() + '/'
+    if (directory / MANIFEST).exists():
+        return {'manifest': url + MANIFEST, 'cached': True}
+
+    start = time.perf_counter()
+    # Built in a scratch directory and renamed into place, so readers never see half of it
+    scratch = directory.with_name(f".{directory.name}.{os.getpid()}.tmp")
+    shutil.rmtree(scratch, ignore_errors=True)
+    scratch.mkdir(parents=True)
+    try:
+        with Image.open(image_path) as opened:
+            image = _normalize(opened)
+        if on_progress:
+            on_progress(stage='tiers')
+        tiers = write_tiers(image, scratch)
+        levels = write_tiles(image, scratch, on_progress)
+        manifest = {
+            'source': image_path.name,
+            'width': image.width,
+            'height': image.height,
+            'url': url,
+            'tiers': tiers,
+            'tiles': {
+                'dzi': 'image.dzi',
+                'path': 'image_files/{level}/{column}_{row}.' + TILE_FORMAT,
+                'tile_size': TILE_SIZE,
+                'overlap': TILE_OVERLAP,
+                'levels': levels,
+            },
+        }
+        with open(scratch / MANIFEST, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        try:
+            os.rename(scratch, directory)
+        except OSError:
+            # Built concurrently by another worker; theirs is identical
+            if not (directory / MANIFEST).exists():
+                raise
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    for old in directory.parent.iterdir():
+        if old != directory and not old.name.startswith('.'):
+            shutil.rmtree(old, ignore_errors=True)
+
+    tile_count = sum(level['columns'] * level['rows'] for level in levels)
+    print(f"Built {len(tiers)} tiers and {tile_count} tiles for {image_path.name} "
+          f"in {time.perf_counter() - start:.1f}s")
+    return {'manifest': url + MANIFEST, 'cached': False, 'tiers': len(tiers), 'tiles': tile_count}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build resized tiers and deep-zoom tiles of scene images')
+    parser.add_argument('images', nargs='*', help='Image files (default: every image in assets/images)')
+    args = parser.parse_args(argv)
+
+    paths = [Path(path) for path in args.images] or sorted(
+        path for path in IMAGES_DIR.iterdir() if path.suffix.lower() in IMAGE_EXTENSIONS)
+    for path in paths:
+        result = build_derivatives(path)
+        if result['cached']:
+            print(f"{path.name}: up to date")
+
+
+if __name__ == '__main__':
+    main()
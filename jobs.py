@@ -0,0 +1,322 @@
+"""
+Background job queue for geometry extraction.
+
+Jobs run in a pool of spawned worker processes so that long extractions never
+block a Flask worker. Each worker keeps its own warm model registry, and torch
+is limited to ``cpu_count // max_workers`` threads per worker so a burst of
+jobs cannot oversubscribe the CPU.
+
+Job functions must be importable module-level callables that accept an
+``on_progress`` keyword argument; calling it from the worker updates the job's
+``progress`` field in the server process.
+
+Jobs submitted with ``stream=True`` also get an ``on_output`` keyword
+argument: each call publishes a chunk of output (e.g. one geometry level)
+that ``iter_output`` hands to readers as soon as it arrives, while the job
+is still running.
+
+Each job's peak memory is recorded on it (``peak_memory_bytes``), and the
+stage timings workers record (see metrics.py) are merged into the server's
+metrics after every job.
+"""
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from effects.geometry.extractors.metrics import metrics, peak_rss_bytes, reset_peak_rss
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+SUPERSEDED = 'superseded'
+# Not job states: workers publish their model registry stats and streamed
+# output under these tags
+MODELS = 'models'
+OUTPUT = 'output'
+METRICS = 'metrics'
+
+DONE_STATES = (FINISHED, FAILED, SUPERSEDED)
+
+# Seconds a finished job's streamed output is kept for late readers
+OUTPUT_TTL = 300
+
+
+class QueueFull(Exception):
+    pass
+
+
+# Worker process state, set by _init_worker
+_events = None
+_current_job = None
+
+
+def _init_worker(events, torch_threads):
+    global _events
+    _events = events
+    if torch_threads:
+        import torch
+        torch.set_num_threads(torch_threads)
+
+
+def report_progress(**info):
+    """Publish progress for the job running in this worker process."""
+    if _events is not None and _current_job is not None:
+        _events.put((_current_job, RUNNING, info))
+
+
+def report_output(**chunk):
+    """Publish a chunk of streamed output for the job running in this worker process."""
+    if _events is not None and _current_job is not None:
+        _events.put((_current_job, OUTPUT, chunk))
+
+
+def _run_job(job_id, fn, args, kwargs, stream=False):
+    global _current_job
+    from effects.geometry.extractors.model_registry import registry
+
+    _current_job = job_id
+    if stream:
+        kwargs = dict(kwargs, on_output=report_output)
+    reset_peak_rss()
+    try:
+        _events.put((job_id, RUNNING, {}))
+        return fn(*args, on_progress=report_progress, **kwargs)
+    finally:
+        _current_job = None
+        if stream:
+            # Tells readers no more output is coming
+            _events.put((job_id, OUTPUT, None))
+        _events.put((job_id, METRICS, {'peak_memory_bytes': peak_rss_bytes(), 'metrics': metrics.drain()}))
+        _events.put((None, MODELS, {'pid': os.getpid(), 'stats': registry.stats()}))
+
+
+def warm_worker(names=None, on_progress=None):
+    from effects.geometry.extractors.model_registry import registry
+    registry.warm(names)
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+class JobQueue:
+    def __init__(self, max_workers=None, max_pending=None, keep_finished=200):
+        cpus = os.cpu_count() or 1
+        self.max_workers = max_workers or _env_int('PILE_EXTRACTION_WORKERS', max(1, cpus // 2))
+        self.max_pending = max_pending or _env_int('PILE_MAX_PENDING_JOBS', 32)
+        self.torch_threads = max(1, cpus // self.max_workers)
+        self.keep_finished = keep_finished
+
+        self._jobs = {}
+        self._futures = {}
+        self._by_key = {}
+        self._outputs = {}
+        self.worker_models = {}
+        # Re-entrant: cancelling a future runs its done callback synchronously
+        self._lock = threading.RLock()
+        # Notified when a job gets output or finishes
+        self._changed = threading.Condition(self._lock)
+        self._executor = None
+        self._events = None
+
+    def start(self):
+        with self._lock:
+            self._ensure_started()
+
+    def warm(self, names=None):
+        """Queue one model warm-up per worker so the first real job skips the load."""
+        for _ in range(self.max_workers):
+            self.submit(warm_worker, names, description='warm models')
+
+    def _ensure_started(self):
+        # Started lazily so the dev-server reloader parent never spawns workers
+        if self._executor is not None:
+            return
+        ctx = multiprocessing.get_context('spawn')
+        self._events = ctx.Queue()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(self._events, self.torch_threads),
+        )
+        threading.Thread(target=self._listen, name='job-events', daemon=True).start()
+
+    def submit(self, fn, *args, key=None, description=None, stream=False, **kwargs):
+        """
+        Queue ``fn(*args, **kwargs)`` in a worker and return the new job.
+
+        Submitting with the ``key`` of a job that has not started yet supersedes
+        that job, so repeated saves of one scene only extract once. With
+        ``stream``, ``fn`` also gets ``on_output`` and its output can be read
+        with ``iter_output`` as it is produced.
+        """
+        with self._lock:
+            self._ensure_started()
+
+            if key is not None and key in self._by_key:
+                previous = self._by_key[key]
+                if self._jobs[previous]['status'] == QUEUED:
+                    self._futures[previous].cancel()
+
+            pending = sum(1 for job in self._jobs.values() if job['status'] in (QUEUED, RUNNING))
+            if pending >= self.max_pending:
+                raise QueueFull(f"{pending} geometry jobs already pending")
+
+            job_id = uuid.uuid4().hex
+            job = {
+                'id': job_id,
+                'function': fn.__name__,
+                'description': description,
+                'status': QUEUED,
+                'progress': {},
+                'result': None,
+                'error': None,
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'peak_memory_bytes': None,
+                'stream': stream,
+            }
+            self._jobs[job_id] = job
+            if key is not None:
+                self._by_key[key] = job_id
+            if stream:
+                self._outputs[job_id] = {'chunks': [], 'ended': False}
+
+            try:
+                future = self._executor.submit(_run_job, job_id, fn, args, kwargs, stream)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); start a fresh pool
+                self._executor = None
+                self._ensure_started()
+                future = self._executor.submit(_run_job, job_id, fn, args, kwargs, stream)
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f, job_id=job_id: self._on_done(job_id, f))
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job, progress=dict(job['progress'])) if job else None
+
+    def list(self):
+        with self._lock:
+            jobs = sorted(self._jobs.values(), key=lambda job: job['created_at'], reverse=True)
+            return [dict(job, progress=dict(job['progress'])) for job in jobs]
+
+    def iter_output(self, job_id):
+        """
+        Yield a streamed job's output chunks, waiting for new ones until the
+        job is done. Starts from the first chunk however late it is called.
+        """
+        sent = 0
+        while True:
+            with self._changed:
+                job = self._jobs.get(job_id)
+                output = self._outputs.get(job_id)
+                if job is None or output is None:
+                    return
+                chunks = output['chunks'][sent:]
+                # A finished job's last chunks may still be on their way from the worker
+                done = job['status'] in DONE_STATES and (output['ended'] or job['status'] != FINISHED)
+                if not chunks and not done:
+                    self._changed.wait(timeout=1.0)
+                    continue
+            for chunk in chunks:
+                yield chunk
+            sent += len(chunks)
+            if done and not chunks:
+                return
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _listen(self):
+        while True:
+            job_id, status, info = self._events.get()
+            with self._lock:
+                if status == MODELS:
+                    self.worker_models[info['pid']] = info['stats']
+                    continue
+                if status == METRICS:
+                    metrics.merge(info['metrics'])
+                    job = self._jobs.get(job_id)
+                    if job is not None and info['peak_memory_bytes'] is not None:
+                        job['peak_memory_bytes'] = info['peak_memory_bytes']
+                        metrics.observe('pile_job_peak_memory_bytes', info['peak_memory_bytes'],
+                                        function=job['function'])
+                    continue
+                if status == OUTPUT:
+                    output = self._outputs.get(job_id)
+                    if output is not None:
+                        if info is None:
+                            output['ended'] = True
+                        else:
+                            output['chunks'].append(info)
+                        self._changed.notify_all()
+                    continue
+                job = self._jobs.get(job_id)
+                # Late progress events must not resurrect a finished job
+                if job is None or job['status'] in DONE_STATES:
+                    continue
+                if job['status'] == QUEUED:
+                    job['started_at'] = time.time()
+                job['status'] = status
+                job['progress'].update(info)
+
+    def _on_done(self, job_id, future):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] in DONE_STATES:
+                return
+            if future.cancelled():
+                self._finish_locked(job_id, SUPERSEDED)
+                return
+            error = future.exception()
+            if error is None:
+                self._finish_locked(job_id, FINISHED, result=future.result())
+            else:
+                message = ''.join(traceback.format_exception_only(type(error), error)).strip()
+                print(f"Job {job_id} failed: {message}")
+                self._finish_locked(job_id, FAILED, error=message)
+
+    def _finish_locked(self, job_id, status, result=None, error=None):
+        job = self._jobs[job_id]
+        job['status'] = status
+        job['result'] = result
+        job['error'] = error
+        job['finished_at'] = time.time()
+        metrics.inc('pile_jobs_finished_total', function=job['function'], status=status)
+        if job['started_at'] is not None:
+            metrics.observe('pile_job_duration_seconds', job['finished_at'] - job['started_at'],
+                            function=job['function'])
+        self._futures.pop(job_id, None)
+        self._prune_locked()
+        self._changed.notify_all()
+
+    def _prune_locked(self):
+        expired = time.time() - OUTPUT_TTL
+        for job_id in list(self._outputs):
+            job = self._jobs.get(job_id)
+            if job is None or (job['finished_at'] is not None and job['finished_at'] < expired):
+                del self._outputs[job_id]
+
+        done = [job for job in self._jobs.values() if job['status'] in DONE_STATES]
+        if len(done) <= self.keep_finished:
+            return
+        done.sort(key=lambda job: job['finished_at'])
+        for job in done[:len(done) - self.keep_finished]:
+            del self._jobs[job['id']]
+            self._outputs.pop(job['id'], None)
+            for key, job_id in list(self._by_key.items()):
+                if job_id == job['id']:
+                    del self._by_key[key]
@@ -0,0 +1,221 @@
+"""
+Prebuild scene geometry offline.
+
+Walks the scene configs (all of them, or one novel's scenes), finds the
+geometry that is missing or stale and regenerates it across the job queue's
+worker processes, so a deploy can build everything before serving traffic::
+
+    python precompute_geometry.py                  # every scene
+    python precompute_geometry.py --novel test     # one novel's scenes
+    python precompute_geometry.py --dry-run        # only list what is stale
+
+Geometry is stale when its files are missing or were built from a different
+image, geometry type, options or extractor version: the manifest
+``assets/geometry/precompute-manifest.json`` records the geometry cache key
+each output was built from, and is updated as soon as each output finishes.
+An interrupted run therefore resumes where it stopped. Outputs are written
+atomically and precompressed for serving, and unchanged geometry already in
+the geometry cache is copied rather than re-extracted.
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+from effects.geometry.extractors.pipeline import (
+    GEOMETRY_TYPES,
+    binary_path,
+    geometry_cache_key,
+    write_json_atomic,
+)
+from jobs import DONE_STATES, FINISHED, JobQueue
+from static_assets import generate_compressed_geometry
+
+BASE_DIR = Path(__file__).parent
+IMAGES_DIR = BASE_DIR / 'assets' / 'images'
+GEOMETRY_DIR = BASE_DIR / 'assets' / 'geometry'
+SCENE_CONFIGS_DIR = BASE_DIR / 'scenes' / 'configs'
+# Novels are served from the top of novels/, see app.py
+NOVELS_DIR = BASE_DIR / 'novels'
+
+MANIFEST_PATH = GEOMETRY_DIR / 'precompute-manifest.json'
+
+POLL_INTERVAL = 0.5
+
+
+def scene_ids(novel_id=None):
+    """Scene ids of one novel, or of every scene config."""
+    if novel_id is None:
+        return sorted(path.stem for path in SCENE_CONFIGS_DIR.glob('*.json'))
+    with open(NOVELS_DIR / f"{novel_id}.json") as f:
+        return list(json.load(f).get('scenes', []))
+
+
+def geometry_tasks(ids):
+    """
+    One task per geometry output used by the scenes ``ids``, with its cache
+    key. Returns ``(tasks, problems)``; scenes that cannot be built are
+    reported in ``problems`` instead.
+    """
+    tasks = {}
+    problems = []
+    for scene_id in ids:
+        try:
+            with open(SCENE_CONFIGS_DIR / f"{scene_id}.json") as f:
+                scene = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            problems.append(f"{scene_id}: cannot read scene config ({e})")
+            continue
+        image = scene.get('image') or {}
+        geometry = image.get('geometry')
+        if not geometry:
+            continue
+        if geometry.get('type') not in GEOMETRY_TYPES:
+            problems.append(f"{scene_id}: unknown geometry type {geometry.get('type')!r}")
+            continue
+        image_path = IMAGES_DIR / image.get('path', '')
+        if not image_path.is_file():
+            problems.append(f"{scene_id}: image {image_path.name} not found")
+            continue
+
+        output_path = GEOMETRY_DIR / geometry['type'] / geometry['data']
+        options = geometry.get('options')
+        key = geometry_cache_key(image_path, geometry['type'], options)
+        other = tasks.get(str(output_path))
+        if other is not None:
+            if other['key'] != key:
+                problems.append(f"{scene_id}: {output_path.name} is also built by scene "
+                                f"{other['scenes'][0]} with a different image or options")
+            else:
+                other['scenes'].append(scene_id)
+            continue
+        tasks[str(output_path)] = {
+            'scenes': [scene_id],
+            'image_path': str(image_path),
+            'geometry_type': geometry['type'],
+            'output_path': str(output_path),
+            'options': options,
+            'key': key,
+        }
+    return list(tasks.values()), problems
+
+
+def load_manifest(path=None):
+    try:
+        with open(path or MANIFEST_PATH) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def is_current(task, manifest):
+    """Whether the task's output exists and was built from the same inputs."""
+    output_path = Path(task['output_path'])
+    return (manifest.get(task['output_path']) == task['key']
+            and output_path.exists() and binary_path(output_path).exists())
+
+
+def _describe(task):
+    return f"{', '.join(task['scenes'])} ({task['geometry_type']})"
+
+
+def _progress_text(progress):
+    if 'levels_total' in progress:
+        return f"{progress.get('levels_done', 0)}/{progress['levels_total']} levels"
+    return 'running'
+
+
+def run(tasks, workers=None, manifest_path=None):
+    """Build ``tasks`` on a worker pool; returns the tasks that failed."""
+    manifest_path = manifest_path or MANIFEST_PATH
+    manifest = load_manifest(manifest_path)
+    queue = JobQueue(max_workers=workers, max_pending=len(tasks) + 1)
+    started = time.perf_counter()
+    jobs = {}
+    for task in tasks:
+        job = queue.submit(
+            generate_compressed_geometry,
+            task['image_path'],
+            task['geometry_type'],
+            task['output_path'],
+            options=task['options'],
+            description=_describe(task),
+        )
+        jobs[job['id']] = task
+    print(f"Building {len(tasks)} geometry files on {queue.max_workers} workers")
+
+    failed = []
+    done = 0
+    shown = {}
+    try:
+        while jobs:
+            time.sleep(POLL_INTERVAL)
+            for job_id, task in list(jobs.items()):
+                job = queue.get(job_id)
+                if job['status'] not in DONE_STATES:
+                    text = _progress_text(job['progress']) if job['progress'] else None
+                    if text and shown.get(job_id) != text:
+                        shown[job_id] = text
+                        print(f"  {_describe(task)}: {text}")
+                    continue
+
+                del jobs[job_id]
+                done += 1
+                elapsed = job['finished_at'] - (job['started_at'] or job['created_at'])
+                if job['status'] == FINISHED:
+                    # Recorded right away, so an interrupted run resumes after it
+                    manifest[task['output_path']] = task['key']
+                    write_json_atomic(manifest, manifest_path)
+                    how = 'copied from cache' if job['result'].get('cached') else f"built in {elapsed:.1f}s"
+                    print(f"[{done}/{len(tasks)}] {_describe(task)}: {how}")
+                else:
+                    failed.append(task)
+                    print(f"[{done}/{len(tasks)}] {_describe(task)}: {job['status']} "
+                          f"{job['error'] or ''}".rstrip())
+    except KeyboardInterrupt:
+        print(f"Interrupted with {len(jobs)} unfinished; rerun to resume")
+        queue.shutdown(wait=False)
+        raise
+    queue.shutdown()
+    print(f"Done in {time.perf_counter() - started:.1f}s, {len(failed)} failed")
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Prebuild missing or stale scene geometry')
+    parser.add_argument('--novel', default=None, help='Only the scenes of this novel')
+    parser.add_argument('--scenes', nargs='+', default=None, help='Only these scene ids')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes (default: PILE_EXTRACTION_WORKERS or half the CPUs)')
+    parser.add_argument('--force', action='store_true', help='Rebuild outputs even when current')
+    parser.add_argument('--dry-run', action='store_true', help='List stale geometry without building it')
+    args = parser.parse_args(argv)
+
+    try:
+        ids = args.scenes or scene_ids(args.novel)
+    except FileNotFoundError:
+        parser.error(f"unknown novel {args.novel}")
+    tasks, problems = geometry_tasks(ids)
+    for problem in problems:
+        print(f"Skipping {problem}")
+
+    manifest = load_manifest()
+    stale = [task for task in tasks if args.force or not is_current(task, manifest)]
+    print(f"{len(tasks)} geometry outputs in {len(ids)} scenes, {len(stale)} missing or stale")
+    if args.dry_run:
+        for task in stale:
+            print(f"  {_describe(task)} -> {Path(task['output_path']).relative_to(BASE_DIR)}")
+        return 0
+    if not stale:
+        return 0 if not problems else 1
+
+    try:
+        failed = run(stale, args.workers)
+    except KeyboardInterrupt:
+        return 130
+    return 1 if failed or problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Sampling profiler for single requests.
+
+With ``PILE_PROFILING=1``, adding ``?profile=1`` to any request samples the
+stack of the thread handling it every ``PILE_PROFILE_INTERVAL`` seconds
+(default 0.005) until the response is ready. The samples are written in the
+collapsed-stack format flamegraph.pl and speedscope read (one
+``outer;inner;innermost count`` line per stack) to ``PILE_PROFILE_DIR``
+(default ``.profiles``); the file name comes back in the ``X-Pile-Profile``
+header and the file is served at ``/api/profiles/<name>``.
+
+Sampling only looks at the request's thread, so work in the job workers is
+not included; their stages show up in ``/api/metrics`` instead.
+"""
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from flask import g, request
+
+BASE_DIR = Path(__file__).parent
+PROFILE_DIR = Path(os.environ.get('PILE_PROFILE_DIR', BASE_DIR / '.profiles'))
+DEFAULT_INTERVAL = 0.005
+
+
+def enabled():
+    return os.environ.get('PILE_PROFILING', '') not in ('', '0')
+
+
+def _frame_name(code):
+    path = Path(code.co_filename)
+    try:
+        path = path.relative_to(BASE_DIR)
+    except ValueError:
+        path = Path(path.name)
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Counts the stacks of one thread, sampled from a background thread."""
+
+    def __init__(self, thread_id=None, interval=None):
+        self.thread_id = thread_id or threading.get_ident()
+        value = os.environ.get('PILE_PROFILE_INTERVAL')
+        self.interval = interval or (float(value) if value else DEFAULT_INTERVAL)
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+        return self.samples
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        """The samples in collapsed-stack format, most frequent first."""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def install(app):
+    """Profile requests carrying ``?profile=1`` when PILE_PROFILING is set."""
+
+    @app.before_request
+    def start_profile():
+        if enabled() and request.args.get('profile') == '1':
+            g.profiler = SamplingProfiler().start()
+
+    @app.after_request
+    def save_profile(response):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+        profiler.stop()
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'unknown'}-{uuid.uuid4().hex[:8]}.folded"
+        (PROFILE_DIR / name).write_text(profiler.folded())
+        print(f"Profiled {request.method} {request.path}: {sum(profiler.samples.values())} samples "
+              f"in {profiler.elapsed:.3f}s -> {PROFILE_DIR / name}")
+        response.headers['X-Pile-Profile'] = name
+        return response
@@ -12,6 +12,13 @@ export const SCENE_SCHEMA = {
     image: {
         path: String,
         padding: Number,
+        // How the resized copies are used: 'tier' (default) loads the smallest
+        // copy sharp at the closest zoom, 'tiles' loads deep-zoom tiles for the
+        // view, 'none' always loads the original
+        derivatives: {
+            type: String,
+            enum: ['tier', 'tiles', 'none']
+        },
         animation: {
             type: {
                 type: String,
@@ -25,6 +32,8 @@ export const SCENE_SCHEMA = {
                 enum: Object.keys(GEOMETRY_TYPE_SCHEMAS)
             },
             data: String,
+            // Extraction overrides, e.g. { threshold, min_length } or { num_points }
+            options: Object,
             animation: {
                 type: {
                     type: String,
@@ -0,0 +1,115 @@
+"""
+Production server: the app under gunicorn.
+
+    python serve.py [--workers 1] [--threads 8] [--bind 0.0.0.0:8000] [--app app:app]
+    python serve.py --dev [--bind 127.0.0.1:5000]
+
+``python app.py`` is the development server (one process, with the debug
+reloader). Here each of ``--workers`` processes serves requests on
+``--threads`` threads. Static files are precompressed once before the
+workers start, and with ``PILE_WARM_MODELS`` each worker warms its
+extraction processes. Unless ``PILE_EXTRACTION_WORKERS`` is set, the cores
+given to extraction (half of them, as for the dev server) are split between
+the web workers.
+
+The default is one worker: each worker has its own job queue and extraction
+pool (see jobs.py), so a job's status and stream are only known to the
+worker that accepted it, and every worker holds its own detectors. Several
+workers only suit read-only deployments (no scene editing), where config,
+asset and geometry requests then use more cores.
+
+``--dev`` runs Werkzeug's threaded server without the debugger or reloader,
+for comparing against the production setup (see benchmarks/loadtest.py).
+gunicorn needs ``pip install 'pile[serve]'``.
+"""
+import argparse
+import importlib
+import os
+import sys
+
+DEFAULT_BIND = '127.0.0.1:8000'
+
+
+def load_app(spec):
+    """The WSGI app ``module:attribute`` (``module:factory()`` calls it)."""
+    module_name, _, attribute = spec.partition(':')
+    attribute = attribute or 'app'
+    target = getattr(importlib.import_module(module_name), attribute.removesuffix('()'))
+    return target() if attribute.endswith('()') else target
+
+
+def precompress():
+    from static_assets import STATIC_DIRS, BASE_DIR, assets
+    built = assets.precompress_tree([BASE_DIR / directory for directory in STATIC_DIRS])
+    if built:
+        print(f"Precompressed {built} static file copies")
+
+
+def post_worker_init(worker):
+    import app
+    app.warm_models()
+
+
+def run_gunicorn(args):
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        sys.exit("The production server needs gunicorn: pip install 'pile[serve]'")
+
+    class PileApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': args.bind,
+                'workers': args.workers,
+                'threads': args.threads,
+                # Streamed geometry previews stay open while levels are extracted
+                'timeout': args.timeout,
+                'graceful_timeout': 30,
+                'keepalive': 5,
+                'accesslog': '-' if args.access_log else None,
+                'post_worker_init': post_worker_init,
+                'proc_name': 'pile',
+            }
+            for name, value in options.items():
+                self.cfg.set(name, value)
+
+        def load(self):
+            return load_app(args.app)
+
+    if args.workers > 1:
+        print(f"Serving with {args.workers} workers: save jobs are only visible to the worker that "
+              f"accepted them, so editors polling /api/jobs will see 404s")
+    cpus = os.cpu_count() or 1
+    os.environ.setdefault('PILE_EXTRACTION_WORKERS', str(max(1, cpus // 2 // args.workers)))
+    precompress()
+    PileApplication().run()
+
+
+def run_dev(args):
+    from werkzeug.serving import run_simple
+    host, _, port = args.bind.rpartition(':')
+    precompress()
+    run_simple(host or '127.0.0.1', int(port), load_app(args.app), threaded=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the app with a production WSGI server')
+    parser.add_argument('--bind', default=DEFAULT_BIND, help='host:port to listen on')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Web worker processes; jobs are per worker, so more than one breaks editing')
+    parser.add_argument('--threads', type=int, default=8, help='Request threads per worker')
+    parser.add_argument('--timeout', type=int, default=300,
+                        help='Seconds a request may run before its worker is restarted')
+    parser.add_argument('--app', default='app:app', help='WSGI app as module:attribute')
+    parser.add_argument('--access-log', action='store_true', help='Log every request to stdout')
+    parser.add_argument('--dev', action='store_true', help="Use Werkzeug's threaded server instead")
+    args = parser.parse_args(argv)
+
+    if args.dev:
+        run_dev(args)
+    else:
+        run_gunicorn(args)
+
+
+if __name__ == '__main__':
+    main()
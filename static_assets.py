@@ -0,0 +1,311 @@
+"""
+Precompressed, cache-friendly static file serving.
+
+``send_static`` replaces ``send_from_directory`` for the app's static routes:
+
+- Compressible files (JS, JSON, HTML, CSS, SVG, packed geometry) are sent
+  brotli- or gzip-encoded, whichever the client's Accept-Encoding prefers,
+  from precompressed copies. A file whose copies are not built yet is sent
+  as is while they are built in the background.
+- Every file gets a content-hash ETag, and ``asset_url`` gives URLs carrying
+  that hash (``?v=<hash>``). Responses to those are ``immutable`` for a year;
+  plain URLs are ``no-cache`` and revalidate with a 304.
+- Range requests are honoured, so large downloads can resume.
+
+Compressed copies are kept in a content-addressed directory
+(``PILE_STATIC_CACHE_DIR``, default ``.static-cache``), so an edited file
+never gets a stale copy; least recently built copies are pruned beyond
+``PILE_STATIC_CACHE_MAX_BYTES`` (default 512 MB). Brotli needs the optional
+``brotli`` package; without it only gzip copies are made.
+
+Build copies ahead of time (e.g. during a deploy) with::
+
+    python static_assets.py precompress
+"""
+import argparse
+import gzip
+import hashlib
+import mimetypes
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from flask import abort, request, send_file
+from werkzeug.utils import safe_join
+
+from effects.geometry.extractors.pipeline import binary_path, generate_geometry_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BASE_DIR = Path(__file__).parent
+DEFAULT_CACHE_DIR = BASE_DIR / '.static-cache'
+DEFAULT_MAX_BYTES = 512 << 20
+
+# Directories whose files are precompressed at startup
+STATIC_DIRS = ['core', 'effects', 'tools', 'schemas', 'assets/geometry']
+
+COMPRESSIBLE = {'.js', '.mjs', '.json', '.html', '.css', '.svg', '.txt', '.bin'}
+MIN_SIZE = 1024
+# A copy must save at least this share of the file to be used
+MIN_SAVING = 0.1
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+# Quality 11 is slow on large files; the size difference is small there
+LARGE_FILE = 4 << 20
+BROTLI_LARGE_QUALITY = 9
+# On-the-fly compression of generated responses
+DYNAMIC_GZIP_LEVEL = 5
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+EXTENSIONS = {'br': 'br', 'gzip': 'gz'}
+
+
+def compressible(path):
+    return Path(path).suffix.lower() in COMPRESSIBLE
+
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        quality = BROTLI_QUALITY if len(data) < LARGE_FILE else BROTLI_LARGE_QUALITY
+        return brotli.compress(data, quality=quality)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class StaticAssets:
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = Path(cache_dir or os.environ.get('PILE_STATIC_CACHE_DIR', DEFAULT_CACHE_DIR))
+        if max_bytes is None:
+            value = os.environ.get('PILE_STATIC_CACHE_MAX_BYTES')
+            max_bytes = int(value) if value else DEFAULT_MAX_BYTES
+        self.max_bytes = max_bytes
+
+        self._digests = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def encodings(self):
+        """Encodings copies are made in, most preferred first."""
+        return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    def digest(self, path):
+        """Content hash of a file, memoized on path, size and mtime."""
+        path = str(path)
+        stat = os.stat(path)
+        with self._lock:
+            memo = self._digests.get(path)
+        if memo is not None and memo[:2] == (stat.st_mtime_ns, stat.st_size):
+            return memo[2]
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()[:16]
+        with self._lock:
+            self._digests[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def variant_path(self, digest, encoding):
+        return self.cache_dir / digest[:2] / f"{digest}.{EXTENSIONS[encoding]}"
+
+    def compress(self, path, digest=None):
+        """Build the missing compressed copies of ``path``; returns how many were built."""
+        if not compressible(path) or os.path.getsize(path) < MIN_SIZE:
+            return 0
+        digest = digest or self.digest(path)
+        data = None
+        built = 0
+        for encoding in self.encodings:
+            target = self.variant_path(digest, encoding)
+            if target.exists():
+                continue
+            if data is None:
+                data = Path(path).read_bytes()
+            compressed = _compress(data, encoding)
+            if len(compressed) > (1 - MIN_SAVING) * len(data):
+                # An empty copy records that this encoding is not worth it
+                compressed = b''
+            target.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.", suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(compressed)
+                os.replace(tmp_path, target)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            built += 1
+        return built
+
+    def compress_later(self, path, digest):
+        """Build ``path``'s copies on a background thread (once per content)."""
+        with self._lock:
+            if digest in self._pending:
+                return
+            self._pending.add(digest)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='precompress')
+        self._executor.submit(self._compress_job, str(path), digest)
+
+    def _compress_job(self, path, digest):
+        try:
+            if self.compress(path, digest):
+                self.prune()
+        except OSError as e:
+            print(f"Could not precompress {path}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(digest)
+
+    def precompress_tree(self, directories):
+        """Build copies for every compressible file under ``directories``."""
+        built = 0
+        for directory in directories:
+            for path in Path(directory).rglob('*'):
+                if path.is_file() and compressible(path) and not path.name.startswith('.'):
+                    built += self.compress(path)
+        self.prune()
+        return built
+
+    def prune(self, max_bytes=None):
+        """Remove the oldest copies until the cache fits in ``max_bytes``."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if not self.cache_dir.exists():
+            return 0
+        copies = []
+        for path in self.cache_dir.glob('*/*'):
+            if path.name.startswith('.'):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            copies.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in copies)
+        removed = 0
+        for _, size, path in sorted(copies):
+            if total <= max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def choose(self, path, digest):
+        """``(encoding, file)`` to send for the request's Accept-Encoding; encoding None is identity."""
+        if not compressible(path) or os.path.getsize(path) < MIN_SIZE:
+            return None, path
+        available = {}
+        missing = False
+        for encoding in self.encodings:
+            variant = self.variant_path(digest, encoding)
+            try:
+                if variant.stat().st_size:
+                    available[encoding] = variant
+            except FileNotFoundError:
+                missing = True
+        if missing:
+            self.compress_later(path, digest)
+        if available:
+            best = request.accept_encodings.best_match(list(available) + ['identity'])
+            if best in available:
+                return best, available[best]
+        return None, path
+
+    def send(self, path, mimetype=None, immutable=False):
+        """
+        Response for a static file: negotiated encoding, hash ETag, Range
+        support. ``immutable`` marks files whose URL already names their content.
+        """
+        digest = self.digest(path)
+        encoding, source = self.choose(path, digest)
+        mimetype = mimetype or mimetypes.guess_type(str(path))[0] or 'application/octet-stream'
+        response = send_file(
+            source,
+            mimetype=mimetype,
+            conditional=True,
+            etag=digest if encoding is None else f"{digest}-{encoding}",
+            last_modified=os.path.getmtime(path),
+        )
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        if compressible(path):
+            response.vary.add('Accept-Encoding')
+        if immutable or request.args.get('v') == digest:
+            # The URL names this exact content, so it can never change
+            response.headers['Cache-Control'] = IMMUTABLE
+        return response
+
+    def encode_response(self, response):
+        """gzip a generated (not file-backed) response when the client accepts it."""
+        if (response.direct_passthrough or response.status_code != 200
+                or 'Content-Encoding' in response.headers):
+            return response
+        data = response.get_data()
+        response.vary.add('Accept-Encoding')
+        if len(data) < MIN_SIZE or request.accept_encodings.best_match(['gzip', 'identity']) != 'gzip':
+            return response
+        response.set_data(gzip.compress(data, compresslevel=DYNAMIC_GZIP_LEVEL, mtime=0))
+        response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+
+# Shared by the app's routes
+assets = StaticAssets()
+
+
+def send_static(directory, filename, mimetype=None, immutable=False):
+    """``send_from_directory`` with precompression, hash ETags and immutable hashed URLs."""
+    path = safe_join(str(directory), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return assets.send(path, mimetype, immutable=immutable)
+
+
+def asset_url(relative_path):
+    """Content-hashed URL of a file under the app directory, cacheable forever."""
+    relative_path = str(relative_path).lstrip('/')
+    path = BASE_DIR / relative_path
+    try:
+        return f"/{relative_path}?v={assets.digest(path)}"
+    except FileNotFoundError:
+        return f"/{relative_path}"
+
+
+def generate_compressed_geometry(image_path, geometry_type, output_path, options=None, on_progress=None,
+                                 on_output=None):
+    """``generate_geometry_file``, then precompress its JSON and binary (a job function)."""
+    summary = generate_geometry_file(image_path, geometry_type, output_path, options=options,
+                                     on_progress=on_progress, on_output=on_output)
+    for path in (Path(output_path), binary_path(output_path)):
+        if path.exists():
+            assets.compress(path)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage precompressed static assets')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('precompress', help='Build compressed copies of every static file')
+    prune = commands.add_parser('prune', help='Remove the oldest compressed copies')
+    prune.add_argument('--max-bytes', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == 'precompress':
+        built = assets.precompress_tree([BASE_DIR / directory for directory in STATIC_DIRS])
+        print(f"Built {built} compressed copies in {assets.cache_dir} "
+              f"({', '.join(assets.encodings)})")
+    elif args.command == 'prune':
+        print(f"Removed {assets.prune(args.max_bytes)} compressed copies")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Fixtures for testing the app against geometry extracted offline: the
+benchmark suite's ``StubDetector`` stands in for the lineart network, and
+every directory the app and pipeline write to is a temporary one.
+"""
+import cv2
+import pytest
+
+import app as app_module
+import static_assets
+from benchmarks.suite import StubDetector
+from config_index import ConfigIndex
+from effects.geometry.extractors.batched_inference import lineart_batch
+from effects.geometry.extractors.pipeline import generate_geometry_file
+
+IMAGE_SIZE = (640, 480)
+# Two levels keep the extraction fast
+LINEART_OPTIONS = {'resolutions': [256, 512]}
+
+
+@pytest.fixture
+def pile(tmp_path, monkeypatch):
+    """The app module, serving from ``tmp_path``, with one stub-drawn image ``photo.png``."""
+    stub = StubDetector()
+    monkeypatch.setattr(lineart_batch(), 'backend', stub)
+    monkeypatch.setenv('PILE_EDGE_STORE_DIR', str(tmp_path / 'edges'))
+    monkeypatch.setenv('PILE_GEOMETRY_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setenv('PILE_STATIC_CACHE_DIR', str(tmp_path / 'static-cache'))
+    monkeypatch.setattr(static_assets.assets, 'cache_dir', tmp_path / 'static-cache')
+
+    for name in ('images', 'geometry', 'scenes'):
+        (tmp_path / name).mkdir()
+    monkeypatch.setattr(app_module, 'IMAGES_DIR', tmp_path / 'images')
+    monkeypatch.setattr(app_module, 'GEOMETRY_DIR', tmp_path / 'geometry')
+    monkeypatch.setattr(app_module, 'SCENE_CONFIGS_DIR', tmp_path / 'scenes')
+    monkeypatch.setattr(app_module, 'scene_index', ConfigIndex(tmp_path / 'scenes'))
+
+    cv2.imwrite(str(tmp_path / 'images' / 'photo.png'), stub.photo(*IMAGE_SIZE, 1000))
+    return app_module
+
+
+@pytest.fixture
+def client(pile):
+    return pile.app.test_client()
+
+
+def generate(pile, name, options=LINEART_OPTIONS):
+    """Extract lineart of ``photo.png`` to ``name`` in the app's geometry directory."""
+    output_path = pile.GEOMETRY_DIR / 'lineart' / name
+    generate_geometry_file(pile.IMAGES_DIR / 'photo.png', 'lineart', output_path, options=options)
+    return output_path
@@ -0,0 +1,55 @@
+import json
+import os
+
+
+def write_scene(pile, scene_id, title, mtime_ns=None):
+    path = pile.SCENE_CONFIGS_DIR / f"{scene_id}.json"
+    path.write_text(json.dumps({'id': scene_id, 'title': title, 'image': {'path': 'photo.png'}}))
+    if mtime_ns is not None:
+        # Later than the previous write even where mtimes are coarse
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return path
+
+
+def test_scene_is_revalidated_by_etag(pile, client):
+    path = write_scene(pile, 'harbour', 'Harbour')
+
+    response = client.get('/api/scenes/harbour')
+    assert response.status_code == 200
+    assert response.json['title'] == 'Harbour'
+    etag = response.headers['ETag']
+
+    replay = client.get('/api/scenes/harbour', headers={'If-None-Match': etag})
+    assert replay.status_code == 304
+    assert replay.headers['ETag'] == etag
+
+    write_scene(pile, 'harbour', 'Harbour at night', path.stat().st_mtime_ns + 10 ** 9)
+    edited = client.get('/api/scenes/harbour', headers={'If-None-Match': etag})
+    assert edited.status_code == 200
+    assert edited.json['title'] == 'Harbour at night'
+    assert edited.headers['ETag'] != etag
+
+
+def test_touching_a_scene_keeps_its_etag(pile, client):
+    path = write_scene(pile, 'harbour', 'Harbour')
+    etag = client.get('/api/scenes/harbour').headers['ETag']
+
+    mtime_ns = path.stat().st_mtime_ns + 10 ** 9
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    assert client.get('/api/scenes/harbour', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_listing_picks_up_new_scenes(pile, client):
+    pile.scene_index.check_interval = 0
+    write_scene(pile, 'harbour', 'Harbour')
+
+    listing = client.get('/api/scenes')
+    etag = listing.headers['ETag']
+    assert client.get('/api/scenes', headers={'If-None-Match': etag}).status_code == 304
+
+    write_scene(pile, 'orchard', 'Orchard')
+    updated = client.get('/api/scenes', headers={'If-None-Match': etag})
+    assert updated.status_code == 200
+    assert [scene['id'] for scene in updated.json] == ['harbour', 'orchard']
+    assert updated.headers['ETag'] != etag
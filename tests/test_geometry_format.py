@@ -0,0 +1,151 @@
+import json
+
+import numpy as np
+import pytest
+
+from effects.geometry.extractors import spatial_index
+from effects.geometry.extractors.geometry_format import (
+    KIND_POINTS, KIND_POLYLINES, KIND_SEGMENTS, MIME_TYPE, QUANT_MAX, decode_geometry, detail_count,
+    encode_geometry, read_header, truncate_geometry)
+from effects.geometry.extractors.pipeline import binary_path, lod_path, select_geometry_binary
+
+from conftest import generate
+
+WIDTH, HEIGHT = 640, 480
+# Quantizing to uint16 moves a coordinate by at most half a step
+TOLERANCE = max(WIDTH, HEIGHT) / QUANT_MAX
+
+
+def random_polylines(path_lengths, level_sizes, seed=0):
+    """Packed polylines of the given vertex counts, in grid order with their grid index."""
+    rng = np.random.default_rng(seed)
+    path_offsets = np.cumsum([0] + path_lengths)
+    level_offsets = np.cumsum([0] + level_sizes)
+    coords = rng.uniform(0, [WIDTH, HEIGHT], size=(path_offsets[-1], 2))
+    coords, path_offsets, level_offsets = spatial_index.sort_paths(
+        coords, path_offsets, level_offsets, WIDTH, HEIGHT)
+    grid = spatial_index.grid_index(coords, path_offsets, level_offsets, WIDTH, HEIGHT)
+    return coords, path_offsets, level_offsets, grid
+
+
+@pytest.mark.parametrize('quantize', [True, False])
+@pytest.mark.parametrize('kind, components', [(KIND_SEGMENTS, 4), (KIND_POINTS, 2)])
+def test_round_trip(kind, components, quantize):
+    coords = np.random.default_rng(1).uniform(0, [WIDTH, HEIGHT] * (components // 2), size=(50, components))
+    data = encode_geometry(kind, coords, [0, 20, 50], width=WIDTH, height=HEIGHT, quantize=quantize)
+
+    geometry = decode_geometry(data)
+
+    assert geometry['kind'] == kind
+    assert (geometry['width'], geometry['height']) == (WIDTH, HEIGHT)
+    assert geometry['level_offsets'].tolist() == [0, 20, 50]
+    np.testing.assert_allclose(geometry['coords'], coords, atol=TOLERANCE if quantize else 1e-3)
+
+
+@pytest.mark.parametrize('quantize', [True, False])
+def test_polyline_round_trip_keeps_the_grid(quantize):
+    coords, path_offsets, level_offsets, grid = random_polylines([2, 5, 3, 4, 2, 6], [2, 4])
+    data = encode_geometry(KIND_POLYLINES, coords, level_offsets, width=WIDTH, height=HEIGHT, quantize=quantize,
+                           path_offsets=path_offsets, grid=grid)
+
+    geometry = decode_geometry(data)
+
+    assert geometry['path_offsets'].tolist() == path_offsets.tolist()
+    assert geometry['level_offsets'].tolist() == level_offsets.tolist()
+    np.testing.assert_allclose(geometry['coords'], coords, atol=TOLERANCE if quantize else 1e-3)
+    assert (geometry['grid']['cols'], geometry['grid']['rows']) == (grid['cols'], grid['rows'])
+    assert geometry['grid']['cell_offsets'].tolist() == grid['cell_offsets'].tolist()
+
+
+def test_polylines_without_grid_decode_without_one():
+    coords, path_offsets, level_offsets, _ = random_polylines([3, 3], [2])
+    data = encode_geometry(KIND_POLYLINES, coords, level_offsets, width=WIDTH, height=HEIGHT,
+                           path_offsets=path_offsets)
+
+    assert 'grid' not in decode_geometry(data)
+
+
+def test_truncating_points_at_the_budget():
+    coords = np.random.default_rng(2).uniform(0, 100, size=(10, 2))
+    data = encode_geometry(KIND_POINTS, coords, [0, 10], width=100, height=100)
+
+    assert truncate_geometry(data, 10) is data
+    geometry = decode_geometry(truncate_geometry(data, 9))
+    assert geometry['level_offsets'].tolist() == [0, 9]
+    np.testing.assert_array_equal(geometry['coords'], decode_geometry(data)['coords'][:9])
+
+
+@pytest.mark.parametrize('max_items', [16, 15, 11, 10, 5, 4, 1, 0])
+def test_truncating_polylines_keeps_whole_paths(max_items):
+    # 16 segments in all, in paths of 1 to 5
+    coords, path_offsets, level_offsets, grid = random_polylines([2, 5, 3, 4, 2, 6], [2, 4])
+    data = encode_geometry(KIND_POLYLINES, coords, level_offsets, width=WIDTH, height=HEIGHT,
+                           path_offsets=path_offsets, grid=grid)
+    full = decode_geometry(data)
+    segments = np.diff(full['path_offsets']) - 1
+    # The longest prefix of whole paths within the budget
+    paths = int(np.sum(np.cumsum(segments) <= max_items))
+
+    truncated = truncate_geometry(data, max_items)
+    geometry = decode_geometry(truncated)
+
+    assert detail_count(read_header(truncated)) == int(segments[:paths].sum())
+    assert geometry['path_offsets'].tolist() == full['path_offsets'][:paths + 1].tolist()
+    assert geometry['level_offsets'].tolist() == np.minimum(full['level_offsets'], paths).tolist()
+    np.testing.assert_array_equal(geometry['coords'], full['coords'][:full['path_offsets'][paths]])
+    assert geometry['grid']['cell_offsets'].tolist() == np.minimum(full['grid']['cell_offsets'], paths).tolist()
+
+
+def write_tiers(output_path, *tiers):
+    """Full-detail binary and LOD tiers of ``output_path`` with the given point counts."""
+    rng = np.random.default_rng(3)
+    for path, count in zip([binary_path(output_path)] + [lod_path(output_path, i) for i in range(1, len(tiers))],
+                           tiers):
+        coords = rng.uniform(0, 100, size=(count, 2))
+        path.write_bytes(encode_geometry(KIND_POINTS, coords, [0, count], width=100, height=100))
+
+
+@pytest.mark.parametrize('max_items, served', [
+    (None, 100), (100, 100), (99, 40), (40, 40), (39, 10), (10, 10), (5, 5),
+])
+def test_select_geometry_binary_picks_the_tier_within_budget(tmp_path, max_items, served):
+    output_path = tmp_path / 'points.json'
+    write_tiers(output_path, 100, 40, 10)
+
+    data = select_geometry_binary(output_path, max_items)
+
+    assert detail_count(read_header(data)) == served
+
+
+def test_json_is_served_unless_binary_is_accepted(pile, client):
+    output_path = generate(pile, 'scene.json')
+
+    response = client.get('/api/geometry/lineart/scene.json', headers={'Accept': 'application/json'})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    assert response.json == json.loads(output_path.read_text())
+    assert 'Accept' in response.vary
+
+
+def test_budget_is_applied_to_json(pile, client):
+    output_path = generate(pile, 'scene.json')
+    budget = detail_count(read_header(binary_path(output_path).read_bytes())) // 2
+
+    response = client.get(f'/api/geometry/lineart/scene.json?max_segments={budget}',
+                          headers={'Accept': 'application/json'})
+    binary = client.get(f'/api/geometry/lineart/scene.json?max_segments={budget}', headers={'Accept': MIME_TYPE})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    paths = [path['points'] for level in response.json['levels'] for path in level]
+    assert 0 < sum(len(points) - 1 for points in paths) <= budget
+    assert len(paths) == len(decode_geometry(binary.data)['path_offsets']) - 1
+
+
+def test_negative_budget_is_rejected(pile, client):
+    generate(pile, 'scene.json')
+
+    response = client.get('/api/geometry/lineart/scene.json?max_segments=-1')
+
+    assert response.status_code == 400
@@ -0,0 +1,57 @@
+from effects.geometry.extractors.geometry_format import MIME_TYPE, decode_geometry
+from effects.geometry.extractors.pipeline import binary_path
+
+from conftest import IMAGE_SIZE, LINEART_OPTIONS, generate
+
+
+def test_generated_binary_is_served_as_written(pile, client):
+    output_path = generate(pile, 'scene.json')
+    written = binary_path(output_path).read_bytes()
+
+    response = client.get('/api/geometry/lineart/scene.json', headers={'Accept': MIME_TYPE})
+
+    assert response.status_code == 200
+    geometry = decode_geometry(response.data)
+    assert (geometry['width'], geometry['height']) == IMAGE_SIZE
+    assert 'grid' in geometry
+    assert binary_path(output_path).read_bytes() == written
+
+
+def test_legacy_json_is_converted_with_image_size_and_grid(pile, client):
+    output_path = generate(pile, 'legacy.json')
+    binary_path(output_path).unlink()
+    (pile.SCENE_CONFIGS_DIR / 'legacy.json').write_text(
+        '{"id": "legacy", "image": {"path": "photo.png", "geometry": {"type": "lineart", "data": "legacy.json"}}}')
+
+    response = client.get('/api/geometry/lineart/legacy.json', headers={'Accept': MIME_TYPE})
+
+    assert response.status_code == 200
+    geometry = decode_geometry(response.data)
+    assert (geometry['width'], geometry['height']) == IMAGE_SIZE
+    assert 'grid' in geometry
+
+
+def save_scene(client, options):
+    return client.post('/api/scenes', json={
+        'id': 'atlas',
+        'image': {'path': 'photo.png', 'geometry': {'type': 'lineart', 'data': 'atlas.json', 'options': options}},
+    })
+
+
+def test_cached_save_replaces_the_atlas(pile, client):
+    with_atlas = dict(LINEART_OPTIONS, atlas_scale=0.5)
+    generate(pile, 'atlas.json', with_atlas)
+    generate(pile, 'atlas.json')
+    # Both are cached now; the files on disk are from the options without an atlas
+    assert client.get('/api/geometry/lineart/atlas.json/atlas').status_code == 404
+
+    response = save_scene(client, with_atlas)
+    assert response.json == {'success': True, 'cached': True}
+    atlas = client.get('/api/geometry/lineart/atlas.json/atlas')
+    assert atlas.status_code == 200
+    assert atlas.json['scale'] == 0.5
+
+    response = save_scene(client, LINEART_OPTIONS)
+    assert response.json == {'success': True, 'cached': True}
+    assert client.get('/api/geometry/lineart/atlas.json/atlas').status_code == 404
+    assert not list((pile.GEOMETRY_DIR / 'lineart').glob('atlas.atlas*'))
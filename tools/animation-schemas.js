@@ -32,6 +32,8 @@ const ANIMATION_SCHEMAS = {
             config: {
                 acceleration: { type: 'number', default: 2.0, min: 0, step: 0.1 },
                 fallDuration: { type: 'number', default: 1.0, min: 0, step: 0.1 },
+                // Seconds for a level's rows to start falling, top first (0: all at once)
+                sweep: { type: 'number', default: 1.0, min: 0, step: 0.1 },
                 fadeIn: {
                     type: 'group',
                     fields: {
@@ -8,6 +8,9 @@ let currentConfig = {
     keyframes: []
 };
 
+// Geometry types and their extraction options, from /api/geometry-types
+let geometryTypes = {};
+
 let currentScale = 1;
 let currentX = 0;
 let currentY = 0;
@@ -37,6 +40,15 @@ export function initializeSceneConfig(ANIMATION_SCHEMAS) {
     setupImageDragAndZoom();
     populateAnimationTypes(ANIMATION_SCHEMAS);
     loadSceneList();
+    loadGeometryTypes();
+}
+
+async function loadGeometryTypes() {
+    try {
+        geometryTypes = await fetch('/api/geometry-types').then(r => r.json());
+    } catch (error) {
+        console.error('Error loading geometry types:', error);
+    }
 }
 
 function setupImageDragAndZoom() {
@@ -190,6 +202,8 @@ async function loadScene(sceneId) {
         console.log('Setting animation type to:', animationValue);
         animationSelect.value = animationValue;
         updateAnimationUI();
+        setGeometryOptions(currentScene.image.geometry?.options || {});
+        clearGeometryPreview();
         
         // Load verses
         currentConfig.verses = currentScene.text.verses || [];
@@ -231,6 +245,8 @@ function updateAnimationUI() {
     
     console.log('Updating animation UI:', { type, name, schema });
     
+    updateGeometryOptionsUI(type === 'geometry' ? schema?.processorType : null);
+    
     if (!schema) {
         configContainer.innerHTML = '';
         return;
@@ -565,6 +581,11 @@ async function saveScene() {
         }
     };
 
+    // Keep how the viewer draws the image (tiers, tiles), edited in the JSON
+    if (currentScene?.image?.derivatives) {
+        sceneData.image.derivatives = currentScene.image.derivatives;
+    }
+
     // Add animation configuration based on type
     if (animationType === 'image') {
         sceneData.image.animation = {
@@ -575,6 +596,7 @@ async function saveScene() {
         sceneData.image.geometry = {
             type: ANIMATION_SCHEMAS.geometry[animationName].processorType,
             data: `${sceneData.id}.json`,
+            options: collectGeometryOptions(),
             animation: {
                 type: animationName,
                 config: collectConfig(ANIMATION_SCHEMAS.geometry[animationName].config)
@@ -596,12 +618,198 @@ async function saveScene() {
         if (result.success) {
             loadSceneList();  // Refresh scene list
             alert('Scene saved successfully!');
+            if (result.job_id) {
+                watchGeometryJob(result.job_id);
+            }
+        } else if (result.error) {
+            alert(`Error saving scene: ${result.error}`);
         }
     } catch (error) {
         console.error('Error saving scene:', error);
     }
 }
 
+// Geometry is generated in the background; poll the job until it settles
+async function watchGeometryJob(jobId) {
+    const status = document.getElementById('geometryStatus');
+    while (true) {
+        const job = await fetch(`/api/jobs/${jobId}`).then(r => r.json());
+        const progress = job.progress || {};
+        let text = `Geometry: ${job.status}`;
+        if (job.status === 'running' && progress.levels_total) {
+            text += ` (${progress.levels_done}/${progress.levels_total} levels)`;
+        } else if (job.status === 'failed') {
+            text += ` - ${job.error}`;
+        }
+        status.textContent = text;
+        console.log('Geometry job:', job);
+
+        if (!['queued', 'running'].includes(job.status)) {
+            return job;
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+}
+
+// Geometry extraction options and previews
+function updateGeometryOptionsUI(geometryType) {
+    const container = document.getElementById('geometryOptions');
+    const options = geometryTypes[geometryType]?.options;
+    if (!geometryType) {
+        container.style.display = 'none';
+        container.innerHTML = '';
+        return;
+    }
+
+    container.style.display = 'block';
+    container.dataset.geometryType = geometryType;
+    container.innerHTML = `
+        <h4>${geometryTypes[geometryType]?.name || geometryType} Options</h4>
+        ${Object.entries(options || {}).map(([key, field]) => `
+            <div class="form-group">
+                <label for="geometryOption.${key}">${key}:</label>
+                ${field.type === 'select' ? `
+                <select id="geometryOption.${key}" data-option="${key}">
+                    ${field.choices.map(choice => `
+                        <option value="${choice}" ${choice === field.default ? 'selected' : ''}>${choice}</option>
+                    `).join('')}
+                </select>
+                ` : `
+                <input type="number"
+                       id="geometryOption.${key}"
+                       data-option="${key}"
+                       value="${field.default}"
+                       min="${field.min}"
+                       max="${field.max}"
+                       step="any">
+                `}
+            </div>
+        `).join('')}
+        <button id="previewGeometryButton">Preview Geometry</button>
+        <div id="geometryPreviewStatus"></div>
+    `;
+    document.getElementById('previewGeometryButton').addEventListener('click', previewGeometry);
+}
+
+function collectGeometryOptions() {
+    const options = {};
+    document.querySelectorAll('#geometryOptions [data-option]').forEach(input => {
+        options[input.dataset.option] = input.tagName === 'SELECT' ? input.value : parseFloat(input.value);
+    });
+    return options;
+}
+
+function setGeometryOptions(options) {
+    Object.entries(options).forEach(([key, value]) => {
+        const input = document.getElementById(`geometryOption.${key}`);
+        if (input) {
+            input.value = value;
+        }
+    });
+}
+
+// Lines of an NDJSON response body, parsed as they arrive
+async function* readNdjson(response) {
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffered = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffered += value;
+        const lines = buffered.split('\n');
+        buffered = lines.pop();
+        for (const line of lines) {
+            if (line.trim()) {
+                yield JSON.parse(line);
+            }
+        }
+    }
+    if (buffered.trim()) {
+        yield JSON.parse(buffered);
+    }
+}
+
+// Levels are streamed and drawn as each one is extracted
+async function previewGeometry() {
+    const status = document.getElementById('geometryPreviewStatus');
+    const request = {
+        image: document.getElementById('currentImage').textContent,
+        type: document.getElementById('geometryOptions').dataset.geometryType,
+        options: collectGeometryOptions()
+    };
+
+    try {
+        status.textContent = 'Extracting...';
+        const started = performance.now();
+        const response = await fetch('/api/geometry/stream', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(request)
+        });
+        if (!response.ok) {
+            status.textContent = (await response.json()).error;
+            return;
+        }
+
+        clearGeometryPreview();
+        const levels = [];
+        for await (const event of readNdjson(response)) {
+            const elapsed = Math.round(performance.now() - started);
+            if (event.event === 'level') {
+                if (event.points) {
+                    drawGeometryPreview(event);
+                } else {
+                    levels[event.level] = event.paths;
+                    drawGeometryPreview({ levels: levels.filter(Boolean) });
+                }
+                status.textContent = `Level ${event.level + 1}/${event.levels_total} in ${elapsed} ms`;
+            } else if (event.event === 'done') {
+                status.textContent = `Preview ready in ${elapsed} ms`;
+            } else if (event.event === 'error') {
+                status.textContent = `Preview ${event.status}: ${event.error || ''}`;
+            }
+        }
+    } catch (error) {
+        console.error('Error previewing geometry:', error);
+    }
+}
+
+function clearGeometryPreview() {
+    const canvas = document.getElementById('geometryPreview');
+    canvas.getContext('2d').clearRect(0, 0, canvas.width, canvas.height);
+}
+
+function drawGeometryPreview(geometry) {
+    const image = document.getElementById('previewImage');
+    const canvas = document.getElementById('geometryPreview');
+    canvas.width = image.naturalWidth;
+    canvas.height = image.naturalHeight;
+
+    const ctx = canvas.getContext('2d');
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    ctx.strokeStyle = '#ff3366';
+    ctx.fillStyle = '#ff3366';
+    ctx.lineWidth = 1;
+
+    if (geometry.levels) {
+        ctx.beginPath();
+        geometry.levels.forEach(level => {
+            level.forEach(path => {
+                const points = path.points || [path.start, path.end];
+                ctx.moveTo(points[0].x, points[0].y);
+                points.slice(1).forEach(point => ctx.lineTo(point.x, point.y));
+            });
+        });
+        ctx.stroke();
+    } else if (geometry.points) {
+        geometry.points.forEach(point => {
+            ctx.fillRect(point.x, point.y, 1, 1);
+        });
+    }
+}
+
 function collectConfig(schema, prefix = '') {
     const config = {};
     